@@ -1,6 +1,8 @@
 from django.contrib import admin
-from .models import Movie, Genre
+from .models import Movie, Genre, MovieUpload, MovieSimilarity
 
 # Register your models here.
 admin.site.register(Movie)
 admin.site.register(Genre)
+admin.site.register(MovieUpload)
+admin.site.register(MovieSimilarity)
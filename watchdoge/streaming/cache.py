@@ -0,0 +1,163 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+
+MISSING = object()
+BUILD_WAIT_INTERVAL = 0.05
+
+
+class LocalCache:
+    """
+    Small in-process LRU with a TTL per entry, for values read on nearly
+    every request (the genre list). Entries are dropped after `ttl` seconds
+    so other processes' invalidations are picked up within that time.
+    """
+
+    def __init__(self, maxsize=128, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalCache(ttl=settings.LOCAL_CACHE_TTL)
+
+
+def version_key(namespace):
+    return f"cache-version:{namespace}"
+
+
+def get_version(namespace):
+    return cache.get_or_set(version_key(namespace), 1, None)
+
+
+def bump_version(namespace):
+    """Invalidate everything cached under `namespace`, in every process."""
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.set(version_key(namespace), 2, None)
+    local_cache.clear()
+
+
+def get_or_build(namespace, key, builder, timeout=None, local=False):
+    """
+    Value of `builder()` cached under the current version of `namespace`:
+    the shared cache first, optionally fronted by the in-process LocalCache
+    (no network round trip at all while the local entry is fresh).
+    """
+    if local:
+        value = local_cache.get((namespace, key))
+        if value is not MISSING:
+            return value
+
+    version = get_version(namespace)
+    cache_key = f"{namespace}:{key}"
+    value = cache.get(cache_key, MISSING, version=version)
+    if value is MISSING:
+        value = build_once(cache_key, version, builder, timeout)
+
+    if local:
+        local_cache.set((namespace, key), value)
+    return value
+
+
+def build_once(cache_key, version, builder, timeout):
+    """
+    Stampede protection for a cold key: the first caller takes a lock
+    (cache.add) and builds, concurrent callers poll the cache for its result
+    instead of all rebuilding. If the builder takes longer than
+    CACHE_BUILD_LOCK_TIMEOUT (or died), waiters build it themselves.
+    """
+    lock_key = f"{cache_key}:lock"
+    if cache.add(lock_key, 1, settings.CACHE_BUILD_LOCK_TIMEOUT, version=version):
+        try:
+            value = builder()
+            cache.set(cache_key, value, timeout, version=version)
+            return value
+        finally:
+            cache.delete(lock_key, version=version)
+
+    deadline = time.monotonic() + settings.CACHE_BUILD_LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(BUILD_WAIT_INTERVAL)
+        value = cache.get(cache_key, MISSING, version=version)
+        if value is not MISSING:
+            return value
+    return builder()
+
+
+class Uncacheable(Exception):
+    """Raised by a page builder to hand back a response that must not be cached."""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def page_cache_key(view, args, kwargs, request, query_params):
+    parts = [view.__module__, view.__name__, repr(args), repr(sorted(kwargs.items())), str(timezone.now().year)]
+    parts += [f"{name}={request.GET.get(name, '')}" for name in query_params]
+    return hashlib.md5("|".join(parts).encode()).hexdigest()
+
+
+def cache_anonymous_page(namespace="catalog", query_params=("cursor",), timeout=None):
+    """
+    Cache the rendered page for anonymous GET requests, keyed by the view,
+    its URL arguments, the current year and `query_params` (the page cursor), under the current
+    version of `namespace` (bumped by signals whenever the data behind the
+    page changes, so a stale page is never served). Cold keys are built once
+    (build_once). Signed-in users, pending flash messages and responses that
+    set cookies are never cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != "GET" or request.user.is_authenticated or len(get_messages(request)):
+                return view(request, *args, **kwargs)
+
+            def render_page():
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.cookies or response.streaming:
+                    raise Uncacheable(response)
+                return response.content, response["Content-Type"]
+
+            key = page_cache_key(view, args, kwargs, request, query_params)
+            try:
+                content, content_type = get_or_build(
+                    namespace, f"page:{key}", render_page, timeout or settings.PAGE_CACHE_TIMEOUT
+                )
+            except Uncacheable as uncacheable:
+                return uncacheable.response
+            return HttpResponse(content, content_type=content_type)
+        return wrapper
+    return decorator
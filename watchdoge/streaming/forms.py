@@ -7,14 +7,15 @@ import os
 class MovieUploadForm(forms.ModelForm):
     class Meta:
         model = Movie
-        fields = ['title', 'description', 'file', 'poster', 'genres', 'trailerUrl', 'release_year', 'duration_minutes']
+        fields = ['title', 'description', 'file', 'poster', 'genres', 'trailerUrl', 'release_year', 'duration_minutes', 'segment_format']
         widgets = {
             'genres': forms.CheckboxSelectMultiple(),
         }
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # Restrict file chooser to videos
-        self.fields['file'].widget.attrs.update({'accept': 'video/*'})
+        if 'file' in self.fields:
+            self.fields['file'].widget.attrs.update({'accept': 'video/*'})
         # (Optional) restrict poster to images
         self.fields['poster'].widget.attrs.update({'accept': 'image/*'})
 
@@ -42,6 +43,11 @@ class MovieUploadForm(forms.ModelForm):
             raise forms.ValidationError("Duration must be between 40 and 600 minutes.")
         return duration
 
+class ChunkedMovieUploadForm(MovieUploadForm):
+    """Movie details for a source that already arrived through the resumable upload API."""
+    class Meta(MovieUploadForm.Meta):
+        fields = ['title', 'description', 'poster', 'genres', 'trailerUrl', 'release_year', 'duration_minutes', 'segment_format']
+
 class GenreForm(forms.ModelForm):
     class Meta:
         model=Genre
@@ -0,0 +1,139 @@
+import math
+import os
+import re
+
+URI_ATTRIBUTE_RE = re.compile(r'URI="([^"]*)"')
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def read_media_playlist(path):
+    """
+    Read a variant (media) playlist written by FFmpeg.
+    Returns (segments, ended) where segments is a list of
+    {'duration': float, 'uri': str, 'map': str or None} in playlist order;
+    'map' is the init segment (#EXT-X-MAP) of fMP4 playlists.
+    """
+    with open(path, encoding="utf-8") as playlist:
+        return parse_media_playlist(playlist)
+
+
+def parse_media_playlist(lines):
+    """read_media_playlist() for a playlist already in memory (any iterable of lines)."""
+    segments = []
+    duration = None
+    init_map = None
+    ended = False
+
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#EXTINF:"):
+            duration = float(line[len("#EXTINF:"):].split(",")[0])
+        elif line.startswith("#EXT-X-MAP:"):
+            init_map = URI_ATTRIBUTE_RE.search(line).group(1)
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif line and not line.startswith("#"):
+            segments.append({"duration": duration, "uri": line, "map": init_map})
+            duration = None
+
+    return segments, ended
+
+
+def write_media_playlist(path, segments, ended=True):
+    """
+    Write a media playlist: VOD when ended, otherwise an EVENT playlist that
+    players keep reloading. Each segment is a dict with 'duration', 'uri'
+    and optionally 'discontinuity' (emit #EXT-X-DISCONTINUITY before it) and
+    'map' (fMP4 init segment, an #EXT-X-MAP is emitted whenever it changes).
+    The file is replaced atomically so players never read a half-written list.
+    """
+    target_duration = max((math.ceil(s["duration"]) for s in segments), default=0)
+    # EXT-X-MAP for fMP4 segments needs protocol version 7 (as written by FFmpeg)
+    fmp4 = any(s.get("map") for s in segments)
+    lines = [
+        "#EXTM3U",
+        f"#EXT-X-VERSION:{7 if fmp4 else 3}",
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        f"#EXT-X-PLAYLIST-TYPE:{'VOD' if ended else 'EVENT'}",
+    ]
+    current_map = None
+    for segment in segments:
+        if segment.get("discontinuity"):
+            lines.append("#EXT-X-DISCONTINUITY")
+        if segment.get("map") and segment["map"] != current_map:
+            current_map = segment["map"]
+            lines.append(f'#EXT-X-MAP:URI="{current_map}"')
+        lines.append(f"#EXTINF:{segment['duration']:.6f},")
+        lines.append(segment["uri"])
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+
+    replace_playlist(path, lines)
+
+
+def finalize_media_playlist(path):
+    """
+    Turn a finished EVENT playlist written by FFmpeg into a VOD playlist:
+    PLAYLIST-TYPE becomes VOD and #EXT-X-ENDLIST is appended if missing.
+    Everything else (tags FFmpeg wrote) is kept as is.
+    """
+    with open(path, encoding="utf-8") as playlist:
+        lines = [line.rstrip("\n") for line in playlist]
+
+    lines = ["#EXT-X-PLAYLIST-TYPE:VOD" if line.startswith("#EXT-X-PLAYLIST-TYPE:") else line for line in lines]
+    while lines and not lines[-1].strip():
+        lines.pop()
+    if "#EXT-X-ENDLIST" not in lines:
+        lines.append("#EXT-X-ENDLIST")
+    replace_playlist(path, lines)
+
+
+def parse_attributes(text):
+    """'BANDWIDTH=1,CODECS="a,b"' -> {'BANDWIDTH': '1', 'CODECS': '"a,b"'} (values kept as written, quotes included)."""
+    return dict(ATTRIBUTE_RE.findall(text))
+
+
+def update_stream_inf(text, attributes):
+    """
+    A master playlist with attributes replaced (or added) on the
+    #EXT-X-STREAM-INF of each variant: `attributes` maps a variant URI to
+    {name: value}. Variants not in `attributes` are left as they are.
+    """
+    lines = text.splitlines()
+    for position, line in enumerate(lines):
+        if not line.startswith("#EXT-X-STREAM-INF:"):
+            continue
+        uri = next((later.strip() for later in lines[position + 1:] if later.strip() and not later.startswith("#")), None)
+        if uri not in attributes:
+            continue
+        values = parse_attributes(line[len("#EXT-X-STREAM-INF:"):])
+        values.update(attributes[uri])
+        lines[position] = "#EXT-X-STREAM-INF:" + ",".join(f"{name}={value}" for name, value in values.items())
+    return "\n".join(lines) + "\n"
+
+
+def replace_playlist(path, lines):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as playlist:
+        playlist.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def with_query(uri, query):
+    return f"{uri}{'&' if '?' in uri else '?'}{query}"
+
+
+def add_query_to_uris(text, query):
+    """
+    Append a query string to every URI of a playlist: segment/variant lines
+    and URI="..." attributes (EXT-X-MAP, EXT-X-KEY, EXT-X-MEDIA).
+    """
+    lines = []
+    for line in text.splitlines():
+        if line.startswith("#"):
+            line = URI_ATTRIBUTE_RE.sub(lambda match: f'URI="{with_query(match.group(1), query)}"', line)
+        elif line.strip():
+            line = with_query(line.strip(), query)
+        lines.append(line)
+    return "\n".join(lines) + "\n"
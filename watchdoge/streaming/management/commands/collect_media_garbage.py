@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from streaming.media_gc import collect_media_garbage
+
+
+class Command(BaseCommand):
+    help = "Report media disk usage and remove files and folders no Movie, MovieUpload or UserProfile refers to."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report, remove nothing.")
+        parser.add_argument(
+            "--grace-hours", type=float, default=None,
+            help=f"Keep orphans modified more recently than this (default {settings.MEDIA_GC_GRACE_SECONDS / 3600:g}).",
+        )
+        parser.add_argument("--top", type=int, default=10, help="Number of movies listed by HLS disk usage.")
+
+    def handle(self, *args, **options):
+        grace_hours = options["grace_hours"]
+        report = collect_media_garbage(
+            dry_run=options["dry_run"],
+            grace_seconds=None if grace_hours is None else grace_hours * 3600,
+            top=options["top"],
+        )
+
+        self.stdout.write(f"{'category':<18}{'entries':>9}{'size':>12}{'orphans':>9}{'orphan size':>13}{'removed':>9}")
+        for category, counters in report.categories.items():
+            self.stdout.write(
+                f"{category:<18}{counters['entries']:>9}{filesizeformat(counters['bytes']):>12}"
+                f"{counters['orphans']:>9}{filesizeformat(counters['orphan_bytes']):>13}{counters['removed']:>9}"
+            )
+        self.stdout.write(f"\nExpired uploads{' (dry run)' if options['dry_run'] else ''}: {report.expired_uploads}")
+        if report.movies():
+            self.stdout.write("\nLargest HLS outputs:")
+            for movie_id, size in report.movies():
+                self.stdout.write(f"  movie {movie_id:<10}{filesizeformat(size):>12}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"\nMedia: {filesizeformat(report.total_bytes)}, reclaimed {filesizeformat(report.removed_bytes)}"
+            f"{' (dry run)' if options['dry_run'] else ''}."
+        ))
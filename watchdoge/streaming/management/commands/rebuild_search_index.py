@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from streaming.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index (titles, descriptions, genres) for the whole catalog."
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(f"Search index rebuilt ({count} movies)."))
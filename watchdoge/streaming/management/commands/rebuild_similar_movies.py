@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from streaming.recommender import rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed similar-movies index (MovieSimilarity) for the whole catalog."
+
+    def handle(self, *args, **options):
+        count = rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Similar-movies index rebuilt ({count} rows)."))
@@ -0,0 +1,235 @@
+import functools
+import heapq
+import os
+import shutil
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from accounts.models import UserProfile
+from .models import Movie, MovieUpload
+from .storage import get_hls_storage
+
+DEFAULT_PROFILE_PICTURE = UserProfile._meta.get_field('profile_picture').default
+
+# Conversion folders of movies in these states are still being written
+CONVERTING = ('uploaded', 'processing', 'partially_ready')
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def scan_files(folder, relative_to):
+    """(media-relative name, size, mtime) of every file under `folder`, one directory at a time."""
+    try:
+        entries = os.scandir(folder)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from scan_files(entry.path, relative_to)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                yield os.path.relpath(entry.path, relative_to).replace("\\", "/"), stat.st_size, stat.st_mtime
+
+
+def folder_usage(folder):
+    """(total bytes, newest mtime) of everything under `folder`."""
+    size, newest = 0, os.stat(folder).st_mtime
+    for _, file_size, mtime in scan_files(folder, folder):
+        size += file_size
+        newest = max(newest, mtime)
+    return size, newest
+
+
+def scan_folders(folder):
+    """(name, path, bytes, newest mtime) of the sub-folders of `folder` (one per movie or upload)."""
+    try:
+        entries = os.scandir(folder)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                size, newest = folder_usage(entry.path)
+                yield entry.name, entry.path, size, newest
+
+
+def movie_ids(names):
+    return [int(name) for name in names if name.isdigit()]
+
+
+def expired_uploads(grace_seconds):
+    """Uploads that never became a movie and got no chunk for `grace_seconds`: abandoned by their client."""
+    cutoff = timezone.now() - timedelta(seconds=grace_seconds)
+    return MovieUpload.objects.filter(movie__isnull=True, updated_at__lt=cutoff)
+
+
+def referenced_uploads(names):
+    # Original uploads of unconverted movies, and uploads still in progress (expired ones are deleted first)
+    return set(Movie.objects.filter(file__in=names).values_list('file', flat=True)) | set(
+        MovieUpload.objects.filter(file_path__in=names).values_list('file_path', flat=True)
+    )
+
+
+def referenced_posters(names):
+    return set(Movie.objects.filter(poster__in=names).values_list('poster', flat=True))
+
+
+def referenced_profile_pictures(names):
+    return {DEFAULT_PROFILE_PICTURE} | set(
+        UserProfile.objects.filter(profile_picture__in=names).values_list('profile_picture', flat=True)
+    )
+
+
+def referenced_hls(names):
+    # Partial output of a failed conversion is garbage too: a new conversion starts from scratch
+    ids = Movie.objects.filter(id__in=movie_ids(names)).exclude(status__in=('failed', 'deleting'))
+    return {str(movie_id) for movie_id in ids.values_list('id', flat=True)}
+
+
+def referenced_work(names):
+    ids = Movie.objects.filter(id__in=movie_ids(names), status__in=CONVERTING)
+    return {str(movie_id) for movie_id in ids.values_list('id', flat=True)}
+
+
+def referenced_ingest(names):
+    upload_ids = []
+    for name in names:
+        try:
+            upload_ids.append(uuid.UUID(name))
+        except ValueError:
+            pass
+    return {str(upload_id) for upload_id in MovieUpload.objects.filter(id__in=upload_ids).values_list('id', flat=True)}
+
+
+def scan_bucket(storage):
+    """(name, movie id, bytes, newest upload time) of every movie prefix in the HLS bucket."""
+    for movie_id in storage.movie_ids():
+        size, newest = storage.movie_usage(movie_id)
+        yield str(movie_id), movie_id, size, newest
+
+
+# category -> (folder under MEDIA_ROOT, whole folders per movie/upload?, which names are still in use)
+CATEGORIES = {
+    'uploads': ('movies/files', False, referenced_uploads),
+    'posters': ('movies/posters', False, referenced_posters),
+    'profile_pictures': ('profile_pictures', False, referenced_profile_pictures),
+    'hls': ('movies/hls', True, referenced_hls),
+    'work': ('movies/work', True, referenced_work),
+    'ingest': ('movies/ingest', True, referenced_ingest),
+}
+# HLS output in the bucket (HLS_STORAGE_BACKEND = 's3'), one prefix per movie, same rule as 'hls'
+BUCKET_CATEGORY = 'hls_bucket'
+
+
+class MediaReport:
+    """Disk usage per category (and the biggest movies' HLS output) found by collect_media_garbage."""
+
+    COUNTERS = ('entries', 'bytes', 'orphans', 'orphan_bytes', 'removed', 'removed_bytes')
+
+    def __init__(self, top=10):
+        self.categories = {name: dict.fromkeys(self.COUNTERS, 0) for name in CATEGORIES}
+        self.top = top
+        self.expired_uploads = 0
+        self.largest_movies = []  # min-heap of (bytes, movie id), at most `top` long
+
+    def add_movie(self, movie_id, size):
+        if len(self.largest_movies) < self.top:
+            heapq.heappush(self.largest_movies, (size, movie_id))
+        elif size > self.largest_movies[0][0]:
+            heapq.heapreplace(self.largest_movies, (size, movie_id))
+
+    def movies(self):
+        """[(movie id, bytes), ...] biggest first."""
+        return [(movie_id, size) for size, movie_id in sorted(self.largest_movies, reverse=True)]
+
+    @property
+    def total_bytes(self):
+        return sum(counters['bytes'] for counters in self.categories.values())
+
+    @property
+    def removed_bytes(self):
+        return sum(counters['removed_bytes'] for counters in self.categories.values())
+
+
+def remove(path, is_folder):
+    try:
+        if is_folder:
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def collect_media_garbage(dry_run=False, grace_seconds=None, top=10):
+    """
+    Walk MEDIA_ROOT category by category with os.scandir and reconcile what
+    is on disk with the Movie, MovieUpload and UserProfile rows,
+    MEDIA_GC_CHUNK_SIZE entries per query, so neither the tree nor a table is
+    ever held in memory. Entries no row refers to and untouched for
+    `grace_seconds` (MEDIA_GC_GRACE_SECONDS) are removed unless `dry_run`.
+    Incomplete uploads idle for as long are deleted first, so their file and
+    ingest folder are collected in the same run (a dry run only counts them).
+    With object storage, the movie prefixes in the bucket are reconciled too.
+    Returns a MediaReport.
+    """
+    if grace_seconds is None:
+        grace_seconds = settings.MEDIA_GC_GRACE_SECONDS
+    cutoff = time.time() - grace_seconds
+    report = MediaReport(top)
+
+    expired = expired_uploads(grace_seconds)
+    if dry_run:
+        report.expired_uploads = expired.count()
+    else:
+        report.expired_uploads = expired.delete()[1].get(MovieUpload._meta.label, 0)
+
+    for category, (folder, per_folder, referenced) in CATEGORIES.items():
+        root = os.path.join(settings.MEDIA_ROOT, folder)
+        if per_folder:
+            entries = scan_folders(root)
+        else:
+            entries = (
+                (name, os.path.join(settings.MEDIA_ROOT, name), size, mtime)
+                for name, size, mtime in scan_files(root, settings.MEDIA_ROOT)
+            )
+        delete = functools.partial(remove, is_folder=per_folder)
+        collect_category(report, category, entries, referenced, delete, cutoff, dry_run)
+
+    storage = get_hls_storage()
+    if not storage.is_local:
+        report.categories[BUCKET_CATEGORY] = dict.fromkeys(MediaReport.COUNTERS, 0)
+        collect_category(report, BUCKET_CATEGORY, scan_bucket(storage), referenced_hls, storage.clear, cutoff, dry_run)
+    return report
+
+
+def collect_category(report, category, entries, referenced, delete, cutoff, dry_run):
+    """Count the (name, path, bytes, mtime) entries of a category and delete(path) its orphans past `cutoff`."""
+    counters = report.categories[category]
+    for chunk in chunked(entries, settings.MEDIA_GC_CHUNK_SIZE):
+        in_use = referenced([name for name, _, _, _ in chunk])
+        for name, path, size, mtime in chunk:
+            counters['entries'] += 1
+            counters['bytes'] += size
+            if category in ('hls', BUCKET_CATEGORY) and name.isdigit():
+                report.add_movie(int(name), size)
+            if name in in_use:
+                continue
+            counters['orphans'] += 1
+            counters['orphan_bytes'] += size
+            if mtime < cutoff and not dry_run:
+                delete(path)
+                counters['removed'] += 1
+                counters['removed_bytes'] += size
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0011_movieupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movieupload',
+            name='ingest_status',
+            field=models.CharField(blank=True, choices=[('', 'Not started'), ('skipped', 'Skipped'), ('running', 'Running'), ('finished', 'Finished'), ('failed', 'Failed')], max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0012_movieupload_ingest_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='status',
+            field=models.CharField(choices=[('uploaded', 'Uploaded'), ('processing', 'Processing'), ('partially_ready', 'Partially ready'), ('ready', 'Ready'), ('failed', 'Failed')], default='uploaded', max_length=20),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0013_movie_partially_ready_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='segment_format',
+            field=models.CharField(blank=True, choices=[('mpegts', 'MPEG-TS (.ts)'), ('fmp4', 'fMP4 / CMAF (.m4s)')], help_text='Leave empty for the site default.', max_length=10),
+        ),
+    ]
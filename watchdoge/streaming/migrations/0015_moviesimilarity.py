@@ -0,0 +1,30 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0014_movie_segment_format'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MovieSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='streaming.movie')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='streaming.movie')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['movie', '-score'], name='movie_similarity_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='moviesimilarity',
+            constraint=models.UniqueConstraint(fields=('movie', 'similar'), name='unique_movie_similarity'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+from django.db import migrations
+
+SQLITE_CREATE = [
+    """
+    CREATE VIRTUAL TABLE streaming_movie_search USING fts5(
+        title, description, genres,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    """
+    INSERT INTO streaming_movie_search (rowid, title, description, genres)
+    SELECT m.id, m.title, m.description, COALESCE(GROUP_CONCAT(g.name, ' '), '')
+    FROM streaming_movie m
+    LEFT JOIN streaming_movie_genres mg ON mg.movie_id = m.id
+    LEFT JOIN streaming_genre g ON g.id = mg.genre_id
+    GROUP BY m.id
+    """,
+]
+
+POSTGRES_CREATE = [
+    """
+    CREATE TABLE streaming_movie_search (
+        movie_id bigint PRIMARY KEY REFERENCES streaming_movie (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+        document tsvector NOT NULL
+    )
+    """,
+    "CREATE INDEX streaming_movie_search_document_idx ON streaming_movie_search USING GIN (document)",
+    """
+    INSERT INTO streaming_movie_search (movie_id, document)
+    SELECT m.id,
+           setweight(to_tsvector('simple', m.title), 'A')
+           || setweight(to_tsvector('simple', m.description), 'C')
+           || setweight(to_tsvector('simple', COALESCE(STRING_AGG(g.name, ' '), '')), 'B')
+    FROM streaming_movie m
+    LEFT JOIN streaming_movie_genres mg ON mg.movie_id = m.id
+    LEFT JOIN streaming_genre g ON g.id = mg.genre_id
+    GROUP BY m.id
+    """,
+]
+
+CREATE = {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRES_CREATE}
+
+
+def create_search_index(apps, schema_editor):
+    # Other databases have no search table; streaming/search.py falls back to icontains
+    for statement in CREATE.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute("DROP TABLE streaming_movie_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0015_moviesimilarity'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
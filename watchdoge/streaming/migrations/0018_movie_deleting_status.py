@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0017_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movie',
+            name='status',
+            field=models.CharField(choices=[('uploaded', 'Uploaded'), ('processing', 'Processing'), ('partially_ready', 'Partially ready'), ('ready', 'Ready'), ('failed', 'Failed'), ('deleting', 'Deleting')], default='uploaded', max_length=20),
+        ),
+    ]
@@ -1,8 +1,12 @@
 from django.db import models
+from django.conf import settings
 from django.utils import timezone
 from django.core.validators import FileExtensionValidator, MinValueValidator,MaxValueValidator
 from django.utils.text import slugify
+from django.db.models.functions import Lower
+from django.urls import reverse
 import datetime
+import uuid
 from .utils import delete_old_file,movie_file_upload_path,poster_upload_path
 import os
 
@@ -22,12 +26,53 @@ class Genre(models.Model):
         return self.name
     
 
+class MovieQuerySet(models.QuerySet):
+    # Everything a movie card, list row or player link needs; description and
+    # the probe/file columns stay in the database
+    CATALOG_FIELDS = ('id', 'title', 'poster', 'release_year', 'status', 'hls_path', 'upload_date')
+
+    def live(self):
+        """Movies not queued for deletion (see streaming.tasks.delete_movie)."""
+        return self.exclude(status='deleting')
+
+    def playable(self):
+        """Movies viewers can start watching (see Movie.is_playable)."""
+        return self.filter(status__in=('ready', 'partially_ready'))
+
+    def catalog(self):
+        """Movies for list pages: card columns only, genres prefetched in one query."""
+        return self.live().only(*self.CATALOG_FIELDS).prefetch_related(catalog_genres())
+
+
+def catalog_genres(relation='genres'):
+    return models.Prefetch(relation, queryset=Genre.objects.only('id', 'name'))
+
+
+def select_catalog_movie(queryset, *fields, relation='movie'):
+    """
+    Rows of another model (history, watchlist, recommendations...) with their
+    movie joined in, catalog columns only, and its genres prefetched: two
+    queries whatever the number of rows. `fields` are the row's own columns
+    (and other relations) the page reads.
+    """
+    return queryset.select_related(relation).only(
+        *fields, relation, *(f'{relation}__{field}' for field in MovieQuerySet.CATALOG_FIELDS)
+    ).prefetch_related(catalog_genres(f'{relation}__genres'))
+
+
 class Movie(models.Model):
     STATUS_CHOICES = [
         ('uploaded', 'Uploaded'),      # Just uploaded, waiting for conversion
         ('processing', 'Processing'),  # Conversion in progress
+        ('partially_ready', 'Partially ready'),  # Still converting, first segments playable
         ('ready', 'Ready'),            # HLS conversion done
         ('failed', 'Failed'),          # Conversion failed
+        ('deleting', 'Deleting'),      # Hidden, row and files being removed by Celery
+    ]
+
+    SEGMENT_FORMAT_CHOICES = [
+        ('mpegts', 'MPEG-TS (.ts)'),
+        ('fmp4', 'fMP4 / CMAF (.m4s)'),  # Smaller, same segments usable for DASH
     ]
 
     title = models.CharField(max_length=200)
@@ -41,9 +86,17 @@ class Movie(models.Model):
         null=True
     )
 
-    # Path to HLS folder/index.m3u8
+    # Path to HLS folder/master.m3u8 (adaptive bitrate master playlist)
     hls_path = models.CharField(max_length=255, blank=True, null=True)
 
+    # HLS segment packaging; empty uses settings.HLS_SEGMENT_TYPE, set to what was produced once converted
+    segment_format = models.CharField(
+        max_length=10,
+        choices=SEGMENT_FORMAT_CHOICES,
+        blank=True,
+        help_text='Leave empty for the site default.'
+    )
+
     poster = models.ImageField(
         upload_to=poster_upload_path,
         validators=[FileExtensionValidator(allowed_extensions=['jpg','jpeg','png'])],
@@ -67,16 +120,41 @@ class Movie(models.Model):
     )
 
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploaded')
+
+    # Source analysis (filled by ffprobe before conversion)
+    video_codec = models.CharField(max_length=20, blank=True)
+    video_profile = models.CharField(max_length=40, blank=True)
+    audio_codec = models.CharField(max_length=20, blank=True)
+    width = models.PositiveIntegerField(blank=True, null=True)
+    height = models.PositiveIntegerField(blank=True, null=True)
+    source_bitrate = models.PositiveIntegerField(blank=True, null=True)  # bits per second
+    source_duration = models.FloatField(blank=True, null=True)  # seconds
+    keyframe_interval = models.FloatField(blank=True, null=True)  # longest gap between keyframes, seconds
+
     upload_date = models.DateTimeField(default=timezone.now)
 
+    objects = MovieQuerySet.as_manager()
+
+    class Meta:
+        # Sort keys of the keyset-paginated lists (streaming/pagination.py)
+        indexes = [
+            models.Index(fields=['title', 'id'], name='movie_title_key_idx'),
+            models.Index(Lower('title'), 'id', name='movie_lower_title_key_idx'),
+            models.Index(fields=['-upload_date', '-id'], name='movie_upload_date_key_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
+    @property
+    def is_playable(self):
+        return self.status in ('ready', 'partially_ready')
+
     @property
     def hls_url(self):
-        """Return URL to HLS index.m3u8 if ready"""
-        if self.status == 'ready' and self.hls_path:
-            return '/' + self.hls_path  # assuming MEDIA_URL serves 'media/' root
+        """Return URL to the HLS master.m3u8 if playable (ready or partially ready)"""
+        if self.is_playable and self.hls_path:
+            return reverse('hls-file', args=[self.id, os.path.basename(self.hls_path)])
         return None
 
     def save(self, *args, **kwargs):
@@ -100,3 +178,62 @@ class Movie(models.Model):
 
 
         super().save(*args, **kwargs)
+
+
+class MovieUpload(models.Model):
+    """
+    A resumable upload of a movie source file.
+    Chunks are appended straight into file_path (movies/files/<uuid>.<ext>);
+    the Movie is only created once every byte arrived and the checksum matches.
+    Fast-start sources can already be encoded while they upload (streaming ingest).
+    """
+    INGEST_CHOICES = [
+        ('', 'Not started'),        # Not enough bytes yet to tell
+        ('skipped', 'Skipped'),     # Source cannot be read before it is complete
+        ('running', 'Running'),     # FFmpeg is following the growing file
+        ('finished', 'Finished'),   # HLS output waiting in the staging folder
+        ('failed', 'Failed'),       # Fall back to the normal conversion
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+
+    # Running hash over the verified chunks: sha256(previous + sha256(chunk)), hex
+    checksum = models.CharField(max_length=64, blank=True)
+
+    movie = models.OneToOneField(Movie, on_delete=models.SET_NULL, blank=True, null=True)
+    ingest_status = models.CharField(max_length=10, choices=INGEST_CHOICES, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+    @property
+    def is_complete(self):
+        return self.offset == self.size
+
+
+class MovieSimilarity(models.Model):
+    """
+    Precomputed "similar movies" index: the top neighbours of every movie,
+    maintained by Celery (see streaming/similarity.py) so a lookup is one indexed query.
+    """
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='similarities')
+    similar = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='similar_to')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['movie', 'similar'], name='unique_movie_similarity'),
+        ]
+        indexes = [
+            models.Index(fields=['movie', '-score'], name='movie_similarity_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.movie_id} -> {self.similar_id} ({self.score:.3f})"
@@ -0,0 +1,201 @@
+import binascii
+import datetime
+import json
+from functools import cached_property
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+CURSOR_PARAM = "cursor"
+APPROXIMATE_COUNT_LIMIT = 1000
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps microseconds (DjangoJSONEncoder rounds datetimes to milliseconds, which breaks keys)."""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values, direction, start):
+    payload = json.dumps({"v": values, "d": direction, "i": start}, cls=CursorEncoder, separators=(",", ":"))
+    return urlsafe_base64_encode(payload.encode())
+
+
+def decode_cursor(cursor):
+    """(values, direction, start index) or None for a missing or mangled cursor."""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(urlsafe_base64_decode(cursor))
+        return list(payload["v"]), payload["d"], int(payload["i"])
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None
+
+
+class KeysetPage:
+    """Same surface the templates used from Django's Page, minus page numbers."""
+
+    def __init__(self, paginator, object_list, start, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.start = start
+        self.has_next_page = has_next
+        self.has_previous_page = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.has_next_page
+
+    def has_previous(self):
+        return self.has_previous_page
+
+    def has_other_pages(self):
+        return self.has_next_page or self.has_previous_page
+
+    def start_index(self):
+        return self.start + 1 if self.object_list else 0
+
+    def end_index(self):
+        return self.start + len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next_page:
+            return None
+        return encode_cursor(self.paginator.key_of(self.object_list[-1]), "n", self.start + len(self.object_list))
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous_page:
+            return None
+        return encode_cursor(self.paginator.key_of(self.object_list[0]), "p", self.start)
+
+    def next_querystring(self):
+        return self.paginator.querystring(self.next_cursor)
+
+    def previous_querystring(self):
+        return self.paginator.querystring(self.previous_cursor)
+
+    @cached_property
+    def approximate_count(self):
+        return self.paginator.approximate_count
+
+
+class KeysetPaginator:
+    """
+    Cursor (keyset) pagination: a page is "the next per_page rows after this
+    sort key", i.e. WHERE (title, id) > (last title, last id) ORDER BY title,
+    id LIMIT per_page + 1. It uses the same index as page one however deep the
+    user goes, and needs no COUNT(*).
+
+    The ordering comes from the queryset's order_by() (plain field or
+    annotation names); the primary key is appended as the tie-breaker so keys
+    are unique. Cursors are opaque base64 tokens carrying the boundary key,
+    the direction and the row offset (for numbering only).
+    """
+
+    def __init__(self, queryset, per_page, params=None):
+        self.per_page = per_page
+        self.params = params.copy() if params is not None else QueryDict(mutable=True)
+
+        ordering = [
+            field for field in queryset.query.order_by or queryset.model._meta.ordering if isinstance(field, str)
+        ]
+        if not ordering or ordering[-1].lstrip("-") not in ("id", "pk"):
+            ordering.append("-pk" if ordering and ordering[0].startswith("-") else "pk")
+        self.ordering = [(field.lstrip("-"), field.startswith("-")) for field in ordering]
+        self.queryset = queryset.order_by(*ordering)
+
+    def order_field(self, name):
+        """Model field or annotation output field behind an ordering name (None for lookups across relations)."""
+        if name in self.queryset.query.annotations:
+            return self.queryset.query.annotations[name].output_field
+        meta = self.queryset.model._meta
+        try:
+            return meta.pk if name == "pk" else meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+
+    def decode(self, cursor):
+        """
+        decode_cursor() with every key value converted by its ordering field:
+        cursors come from the query string, so a value of the wrong type gives
+        None (back to the first page) instead of an error when filtering.
+        """
+        decoded = decode_cursor(cursor)
+        if decoded is None or len(decoded[0]) != len(self.ordering):
+            return None
+        values, direction, start = decoded
+        try:
+            for position, (name, _) in enumerate(self.ordering):
+                field = self.order_field(name)
+                if field is not None:
+                    values[position] = field.to_python(values[position])
+        except (ValidationError, ValueError, TypeError):
+            return None
+        return values, direction, start
+
+    def key_of(self, item):
+        return [getattr(item, "pk" if name == "pk" else name) for name, _ in self.ordering]
+
+    def after(self, values, backwards):
+        """Rows strictly after (or, going backwards, before) the key `values`."""
+        condition = Q()
+        for position, (name, descending) in enumerate(self.ordering):
+            term = Q(**{f"{name}__{'lt' if descending != backwards else 'gt'}": values[position]})
+            for (previous, _), value in zip(self.ordering[:position], values):
+                term &= Q(**{previous: value})
+            condition |= term
+        # Redundant bound on the leading key: lets the database range-scan the
+        # sort index instead of evaluating the OR on every row
+        name, descending = self.ordering[0]
+        return Q(**{f"{name}__{'lte' if descending != backwards else 'gte'}": values[0]}) & condition
+
+    def get_page(self, cursor=None):
+        if cursor is None:
+            cursor = self.params.get(CURSOR_PARAM)
+        decoded = self.decode(cursor)
+        if decoded is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            return KeysetPage(self, rows[:self.per_page], 0, len(rows) > self.per_page, False)
+
+        values, direction, start = decoded
+        if direction == "p":
+            reverse = [f"{'' if descending else '-'}{name}" for name, descending in self.ordering]
+            rows = list(self.queryset.filter(self.after(values, True)).order_by(*reverse)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(self, rows, max(start - len(rows), 0), True, has_previous)
+
+        rows = list(self.queryset.filter(self.after(values, False))[:self.per_page + 1])
+        return KeysetPage(self, rows[:self.per_page], start, len(rows) > self.per_page, True)
+
+    def querystring(self, cursor):
+        """The current query string (search terms, filters) with `cursor` swapped in."""
+        params = self.params.copy()
+        params.pop(CURSOR_PARAM, None)
+        if cursor is not None:
+            params[CURSOR_PARAM] = cursor
+        return params.urlencode()
+
+    @cached_property
+    def approximate_count(self):
+        """
+        Number of rows, counted up to APPROXIMATE_COUNT_LIMIT only (the
+        template shows "1000+" beyond), so it stays cheap on big results.
+        """
+        count = self.queryset.order_by()[:APPROXIMATE_COUNT_LIMIT + 1].count()
+        return f"{APPROXIMATE_COUNT_LIMIT}+" if count > APPROXIMATE_COUNT_LIMIT else str(count)
@@ -0,0 +1,127 @@
+import subprocess
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+PROGRESS_TTL = 60 * 60 * 24
+
+
+def progress_key(movie_id, part=None):
+    key = f"streaming:progress:{movie_id}"
+    return key if part is None else f"{key}:{part}"
+
+
+def parse_speed(value):
+    """FFmpeg reports speed as e.g. '1.53x' (or 'N/A' while starting)."""
+    try:
+        return float(value.rstrip("x"))
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+def parse_out_time(stats):
+    """Encoded media time in seconds from a -progress block (out_time_us is in microseconds)."""
+    for key in ("out_time_us", "out_time_ms"):
+        try:
+            return max(int(stats[key]), 0) / 1_000_000
+        except (KeyError, ValueError):
+            continue
+    return 0.0
+
+
+class ProgressReporter:
+    """
+    Publishes conversion progress for one movie (or one chunk of it) at most
+    every HLS_PROGRESS_INTERVAL seconds, to the cache and to the Celery task state.
+    """
+
+    def __init__(self, movie_id, duration, task=None, part=None):
+        self.movie_id = movie_id
+        self.duration = duration or 0
+        self.task = task
+        self.part = part
+        self.last_report = 0
+
+    def update(self, stats, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < settings.HLS_PROGRESS_INTERVAL:
+            return
+        self.last_report = now
+
+        out_time = parse_out_time(stats)
+        speed = parse_speed(stats.get("speed"))
+        self.publish(out_time, speed, finished=stats.get("progress") == "end")
+
+    def publish(self, out_time, speed, finished=False):
+        out_time = self.duration if finished else min(out_time, self.duration)
+        record = {
+            "out_time": out_time,
+            "duration": self.duration,
+            "speed": speed,
+            "percent": round(100 * out_time / self.duration, 1) if self.duration else 0.0,
+            "eta": round((self.duration - out_time) / speed) if speed else None,
+            "finished": finished,
+            "updated": time.time(),
+        }
+        cache.set(progress_key(self.movie_id, self.part), record, PROGRESS_TTL)
+        if self.task is not None and self.task.request.id:
+            self.task.update_state(state="PROGRESS", meta=record)
+
+    def finish(self):
+        self.publish(self.duration, 0.0, finished=True)
+
+
+def start_chunked_progress(movie_id, duration, parts):
+    """Register a chunked conversion so get_progress() knows to sum its parts."""
+    cache.set(progress_key(movie_id), {"duration": duration, "parts": parts}, PROGRESS_TTL)
+
+
+def get_progress(movie_id):
+    """
+    Current progress of a movie conversion, or None if nothing was reported yet.
+    Chunked conversions are summed over their parts: encoded seconds add up and
+    so do the speeds of the chunks still running on the workers.
+    """
+    record = cache.get(progress_key(movie_id))
+    if not record or "parts" not in record:
+        return record
+
+    parts = cache.get_many([progress_key(movie_id, part) for part in range(record["parts"])]).values()
+    duration = record["duration"]
+    out_time = min(sum(part["out_time"] for part in parts), duration)
+    speed = sum(part["speed"] for part in parts if not part["finished"])
+
+    return {
+        "out_time": out_time,
+        "duration": duration,
+        "speed": round(speed, 2),
+        "percent": round(100 * out_time / duration, 1) if duration else 0.0,
+        "eta": round((duration - out_time) / speed) if speed else None,
+        "finished": bool(parts) and len(parts) == record["parts"] and all(part["finished"] for part in parts),
+        "updated": max((part["updated"] for part in parts), default=None),
+    }
+
+
+def run_ffmpeg(cmd, movie_id, duration, task=None, part=None, on_progress=None):
+    """
+    Run an FFmpeg command with -progress on stdout, publishing throttled progress.
+    on_progress(stats) is called after every progress block (about twice a second).
+    Raises CalledProcessError like subprocess.run(check=True) on failure.
+    """
+    cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats"] + cmd[1:]
+    reporter = ProgressReporter(movie_id, duration, task=task, part=part)
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as process:
+        stats = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition("=")
+            stats[key] = value
+            # Every progress block ends with progress=continue|end
+            if key == "progress":
+                reporter.update(stats)
+                if on_progress is not None:
+                    on_progress(stats)
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    reporter.finish()
@@ -0,0 +1,158 @@
+from itertools import islice
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import normalize
+from django.conf import settings
+from django.db import connection, transaction
+from .models import Movie, MovieSimilarity
+
+
+def load_catalog():
+    """ids, titles, descriptions and genre ids of every movie, in two queries."""
+    ids, titles, descriptions = [], [], []
+    for movie_id, title, description in Movie.objects.order_by('id').values_list('id', 'title', 'description'):
+        ids.append(movie_id)
+        titles.append(title or '')
+        descriptions.append(description or '')
+
+    genres = {}
+    for movie_id, genre_id in Movie.genres.through.objects.values_list('movie_id', 'genre_id'):
+        genres.setdefault(movie_id, []).append(genre_id)
+    return ids, titles, descriptions, genres
+
+
+def tfidf_block(documents, **options):
+    try:
+        return TfidfVectorizer(sublinear_tf=True, dtype=np.float32, **options).fit_transform(documents)
+    except ValueError:
+        # Empty vocabulary (no usable text at all): this block contributes nothing
+        return sparse.csr_matrix((len(documents), 0), dtype=np.float32)
+
+
+def genre_block(ids, genres):
+    row_of = {movie_id: row for row, movie_id in enumerate(ids)}
+    columns = {genre_id: column for column, genre_id in enumerate(sorted({g for gs in genres.values() for g in gs}))}
+    rows, cols = [], []
+    for movie_id, genre_ids in genres.items():
+        if movie_id in row_of:
+            for genre_id in genre_ids:
+                rows.append(row_of[movie_id])
+                cols.append(columns[genre_id])
+    data = np.ones(len(rows), dtype=np.float32)
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(ids), len(columns)))
+
+
+def build_feature_matrix():
+    """
+    (movie ids, CSR matrix with one feature row per movie).
+
+    A row is TF-IDF over title character n-grams (close titles, sequels),
+    TF-IDF over description words and a one-hot genre block. Each block is
+    L2-normalised and scaled by the square root of its RECOMMENDER_WEIGHTS
+    entry, so the dot product of two rows is the weighted sum of the per-block
+    cosine similarities.
+    """
+    ids, titles, descriptions, genres = load_catalog()
+    weights = settings.RECOMMENDER_WEIGHTS
+
+    blocks = [
+        (tfidf_block(titles, analyzer='char_wb', ngram_range=(3, 4)), weights['title']),
+        (tfidf_block(descriptions, stop_words='english', max_features=settings.RECOMMENDER_MAX_TERMS), weights['description']),
+        (genre_block(ids, genres), weights['genres']),
+    ]
+    # Blocks without any feature yet (e.g. no genres assigned) are left out
+    matrix = sparse.hstack(
+        [sparse.csr_matrix((len(ids), 0), dtype=np.float32)]
+        + [normalize(block) * np.float32(np.sqrt(weight)) for block, weight in blocks if block.shape[1]],
+        format='csr',
+    )
+    return ids, matrix
+
+
+def build_embeddings():
+    """
+    (movie ids, dense float32 array with one unit-length embedding per movie).
+
+    The sparse features are reduced to RECOMMENDER_EMBEDDING_DIM dimensions with
+    a truncated SVD (latent semantic analysis), so catalog-wide similarities are
+    dense BLAS matrix products instead of sparse x sparse products whose result
+    is almost dense anyway. Small catalogs skip the reduction.
+    """
+    ids, matrix = build_feature_matrix()
+    if not matrix.shape[0] or not matrix.shape[1]:
+        # No movies, or no text nor genres at all: nothing is similar to anything
+        return ids, np.zeros(matrix.shape, dtype=np.float32)
+    dim = settings.RECOMMENDER_EMBEDDING_DIM
+    if min(matrix.shape) <= dim:
+        embeddings = matrix.toarray()
+    else:
+        embeddings = TruncatedSVD(n_components=dim, random_state=0).fit_transform(matrix)
+    return ids, normalize(embeddings).astype(np.float32, copy=False)
+
+
+def top_k(rows, matrix, k, exclude=None):
+    """
+    Top-k most similar columns for a block of rows: (indices, scores), both
+    rows x k and sorted best first. `exclude` gives, per row, a column to skip
+    (the movie itself).
+    """
+    scores = rows @ matrix.T
+    if exclude is not None:
+        scores[np.arange(len(exclude)), exclude] = -np.inf
+
+    k = min(k, scores.shape[1] - 1 if exclude is not None else scores.shape[1])
+    if k <= 0:
+        empty = np.empty((scores.shape[0], 0))
+        return empty.astype(int), empty
+    indices = np.argpartition(scores, -k, axis=1)[:, -k:]
+    best = np.take_along_axis(scores, indices, axis=1)
+    order = np.argsort(-best, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(best, order, axis=1)
+
+
+def neighbour_rows(ids, matrix, row_indices, k):
+    """
+    (movie id, similar id, score) tuples for the given matrix rows, computed in
+    batches of RECOMMENDER_BATCH_SIZE rows so memory stays at batch size x catalog floats.
+    """
+    ids = np.asarray(ids)
+    batch_size = settings.RECOMMENDER_BATCH_SIZE
+    for start in range(0, len(row_indices), batch_size):
+        batch = np.asarray(row_indices[start:start + batch_size])
+        indices, scores = top_k(matrix[batch], matrix, k, exclude=batch)
+        keep = scores > 0
+        movie_ids = np.repeat(ids[batch], indices.shape[1]).reshape(indices.shape)
+        yield from zip(movie_ids[keep].tolist(), ids[indices[keep]].tolist(), scores[keep].tolist())
+
+
+def insert_rows(model, fields, rows, batch_size=10000):
+    """
+    Write plain tuples (one value per field) with executemany: full index
+    rebuilds write far too many rows to build model instances for.
+    """
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    columns = ", ".join(quote(model._meta.get_field(name).column) for name in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while batch := list(islice(rows, batch_size)):
+            cursor.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", batch)
+
+
+def insert_similarities(rows):
+    """Write (movie id, similar id, score) tuples."""
+    insert_rows(MovieSimilarity, ("movie", "similar", "score"), rows)
+
+
+def rebuild_index():
+    """Recompute the neighbours of the whole catalog and replace the index."""
+    ids, matrix = build_embeddings()
+    rows = list(neighbour_rows(ids, matrix, range(len(ids)), settings.SIMILAR_MOVIES_INDEX_SIZE))
+
+    with transaction.atomic():
+        MovieSimilarity.objects.all().delete()
+        insert_similarities(rows)
+    return len(rows)
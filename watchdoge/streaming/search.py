@@ -0,0 +1,178 @@
+import re
+from django.db import connection, transaction
+from django.db.models import Exists, FloatField, OuterRef, Q
+from django.db.models.expressions import RawSQL
+from .models import Movie
+
+SEARCH_TABLE = "streaming_movie_search"
+SEARCH_BATCH_SIZE = 1000
+MAX_QUERY_TERMS = 8
+MIN_DESCRIPTION_PREFIX = 3
+
+TERM_RE = re.compile(r"\w+")
+
+
+def query_terms(query):
+    """Lowercased words of a search box query; every other character is dropped."""
+    return TERM_RE.findall((query or "").lower())[:MAX_QUERY_TERMS]
+
+
+class SQLiteSearchIndex:
+    """
+    FTS5 virtual table (title, description, genres) keyed by the movie id as
+    rowid, with prefix indexes so "star wa" style queries stay index lookups.
+    Ranked with bm25, title matches weighing most.
+    """
+
+    def match(self, terms):
+        # "term"* = prefix query; terms are \w+ only so they never need escaping.
+        # Very short prefixes match half the descriptions, so they only look at titles.
+        return " ".join(
+            f'"{term}"*' if len(term) >= MIN_DESCRIPTION_PREFIX else f'title : "{term}"*' for term in terms
+        )
+
+    def search(self, queryset, terms):
+        # rank is an annotation (not an extra select) so keyset pagination can filter on it
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[f"{SEARCH_TABLE}.rowid = streaming_movie.id", f"{SEARCH_TABLE} MATCH %s"],
+            params=[self.match(terms)],
+        ).annotate(
+            rank=RawSQL(f"bm25({SEARCH_TABLE}, 10.0, 1.0, 3.0)", (), output_field=FloatField())
+        ).order_by("rank", "title", "id")
+
+    def upsert(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, title, description, genres) VALUES (%s, %s, %s, %s)", rows
+            )
+
+    def delete(self, movie_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(movie_id,) for movie_id in movie_ids])
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+
+class PostgresSearchIndex:
+    """
+    Side table of weighted tsvectors (title A, genres B, description C) with a
+    GIN index; the same document SearchVector would build, stored so queries
+    never recompute it. Rows go with the movie (ON DELETE CASCADE).
+    """
+
+    def match(self, terms):
+        # term:* = prefix query, term:*A = prefix query on the title weight only
+        return " & ".join(f"{term}:*" if len(term) >= MIN_DESCRIPTION_PREFIX else f"{term}:*A" for term in terms)
+
+    def search(self, queryset, terms):
+        return queryset.extra(
+            tables=[SEARCH_TABLE],
+            where=[f"{SEARCH_TABLE}.movie_id = streaming_movie.id", f"{SEARCH_TABLE}.document @@ to_tsquery('simple', %s)"],
+            params=[self.match(terms)],
+        ).annotate(
+            rank=RawSQL(
+                f"ts_rank({SEARCH_TABLE}.document, to_tsquery('simple', %s))", (self.match(terms),), output_field=FloatField()
+            )
+        ).order_by("-rank", "title", "id")
+
+    def upsert(self, rows):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"""
+                INSERT INTO {SEARCH_TABLE} (movie_id, document)
+                VALUES (%s, setweight(to_tsvector('simple', %s), 'A')
+                         || setweight(to_tsvector('simple', %s), 'C')
+                         || setweight(to_tsvector('simple', %s), 'B'))
+                ON CONFLICT (movie_id) DO UPDATE SET document = EXCLUDED.document
+                """,
+                rows,
+            )
+
+    def delete(self, movie_ids):
+        pass
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {SEARCH_TABLE}")
+
+
+class FallbackSearchIndex:
+    """Other databases: unindexed substring match, as before."""
+
+    def search(self, queryset, terms):
+        condition = Q()
+        for term in terms:
+            condition &= Q(title__icontains=term) | Q(description__icontains=term)
+        return queryset.filter(condition).order_by("title", "id")
+
+    def upsert(self, rows):
+        pass
+
+    def delete(self, movie_ids):
+        pass
+
+    def clear(self):
+        pass
+
+
+SEARCH_INDEXES = {
+    "sqlite": SQLiteSearchIndex,
+    "postgresql": PostgresSearchIndex,
+}
+
+
+def get_search_index():
+    return SEARCH_INDEXES.get(connection.vendor, FallbackSearchIndex)()
+
+
+def search_movies(queryset, query):
+    """
+    Movies matching every word of `query` (each as a prefix), best match first.
+    One indexed query; filters already on `queryset` are kept.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return queryset.none()
+    return get_search_index().search(queryset, terms)
+
+
+def filter_by_genres(queryset, genre_ids):
+    """Movies in any of the genres, as an EXISTS in the same query (no join, no DISTINCT)."""
+    return queryset.filter(
+        Exists(Movie.genres.through.objects.filter(movie_id=OuterRef("pk"), genre_id__in=genre_ids))
+    )
+
+
+def index_movies(movie_ids):
+    """(Re)index the given movies: title, description and genre names."""
+    movie_ids = list(movie_ids)
+    genres = {}
+    for movie_id, name in (
+        Movie.genres.through.objects.filter(movie_id__in=movie_ids).values_list("movie_id", "genre__name")
+    ):
+        genres.setdefault(movie_id, []).append(name)
+
+    rows = [
+        (movie_id, title, description or "", " ".join(genres.get(movie_id, ())))
+        for movie_id, title, description in Movie.objects.filter(id__in=movie_ids).values_list("id", "title", "description")
+    ]
+    if rows:
+        get_search_index().upsert(rows)
+
+
+def unindex_movies(movie_ids):
+    get_search_index().delete(list(movie_ids))
+
+
+def rebuild_search_index():
+    """Reindex the whole catalog in batches; returns the number of movies."""
+    movie_ids = list(Movie.objects.order_by("id").values_list("id", flat=True))
+    with transaction.atomic():
+        get_search_index().clear()
+        for start in range(0, len(movie_ids), SEARCH_BATCH_SIZE):
+            index_movies(movie_ids[start:start + SEARCH_BATCH_SIZE])
+    return len(movie_ids)
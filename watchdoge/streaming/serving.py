@@ -0,0 +1,202 @@
+import os
+import re
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect
+from django.utils.http import http_date, parse_etags, quote_etag
+from .hls import add_query_to_uris
+
+HLS_CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".aac": "audio/aac",
+    ".vtt": "text/vtt",
+}
+PLAYLIST_EXTENSION = ".m3u8"
+# Every URL carries a per-viewer playback token, so responses are for the browser's cache
+# only: a shared cache (CDN, proxy) would hand them out without checking the token
+SEGMENT_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def file_etag(stat):
+    """
+    Strong ETag from size and mtime. Segments never change once written and
+    playlists are replaced atomically, so a new version always gets a new mtime.
+    """
+    return quote_etag(f"{stat.st_size:x}-{stat.st_mtime_ns:x}")
+
+
+def cache_control(filename):
+    """Segments are immutable; playlists may still grow (EVENT) or be finalized, so keep them short."""
+    if filename.endswith(PLAYLIST_EXTENSION):
+        return f"private, max-age={settings.HLS_PLAYLIST_MAX_AGE}"
+    return SEGMENT_CACHE_CONTROL
+
+
+def parse_range(header, size):
+    """
+    Parse a single 'bytes=' range into (start, end) inclusive.
+    Returns None when the header should be ignored (absent, malformed or
+    several ranges: the whole file is served) and False when unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def not_modified(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    return bool(if_none_match) and (if_none_match.strip() == "*" or etag in parse_etags(if_none_match))
+
+
+class RangeFile:
+    """
+    Read-only view of bytes [start, start + length) of an open file.
+
+    It deliberately exposes fileno() and positions the descriptor at `start`:
+    WSGI servers with a sendfile-capable wsgi.file_wrapper (gunicorn, uWSGI)
+    then hand the file to os.sendfile() from the current offset for
+    Content-Length bytes, so segments go from page cache to socket without
+    being copied through Python. Other servers simply call read().
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.remaining = length
+        file.seek(start)
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def sendfile_response(path, content_type):
+    """
+    Let the web server send the file (settings.HLS_SENDFILE_BACKEND).
+    nginx: X-Accel-Redirect to an internal location aliased to MEDIA_ROOT.
+    Apache/lighttpd: X-Sendfile with the absolute path.
+    The web server then handles Range requests itself.
+    """
+    response = HttpResponse(content_type=content_type)
+    if settings.HLS_SENDFILE_BACKEND == "x-accel-redirect":
+        relative = os.path.relpath(path, settings.MEDIA_ROOT).replace("\\", "/")
+        response["X-Accel-Redirect"] = settings.HLS_SENDFILE_ROOT.rstrip("/") + "/" + relative
+    else:
+        response["X-Sendfile"] = path
+    return response
+
+
+def serve_file(request, path, filename, query=None):
+    """
+    Serve one playlist or segment with ETag/304, Cache-Control and Range
+    support. Playlists get `query` (the playback token) appended to every URI
+    they reference. Raises FileNotFoundError if the file does not exist.
+    """
+    content_type = HLS_CONTENT_TYPES[os.path.splitext(filename)[1]]
+    stat = os.stat(path)
+    etag = file_etag(stat)
+
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Cache-Control": cache_control(filename),
+        "Accept-Ranges": "bytes",
+    }
+
+    if not_modified(request, etag):
+        response = HttpResponse(status=304)
+    elif query and filename.endswith(PLAYLIST_EXTENSION):
+        response = playlist_response(path, content_type, query)
+        del headers["Accept-Ranges"]
+    elif settings.HLS_SENDFILE_BACKEND:
+        response = sendfile_response(path, content_type)
+    else:
+        response = ranged_file_response(request, path, stat.st_size, etag, content_type)
+
+    # Error responses (416) bring their own Cache-Control
+    for header, value in headers.items():
+        response.setdefault(header, value)
+    return response
+
+
+def serve_stored_file(request, storage, movie_id, filename, query=None):
+    """
+    serve_file() for HLS output kept in object storage (HLS_STORAGE_BACKEND).
+    Segments are redirected to a presigned URL, so their bytes go from the
+    bucket to the player without passing through Django; playlists are read
+    and rewritten to carry `query` like local ones.
+    Raises FileNotFoundError if a playlist does not exist.
+    """
+    if not filename.endswith(PLAYLIST_EXTENSION):
+        response = HttpResponseRedirect(storage.url(movie_id, filename))
+        # Presigned URLs expire: the redirect may only be reused for part of their lifetime
+        response["Cache-Control"] = f"private, max-age={settings.HLS_S3_URL_EXPIRY // 2}"
+        return response
+
+    content, etag, last_modified = storage.read(movie_id, filename)
+    if not_modified(request, etag):
+        response = HttpResponse(status=304)
+    else:
+        text = content.decode("utf-8")
+        response = HttpResponse(add_query_to_uris(text, query) if query else text, content_type=HLS_CONTENT_TYPES[PLAYLIST_EXTENSION])
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+    response["Cache-Control"] = cache_control(filename)
+    return response
+
+
+def playlist_response(path, content_type, query):
+    """Playlists are tiny, so they are rewritten in memory for every request."""
+    with open(path, encoding="utf-8") as playlist:
+        return HttpResponse(add_query_to_uris(playlist.read(), query), content_type=content_type)
+
+
+def ranged_file_response(request, path, size, etag, content_type):
+    byte_range = parse_range(request.headers.get("Range"), size)
+
+    # If-Range: only honour the range while the client still has this version
+    if_range = request.headers.get("If-Range")
+    if byte_range and if_range and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        # Never cache an error for an otherwise immutable URL
+        response["Cache-Control"] = "no-store"
+        return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1 if size else 0
+    response = FileResponse(RangeFile(open(path, "rb"), start, length), content_type=content_type)
+    response["Content-Length"] = str(length)
+    if byte_range:
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
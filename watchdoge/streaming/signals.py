@@ -1,25 +1,126 @@
-import os
-from django.db.models.signals import post_delete
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Movie
-from .utils import delete_hls_folder
-import shutil
-from django.conf import settings
+from .models import Genre, Movie
+from .search import index_movies, unindex_movies
+from .suggest import mark_suggest_index_stale
+from .cache import bump_version
+
+CATALOG_PAGE_FIELDS = {'title', 'poster', 'release_year'}
+
 
 @receiver(post_delete, sender=Movie)
-def auto_delete_movie_files(sender, instance, **kwargs):
-    if instance.file and os.path.isfile(instance.file.path):
-        os.remove(instance.file.path)
-    if instance.poster and os.path.isfile(instance.poster.path):
-        os.remove(instance.poster.path)
+def movie_deleted_cleanup_files(sender, instance, **kwargs):
+    # Movies deleted some other way (admin, cascades) than deleteMovie -> delete_movie,
+    # whose cleanup_movie_files only deletes the row once the files are gone
+    if instance.status == 'deleting':
+        return
+    from .tasks import cleanup_movie_files
+    movie_id = instance.id  # reset to None once delete() returns
+    file_names = [field.name for field in (instance.file, instance.poster) if field]
+    transaction.on_commit(lambda: cleanup_movie_files.delay(movie_id, file_names))
+
+
+def schedule_similarity_update():
+    from .tasks import schedule_similarity_rebuild
+    transaction.on_commit(schedule_similarity_rebuild)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved_update_similarities(sender, instance, created, update_fields=None, **kwargs):
+    # Conversion progress saves with update_fields; only title/description feed the index
+    if created or update_fields is None or {'title', 'description'} & set(update_fields):
+        schedule_similarity_update()
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_update_similarities(sender, action, **kwargs):
+    # Either side (movie.genres or genre.movie_set) changed some movie's genres
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        schedule_similarity_update()
+
 
-    # Delete HLS folder
-    if instance.hls_path:
-        hls_dir = os.path.join(settings.MEDIA_ROOT, os.path.dirname(instance.hls_path))
-        if os.path.isdir(hls_dir):
-            shutil.rmtree(hls_dir)  # deletes folder and all its content
+@receiver(post_save, sender=Movie)
+def movie_saved_update_search_index(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or {'title', 'description'} & set(update_fields):
+        index_movies([instance.id])
 
 
 @receiver(post_delete, sender=Movie)
-def cleanup_hls_on_delete(sender, instance, **kwargs):
-    delete_hls_folder(instance)
\ No newline at end of file
+def movie_deleted_update_search_index(sender, instance, **kwargs):
+    unindex_movies([instance.id])
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_update_search_index(sender, instance, action, reverse, pk_set=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        index_movies([instance.id])
+    elif action == 'post_clear':
+        # genre.movie_set.clear(): pk_set is not sent, the movies were collected in pre_clear
+        index_movies(getattr(instance, '_search_movie_ids', ()))
+    else:
+        index_movies(pk_set or ())
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def genre_movies_before_clear(sender, instance, action, reverse, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._search_movie_ids = list(instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Genre)
+def genre_renamed_update_search_index(sender, instance, created, **kwargs):
+    if not created:
+        index_movies(instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Genre)
+def genre_deleted_collect_movies(sender, instance, **kwargs):
+    instance._search_movie_ids = list(instance.movie_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Genre)
+def genre_deleted_update_search_index(sender, instance, **kwargs):
+    index_movies(getattr(instance, '_search_movie_ids', ()))
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved_update_suggest_index(sender, instance, created, update_fields=None, **kwargs):
+    # A status change can add (now playable) or remove (failed, deleting) a title
+    if created or update_fields is None or {'title', 'release_year', 'status'} & set(update_fields):
+        transaction.on_commit(mark_suggest_index_stale)
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted_update_suggest_index(sender, instance, **kwargs):
+    transaction.on_commit(mark_suggest_index_stale)
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def genre_changed_invalidate_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version('genres'))
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+
+@receiver(post_save, sender=Movie)
+def movie_changed_invalidate_cache(sender, instance, created, update_fields=None, **kwargs):
+    # Cached catalog pages show the title, poster and year of live movies. Conversion
+    # saves (status, probe columns, hls_path) only matter when the movie leaves the catalog.
+    if created or update_fields is None or CATALOG_PAGE_FIELDS & set(update_fields) or (
+        'status' in update_fields and instance.status == 'deleting'
+    ):
+        transaction.on_commit(lambda: bump_version('catalog'))
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted_invalidate_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_version('catalog'))
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_invalidate_cache(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(lambda: bump_version('catalog'))
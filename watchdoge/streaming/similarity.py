@@ -0,0 +1,20 @@
+from django.utils import timezone
+from .models import Movie, MovieQuerySet
+from .search import filter_by_genres
+
+
+def get_similar_movies(movie, limit=5):
+    """
+    Recommended movies for a movie page: one query on the precomputed
+    MovieSimilarity index (maintained by streaming/recommender.py), playable
+    movies only. Until the index has rows for the movie (it is rebuilt a
+    little after a movie is added), the latest movies sharing one of its genres.
+    """
+    # Movie cards show no genres, so none are prefetched
+    movies = Movie.objects.playable().only(*MovieQuerySet.CATALOG_FIELDS).filter(release_year__lte=timezone.now().year)
+    similar = list(movies.filter(similar_to__movie_id=movie.id).order_by('-similar_to__score')[:limit])
+    if similar:
+        return similar
+    return list(
+        filter_by_genres(movies.exclude(id=movie.id), movie.genres.values('id')).order_by('-upload_date', '-id')[:limit]
+    )
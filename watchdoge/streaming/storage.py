@@ -0,0 +1,315 @@
+import functools
+import os
+import posixpath
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from .hls import parse_media_playlist
+from .serving import HLS_CONTENT_TYPES, cache_control
+from .transcode import MASTER_PLAYLIST, VARIANT_PLAYLIST, available_segments, hls_output_dir, variant_names
+from .utils import remove_tree_batch
+
+
+def master_variants(text):
+    """Variant folders a master playlist refers to (its URI lines are <name>/index.m3u8)."""
+    return {posixpath.dirname(line.strip()) for line in text.splitlines() if line.strip() and not line.startswith("#")}
+
+
+class LocalHLSStorage:
+    """
+    HLS output stays where FFmpeg writes it, movies/hls/<id> under MEDIA_ROOT,
+    and is served from there (or by the web server, HLS_SENDFILE_BACKEND).
+    """
+
+    is_local = True
+
+    def uploader(self, movie_id):
+        return LocalHLSUploader(movie_id)
+
+    def clear(self, movie_id):
+        shutil.rmtree(hls_output_dir(movie_id), ignore_errors=True)
+
+    def delete_movie(self, movie_id, limit):
+        return remove_tree_batch(hls_output_dir(movie_id), limit)
+
+
+class LocalHLSUploader:
+    """Nothing to ship: the output folder is the storage."""
+
+    def __init__(self, movie_id):
+        self.output_dir = hls_output_dir(movie_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def sync(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+    def available_segments(self, variants):
+        return available_segments(self.output_dir, variants)
+
+
+def storage_errors(method):
+    """Report S3 failures as OSError, like the filesystem, so callers (and task retries) treat both alike."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            return method(*args, **kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise FileNotFoundError(str(e)) from e
+            raise OSError(str(e)) from e
+        except BotoCoreError as e:
+            raise OSError(str(e)) from e
+    return wrapper
+
+
+class S3HLSStorage:
+    """
+    HLS output in an S3-compatible bucket (AWS S3, MinIO, Ceph...) under
+    HLS_S3_PREFIX/<id>/; movies/hls/<id> is only scratch space while a
+    conversion runs. Files larger than HLS_S3_MULTIPART_THRESHOLD are sent as
+    multipart uploads. boto3 is only needed when this backend is configured.
+    """
+
+    is_local = False
+
+    def __init__(self):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        # Clients are thread-safe, so the uploader threads share this one
+        self.client = boto3.session.Session().client(
+            "s3",
+            endpoint_url=settings.HLS_S3_ENDPOINT_URL or None,
+            region_name=settings.HLS_S3_REGION or None,
+            aws_access_key_id=settings.HLS_S3_ACCESS_KEY or None,
+            aws_secret_access_key=settings.HLS_S3_SECRET_KEY or None,
+        )
+        self.bucket = settings.HLS_S3_BUCKET
+        self.prefix = settings.HLS_S3_PREFIX.strip("/")
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.HLS_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.HLS_S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=settings.HLS_S3_MULTIPART_CONCURRENCY,
+        )
+
+    def movie_prefix(self, movie_id):
+        return f"{self.prefix}/{movie_id}/"
+
+    def key(self, movie_id, name):
+        name = posixpath.normpath(name.replace("\\", "/"))
+        if name.startswith(("/", "../")) or name in (".", ".."):
+            raise SuspiciousFileOperation(f"{name} is outside the HLS output of movie {movie_id}")
+        return self.movie_prefix(movie_id) + name
+
+    def object_args(self, name):
+        return {
+            "ContentType": HLS_CONTENT_TYPES.get(os.path.splitext(name)[1], "application/octet-stream"),
+            "CacheControl": cache_control(name),
+        }
+
+    def uploader(self, movie_id):
+        return S3HLSUploader(self, movie_id)
+
+    @storage_errors
+    def upload_file(self, path, movie_id, name):
+        self.client.upload_file(
+            path, self.bucket, self.key(movie_id, name),
+            ExtraArgs=self.object_args(name), Config=self.transfer_config,
+        )
+
+    @storage_errors
+    def save(self, movie_id, name, text):
+        self.client.put_object(Bucket=self.bucket, Key=self.key(movie_id, name), Body=text.encode("utf-8"), **self.object_args(name))
+
+    @storage_errors
+    def read(self, movie_id, name):
+        """(bytes, ETag, last modified datetime) of a stored file; FileNotFoundError if there is none."""
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key(movie_id, name))
+        with response["Body"] as body:
+            return body.read(), response["ETag"], response["LastModified"]
+
+    def url(self, movie_id, name):
+        """Presigned GET URL, valid for HLS_S3_URL_EXPIRY seconds (signed locally, no request)."""
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self.key(movie_id, name)},
+            ExpiresIn=settings.HLS_S3_URL_EXPIRY,
+        )
+
+    def clear(self, movie_id):
+        while not self.delete_movie(movie_id, 1000):
+            pass
+
+    @storage_errors
+    def delete_movie(self, movie_id, limit):
+        """
+        Delete up to `limit` objects of a movie (1000 per request), then its
+        scratch folder. Returns True once nothing is left.
+        """
+        while limit > 0:
+            listing = self.client.list_objects_v2(Bucket=self.bucket, Prefix=self.movie_prefix(movie_id), MaxKeys=min(limit, 1000))
+            keys = [{"Key": item["Key"]} for item in listing.get("Contents", ())]
+            if keys:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": keys, "Quiet": True})
+                limit -= len(keys)
+            if not listing.get("IsTruncated"):
+                return remove_tree_batch(hls_output_dir(movie_id), limit)
+        return False
+
+    @storage_errors
+    def movie_ids(self):
+        """Ids of the movies with objects in the bucket."""
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/", Delimiter="/"):
+            for common in page.get("CommonPrefixes", ()):
+                name = common["Prefix"][len(self.prefix) + 1:].rstrip("/")
+                if name.isdigit():
+                    yield int(name)
+
+    @storage_errors
+    def movie_usage(self, movie_id):
+        """(total bytes, newest upload timestamp) of a movie's objects."""
+        size, newest = 0, 0.0
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.movie_prefix(movie_id)):
+            for item in page.get("Contents", ()):
+                size += item["Size"]
+                newest = max(newest, item["LastModified"].timestamp())
+        return size, newest
+
+
+class S3HLSUploader:
+    """
+    Ships a conversion from its scratch folder to the bucket while FFmpeg is
+    still writing it. sync() (called on every FFmpeg progress block) queues
+    the segments the variant playlists list, FFmpeg adds a segment only once
+    it is closed, on HLS_UPLOAD_WORKERS threads; each local copy is deleted
+    once uploaded, so the scratch disk only holds segments in flight.
+    A playlist is uploaded after the segments it lists and the master
+    playlist after every variant playlist, so players never see a URI that
+    is not in the bucket yet.
+    """
+
+    def __init__(self, storage, movie_id):
+        self.storage = storage
+        self.movie_id = movie_id
+        self.output_dir = hls_output_dir(movie_id)
+        self.pool = ThreadPoolExecutor(max_workers=settings.HLS_UPLOAD_WORKERS, thread_name_prefix=f"hls-upload-{movie_id}")
+        self.futures = {}    # segment name -> upload future
+        self.pending = {}    # variant -> (playlist text, futures of its segments)
+        self.uploaded = {}   # variant -> playlist text last uploaded
+        self.master_uploaded = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, name):
+        with open(os.path.join(self.output_dir, name), encoding="utf-8") as playlist:
+            return playlist.read()
+
+    def upload_segment(self, name):
+        path = os.path.join(self.output_dir, name)
+        self.storage.upload_file(path, self.movie_id, name)
+        os.remove(path)
+
+    def queue_segments(self, variant, text):
+        """Upload futures of the segments a variant playlist lists, queueing the new ones."""
+        futures = []
+        segments, _ = parse_media_playlist(text.splitlines())
+        for uri in dict.fromkeys(name for segment in segments for name in (segment["map"], segment["uri"]) if name):
+            name = f"{variant}/{uri}"
+            if name not in self.futures:
+                self.futures[name] = self.pool.submit(self.upload_segment, name)
+            futures.append(self.futures[name])
+        return futures
+
+    def upload_playlist(self, variant, text, futures):
+        for future in futures:
+            future.result()  # re-raises a failed segment upload
+        self.storage.save(self.movie_id, f"{variant}/{VARIANT_PLAYLIST}", text)
+        self.uploaded[variant] = text
+
+    def upload_master(self):
+        if not os.path.exists(os.path.join(self.output_dir, MASTER_PLAYLIST)):
+            return
+        text = self.read(MASTER_PLAYLIST)
+        if master_variants(text) <= self.uploaded.keys():
+            self.storage.save(self.movie_id, MASTER_PLAYLIST, text)
+            self.master_uploaded = True
+
+    def sync(self):
+        """Queue the segments finished since the last call; upload the playlists whose segments all arrived."""
+        for variant in variant_names(self.output_dir):
+            if variant not in self.pending:
+                text = self.read(f"{variant}/{VARIANT_PLAYLIST}")
+                if text == self.uploaded.get(variant):
+                    continue
+                self.pending[variant] = (text, self.queue_segments(variant, text))
+
+            # The snapshot is uploaded once its segments are; the next call takes a newer one
+            text, futures = self.pending[variant]
+            if all(future.done() for future in futures):
+                del self.pending[variant]
+                self.upload_playlist(variant, text, futures)
+
+        if not self.master_uploaded:
+            self.upload_master()
+
+    def flush(self):
+        """Upload everything the playlists list, wait for it, then upload the playlists."""
+        self.pending.clear()
+        for variant in variant_names(self.output_dir):
+            text = self.read(f"{variant}/{VARIANT_PLAYLIST}")
+            if text != self.uploaded.get(variant):
+                self.upload_playlist(variant, text, self.queue_segments(variant, text))
+        self.upload_master()
+
+    def finish(self):
+        """Final flush of a finished conversion; the scratch folder is removed afterwards."""
+        try:
+            self.flush()
+        finally:
+            self.close()
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    def available_segments(self, variants):
+        """Like transcode.available_segments(), counting what players can already get from the bucket."""
+        if not self.master_uploaded:
+            return 0
+        try:
+            return min(len(parse_media_playlist(self.uploaded[name].splitlines())[0]) for name in variants)
+        except KeyError:
+            return 0
+
+
+_storage = None
+
+
+def get_hls_storage():
+    """The configured HLS storage backend (HLS_STORAGE_BACKEND: 'local' or 's3')."""
+    global _storage
+    if _storage is None:
+        _storage = S3HLSStorage() if settings.HLS_STORAGE_BACKEND == "s3" else LocalHLSStorage()
+    return _storage
@@ -0,0 +1,128 @@
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from .models import Movie
+
+SUGGEST_VERSION_KEY = "movie-suggest:version"
+NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalize_title(title):
+    """'Amélie (2001)' -> 'amelie 2001': accents folded, punctuation dropped, single spaces."""
+    title = (title or "").lower()
+    if not title.isascii():
+        title = "".join(char for char in unicodedata.normalize("NFKD", title) if not unicodedata.combining(char))
+    return " ".join(NON_WORD_RE.sub(" ", title).split())
+
+
+class PrefixIndex:
+    """
+    Compact prefix index over normalized titles: two sorted key lists (whole
+    titles, then titles from their second word on, so "wars" finds "Star
+    Wars") with parallel movie id arrays. A lookup is a bisect plus a short
+    forward scan, O(log n + limit), no per-character trie nodes.
+    """
+
+    def __init__(self, movies):
+        self.movies = {}
+        title_keys, word_keys = [], []
+        for movie_id, title, release_year in movies:
+            self.movies[movie_id] = (title, release_year)
+            words = normalize_title(title).split(" ")
+            if words[0]:
+                title_keys.append((" ".join(words), movie_id))
+            for start in range(1, len(words)):
+                word_keys.append((" ".join(words[start:]), movie_id))
+
+        self.sections = []
+        for keys in (title_keys, word_keys):
+            keys.sort()
+            self.sections.append(([key for key, _ in keys], array("q", (movie_id for _, movie_id in keys))))
+
+    def lookup(self, prefix, limit):
+        """Movie ids whose title (or a later word of it) starts with `prefix`, title starts first."""
+        found = []
+        for keys, ids in self.sections:
+            position = bisect_left(keys, prefix)
+            while position < len(keys) and len(found) < limit and keys[position].startswith(prefix):
+                if ids[position] not in found:
+                    found.append(ids[position])
+                position += 1
+        return found
+
+    def suggest(self, query, limit):
+        prefix = normalize_title(query)
+        if not prefix:
+            return []
+        return [(movie_id, *self.movies[movie_id]) for movie_id in self.lookup(prefix, limit)]
+
+
+_index = None
+_index_version = None
+_checked_at = 0.0
+_rebuilding = False
+_lock = threading.Lock()
+
+
+def build_prefix_index():
+    # Only what a viewer can open: no uploads still converting, failed or being deleted
+    return PrefixIndex(Movie.objects.playable().values_list("id", "title", "release_year").iterator())
+
+
+def rebuild_prefix_index(version):
+    global _index, _index_version, _rebuilding
+    try:
+        index = build_prefix_index()
+        with _lock:
+            _index, _index_version = index, version
+    finally:
+        _rebuilding = False
+        connection.close()
+
+
+def get_prefix_index():
+    """
+    The process-wide index, shared by every request. Movie changes bump a
+    version in the shared cache (see mark_suggest_index_stale); each process
+    looks at it at most every SUGGEST_INDEX_CHECK_INTERVAL seconds and, when
+    it moved, rebuilds in a background thread while requests keep using the
+    current index. Only the very first request of a process waits for a build.
+    """
+    global _index, _index_version, _checked_at, _rebuilding
+    now = time.monotonic()
+    if _index is not None and now - _checked_at < settings.SUGGEST_INDEX_CHECK_INTERVAL:
+        return _index
+
+    with _lock:
+        if _index is None:
+            _index_version = cache.get_or_set(SUGGEST_VERSION_KEY, 1, None)
+            _index = build_prefix_index()
+            _checked_at = time.monotonic()
+        elif now - _checked_at >= settings.SUGGEST_INDEX_CHECK_INTERVAL:
+            _checked_at = now
+            version = cache.get_or_set(SUGGEST_VERSION_KEY, 1, None)
+            if version != _index_version and not _rebuilding:
+                _rebuilding = True
+                threading.Thread(target=rebuild_prefix_index, args=(version,), daemon=True).start()
+        return _index
+
+
+def mark_suggest_index_stale():
+    """Called on Movie changes: every process rebuilds its index on its next check."""
+    global _checked_at
+    try:
+        cache.incr(SUGGEST_VERSION_KEY)
+    except ValueError:
+        cache.set(SUGGEST_VERSION_KEY, 2, None)
+    _checked_at = 0.0  # this process does not wait for the interval
+
+
+def suggest_movies(query, limit=None):
+    """[(movie id, title, release year), ...] of titles starting with the query."""
+    return get_prefix_index().suggest(query, limit or settings.SUGGEST_LIMIT)
@@ -1,23 +1,45 @@
 # tasks.py
-from celery import shared_task
-from .models import Movie
+from celery import shared_task, chord
+from .models import Movie, MovieUpload
 from django.conf import settings
-from .utils import delete_original_after_conversion
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from .utils import delete_original_after_conversion, remove_tree_batch
+from .transcode import (
+    MASTER_PLAYLIST, MODE_AUDIO, MODE_FULL, PASSTHROUGH_VARIANT, SEGMENT_MPEGTS,
+    build_hls_command, build_passthrough_command, build_split_command,
+    choose_conversion_mode, chunk_output_dir, chunk_starts, chunk_source_path,
+    finalize_playlists, follow_input, get_renditions, hls_output_dir,
+    hls_work_dir, ingest_output_dir, max_keyframe_interval,
+    output_segment_format, plan_chunk_splits, playlist_duration,
+    probe_keyframes, probe_source, stitch_chunks,
+)
+from .progress import run_ffmpeg, start_chunked_progress
+from .uploads import upload_abspath
+from .recommender import rebuild_index
+from .media_gc import collect_media_garbage
+from .storage import get_hls_storage
 import os
+import shutil
 import subprocess
 import time
 import getpass
 
-FFMPEG_PATH = r"C:\ffmpeg\bin\ffmpeg.exe"
-
 @shared_task(bind=True)
 def convert_movie_to_hls(self, movie_id):
     """
-    Celery task to convert uploaded movie into HLS.
+    Celery task to convert uploaded movie into an adaptive bitrate HLS ladder.
     Windows-safe:
     - Uses absolute paths for FFmpeg, input, output
     - Adds short delay to avoid file locks
-    - Updates movie.status in DB: uploaded -> processing -> ready/failed
+    - Updates movie.status in DB: uploaded -> processing -> (partially_ready ->) ready/failed
+    The source is probed first: compatible H.264/AAC files are only remuxed,
+    H.264 with other audio gets an audio-only re-encode, everything else goes
+    through the ladder encode. Long full encodes are handed off to the parallel
+    chunk pipeline (encode_hls_chunk x N -> stitch_hls_chunks), local storage only.
+    The movie is published as partially_ready as soon as the first segments exist.
+    With object storage (HLS_STORAGE_BACKEND) segments are uploaded while FFmpeg runs.
     """
     try:
         # Fetch movie
@@ -31,67 +53,430 @@ def convert_movie_to_hls(self, movie_id):
             if not os.path.exists(input_file):
                 raise FileNotFoundError(f"File not found: {input_file}")
 
-        # Output directory for HLS files
-        output_dir = os.path.join(settings.MEDIA_ROOT, "movies", "hls", str(movie_id))
+        # Output directory for HLS files (master.m3u8 + one folder per rendition),
+        # only scratch space with object storage.
+        # Start clean so a re-upload never mixes old and new renditions.
+        output_dir = hls_output_dir(movie_id)
+        storage = get_hls_storage()
+        storage.clear(movie_id)
         os.makedirs(output_dir, exist_ok=True)
-        output_file = os.path.abspath(os.path.join(output_dir, "index.m3u8"))
 
-        # Update status → processing
+        # Update status → processing (and record the segment packaging used)
         movie.status = "processing"
-        movie.save(update_fields=["status"])
+        movie.segment_format = movie.segment_format or settings.HLS_SEGMENT_TYPE
+        movie.save(update_fields=["status", "segment_format"])
         print(f"[TASK] Movie {movie.id} status set to PROCESSING (user: {getpass.getuser()})")
 
         # Small delay to avoid Windows file lock issues
         time.sleep(1)
 
-        # FFmpeg command
-        cmd = [
-            FFMPEG_PATH,
-            "-y",
-            "-i", input_file,
-            "-c:v", "libx264",        # Re-encode video
-            "-preset", "veryfast",    # Optional speed
-            "-profile:v", "main",
-            "-level", "4.0",
-            "-c:a", "aac",
-            "-b:a", "128k",
-            "-start_number", "0",
-            "-hls_time", "6",
-            "-hls_list_size", "0",
-            "-hls_segment_filename", os.path.join(output_dir, "segment_%03d.ts"),
-            "-f", "hls",
-            output_file
-        ]
-
-
-        print(f"[TASK] Running FFmpeg for movie {movie.id}")
-        subprocess.run(cmd, check=True)
-
-        # Conversion succeeded
-        rel_path = os.path.relpath(output_file, settings.MEDIA_ROOT).replace("\\", "/")
-        movie.hls_path = rel_path
-        movie.status = "ready"
-        movie.save(update_fields=["status", "hls_path"])
-        print(f"[TASK] Movie {movie.id} conversion completed. Status set to READY.")
-
-        # Delete original file after successful conversion
-        delete_original_after_conversion(movie)
+        source, keyframes = analyse_source(movie, input_file)
+        mode = choose_conversion_mode(source, movie.keyframe_interval) if settings.HLS_PASSTHROUGH else MODE_FULL
+        print(f"[TASK] Movie {movie.id}: {source['video_codec']}/{source['audio_codec'] or 'no audio'} "
+              f"{source['width']}x{source['height']}, conversion mode: {mode.upper()}")
+
+        if mode != MODE_FULL:
+            # FFmpeg command: remux (optionally re-encoding just the audio)
+            cmd = build_passthrough_command(
+                input_file, output_dir,
+                reencode_audio=mode == MODE_AUDIO,
+                has_audio=source["has_audio"],
+                segment_format=movie.segment_format,
+            )
+            variants = [PASSTHROUGH_VARIANT]
+        else:
+            renditions = get_renditions(source["height"])
+            # Chunk workers share movies/work, i.e. MEDIA_ROOT: only with local HLS storage
+            if storage.is_local and source["duration"] >= settings.HLS_PARALLEL_MIN_SECONDS:
+                start_chunked_conversion(movie, input_file, keyframes, renditions, source["has_audio"])
+                return
+
+            # FFmpeg command: whole rendition ladder in a single pass
+            cmd = build_hls_command(
+                input_file, output_dir, renditions,
+                has_audio=source["has_audio"],
+                segment_format=movie.segment_format,
+            )
+            variants = [rendition["name"] for rendition in renditions]
 
+        with storage.uploader(movie.id) as uploader:
+            def publish_when_playable(stats):
+                uploader.sync()
+                if movie.status == "processing":
+                    publish_partial(movie, variants, uploader)
+
+            print(f"[TASK] Running FFmpeg for movie {movie.id}")
+            run_ffmpeg(cmd, movie.id, source["duration"], task=self, on_progress=publish_when_playable)
+
+            finish_conversion(movie, uploader)
 
     except Exception as e:
+        mark_conversion_failed(movie_id, e)
+        raise e
+
+
+def analyse_source(movie, input_file):
+    """Probe the upload with ffprobe and store codec, resolution, bitrate, duration and GOP on the movie."""
+    source = probe_source(input_file)
+    keyframes = probe_keyframes(input_file)
+
+    movie.video_codec = source["video_codec"]
+    movie.video_profile = source["video_profile"]
+    movie.audio_codec = source["audio_codec"]
+    movie.width = source["width"]
+    movie.height = source["height"]
+    movie.source_bitrate = source["bitrate"] or None
+    movie.source_duration = source["duration"]
+    movie.keyframe_interval = max_keyframe_interval(keyframes, source["duration"])
+    movie.save(update_fields=[
+        "video_codec", "video_profile", "audio_codec", "width", "height",
+        "source_bitrate", "source_duration", "keyframe_interval",
+    ])
+    return source, keyframes
+
+
+def start_chunked_conversion(movie, input_file, keyframes, renditions, has_audio):
+    """
+    Cut the source on keyframes and fan the chunks out to the workers as a chord.
+    The chord callback stitches the results once every chunk is encoded.
+    """
+    work_dir = hls_work_dir(movie.id)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+
+    split_times = plan_chunk_splits(keyframes, settings.HLS_CHUNK_SECONDS)
+    subprocess.run(build_split_command(input_file, work_dir, split_times), check=True)
+
+    starts = chunk_starts(keyframes, split_times)
+    chunk_count = len(starts)
+    print(f"[TASK] Movie {movie.id} split into {chunk_count} chunks for parallel encoding")
+    start_chunked_progress(movie.id, movie.source_duration, chunk_count)
+
+    header = [
+        encode_hls_chunk.si(movie.id, index, renditions, has_audio, chunk_count, movie.segment_format, start)
+        for index, start in enumerate(starts)
+    ]
+    callback = stitch_hls_chunks.si(movie.id, chunk_count, renditions).on_error(chunked_conversion_failed.s(movie.id))
+    chord(header)(callback)
+
+
+@shared_task(bind=True)
+def encode_hls_chunk(self, movie_id, index, renditions, has_audio=True, chunk_count=None, segment_format=SEGMENT_MPEGTS,
+                     start=0.0):
+    """
+    Encode one GOP-aligned chunk of the source into the full rendition ladder,
+    its timestamps shifted to `start` (seconds into the movie) so the stitched
+    playlists have one continuous timeline.
+    With chunk_count, the finished prefix of the movie is stitched and published
+    right away so playback can start before the last chunk is done.
+    """
+    work_dir = hls_work_dir(movie_id)
+    chunk_file = chunk_source_path(work_dir, index)
+    output_dir = chunk_output_dir(work_dir, index)
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"[TASK] Encoding chunk {index} of movie {movie_id}")
+    cmd = build_hls_command(
+        chunk_file, output_dir, renditions, has_audio=has_audio, segment_format=segment_format, output_ts_offset=start,
+    )
+    run_ffmpeg(cmd, movie_id, probe_source(chunk_file)["duration"], task=self, part=index)
+    os.remove(chunk_file)
+
+    if chunk_count:
+        stitch_finished_prefix(movie_id, chunk_count, renditions)
+
+
+def finished_chunk_prefix(work_dir, chunk_count):
+    """Number of leading chunks already encoded (their source file is removed once done)."""
+    done = 0
+    while done < chunk_count and not os.path.exists(chunk_source_path(work_dir, done)):
+        done += 1
+    return done
+
+
+def stitch_finished_prefix(movie_id, chunk_count, renditions):
+    """
+    Stitch the leading run of encoded chunks into an EVENT playlist and publish
+    the movie once it is long enough. Chunks finish on different workers, so
+    only one of them stitches at a time; the lock holder re-checks the prefix
+    after releasing so a chunk that finished meanwhile is never missed.
+    """
+    work_dir = hls_work_dir(movie_id)
+    lock_key = f"streaming:stitch-lock:{movie_id}"
+
+    done = finished_chunk_prefix(work_dir, chunk_count)
+    # Nothing to show yet, or the chord callback does the final stitch
+    while 0 < done < chunk_count:
+        if not cache.add(lock_key, 1, 300):
+            return
         try:
-            movie = Movie.objects.get(id=movie_id)
-            movie.status = "failed"
-            movie.save(update_fields=["status"])
-            print(f"[TASK] Movie {movie.id} conversion FAILED: {str(e)}")
-
-            # 🧹 Cleanup: remove empty HLS folder if FFmpeg didn’t produce output
-            output_dir = os.path.join(settings.MEDIA_ROOT, "movies", "hls", str(movie_id))
-            if os.path.isdir(output_dir) and not os.listdir(output_dir):
-                os.rmdir(output_dir)
-                print(f"[CLEANUP] Removed empty HLS folder: {output_dir}")
-
-        except Movie.DoesNotExist:
-            print(f"[TASK] Failed movie {movie_id} not found in DB.")
+            stitch_chunks(work_dir, hls_output_dir(movie_id), done, renditions, ended=False)
+            with get_hls_storage().uploader(movie_id) as uploader:
+                uploader.flush()
+
+                movie = Movie.objects.get(id=movie_id)
+                if movie.status == "processing":
+                    publish_partial(movie, [rendition["name"] for rendition in renditions], uploader)
+        finally:
+            cache.delete(lock_key)
+
+        stitched, done = done, finished_chunk_prefix(work_dir, chunk_count)
+        if done == stitched:
+            return
+
+
+@shared_task
+def stitch_hls_chunks(movie_id, chunk_count, renditions):
+    """Chord callback: join the encoded chunks into the final HLS output."""
+    try:
+        movie = Movie.objects.get(id=movie_id)
+        work_dir = hls_work_dir(movie_id)
+
+        stitch_chunks(work_dir, hls_output_dir(movie_id), chunk_count, renditions)
+        shutil.rmtree(work_dir, ignore_errors=True)
+        print(f"[TASK] Movie {movie_id}: stitched {chunk_count} chunks")
+
+        finish_conversion(movie)
+
+    except Exception as e:
+        mark_conversion_failed(movie_id, e)
+        raise e
+
+
+@shared_task
+def chunked_conversion_failed(request, exc, traceback, movie_id):
+    """Error callback of the chunk chord (a chunk or the stitch step failed)."""
+    shutil.rmtree(hls_work_dir(movie_id), ignore_errors=True)
+    mark_conversion_failed(movie_id, exc)
+
+
+@shared_task
+def ingest_upload_to_hls(upload_id):
+    """
+    Streaming ingest: encode a fast-start source while it is still uploading.
+    FFmpeg follows the growing file up to the upload size, so the encode
+    finishes as soon as the last chunk lands. Output is staged under
+    movies/ingest/<upload id> until the upload is completed and its Movie
+    exists (see adopt_ingest_output).
+    """
+    upload = MovieUpload.objects.get(id=upload_id)
+    input_file = upload_abspath(upload)
+    output_dir = ingest_output_dir(upload_id)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    succeeded = False
+    try:
+        # The header is complete for fast-start sources, so probing works already
+        source = probe_source(input_file)
+        renditions = get_renditions(source["height"])
+        input_url, input_options = follow_input(input_file, upload.size)
+        cmd = build_hls_command(
+            input_url, output_dir, renditions,
+            has_audio=source["has_audio"],
+            input_options=input_options,
+            segment_format=settings.HLS_SEGMENT_TYPE,
+        )
+        print(f"[INGEST] Upload {upload_id}: encoding while the file is still uploading")
+        run_ffmpeg(cmd, f"upload-{upload_id}", source["duration"])
+
+        # FFmpeg reads to the upload size, or stops early when the upload stalls
+        # (it exits cleanly then too): only keep an encode of the whole file
+        read_to_end = os.path.getsize(input_file) >= upload.size
+        upload.refresh_from_db()
+        encoded = playlist_duration(output_dir, renditions)
+        succeeded = (
+            read_to_end and upload.is_complete
+            and encoded >= probe_source(input_file)["duration"] - settings.HLS_SEGMENT_SECONDS
+        )
+        if not read_to_end:
+            print(f"[INGEST] Upload {upload_id}: the upload stalled, {encoded:.0f}s encoded")
+        elif not succeeded:
+            print(f"[INGEST] Upload {upload_id}: only {encoded:.0f}s encoded")
+
+    except Exception as e:
+        print(f"[INGEST] Upload {upload_id} streaming conversion FAILED: {str(e)}")
+
+    # complete_upload takes the same lock, so exactly one side schedules what comes next
+    with transaction.atomic():
+        upload = MovieUpload.objects.select_for_update().get(id=upload_id)
+        # append_chunk gives the ingest up when it had to cut bytes FFmpeg may have read;
+        # complete_upload then converts the movie normally
+        abandoned = upload.ingest_status != "running"
+        if not abandoned:
+            upload.ingest_status = "finished" if succeeded else "failed"
+            upload.save(update_fields=["ingest_status", "updated_at"])
+        movie_id = upload.movie_id
+
+    if abandoned or not succeeded:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    if abandoned:
+        print(f"[INGEST] Upload {upload_id}: ingest abandoned, the upload was rewound")
+    elif movie_id and succeeded:
+        adopt_ingest_output(upload_id)
+    elif movie_id:
+        convert_movie_to_hls.delay(movie_id)
+
+
+@shared_task
+def adopt_ingest_output(upload_id):
+    """
+    Move a finished streaming-ingest output into movies/hls/<movie id> and mark the movie ready.
+    If the movie asked for another segment packaging than the ingest produced, it is converted normally.
+    """
+    upload = MovieUpload.objects.select_related("movie").get(id=upload_id)
+    movie = upload.movie
+    staged_format = output_segment_format(ingest_output_dir(upload_id))
+    if movie.segment_format and movie.segment_format != staged_format:
+        shutil.rmtree(ingest_output_dir(upload_id), ignore_errors=True)
+        convert_movie_to_hls.delay(movie.id)
+        return
+
+    try:
+        analyse_source(movie, upload_abspath(upload))
+        movie.segment_format = staged_format
+        movie.save(update_fields=["segment_format"])
+
+        output_dir = hls_output_dir(movie.id)
+        get_hls_storage().clear(movie.id)
+        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+        os.replace(ingest_output_dir(upload_id), output_dir)
+
+        finish_conversion(movie)
+
+    except Exception as e:
+        mark_conversion_failed(movie.id, e)
         raise e
 
+
+SIMILARITY_REBUILD_KEY = "streaming:similarity-rebuild-pending"
+
+
+def schedule_similarity_rebuild():
+    """
+    A movie's title, description or genres changed: rebuild the whole index
+    SIMILAR_MOVIES_REBUILD_DELAY seconds from now. Every change until then is
+    covered by that one rebuild, so a bulk edit costs a single refit.
+    """
+    if cache.add(SIMILARITY_REBUILD_KEY, 1, settings.SIMILAR_MOVIES_REBUILD_DELAY + 60 * 60):
+        rebuild_movie_similarities.apply_async(countdown=settings.SIMILAR_MOVIES_REBUILD_DELAY)
+
+
+@shared_task
+def rebuild_movie_similarities():
+    """
+    Full recomputation: after movie changes (debounced, see
+    schedule_similarity_rebuild) and nightly. The TF-IDF vocabulary and the
+    SVD are refitted every time, so all scores come from the same space.
+    """
+    # A change from now on may not be in the catalog read below: it schedules the next rebuild
+    cache.delete(SIMILARITY_REBUILD_KEY)
+    count = rebuild_index()
+    print(f"[TASK] Similar-movies index rebuilt ({count} rows)")
+
+
+@shared_task
+def delete_movie(movie_id):
+    """
+    Second half of deleting a movie (deleteMovie only marks it 'deleting'):
+    queue cleanup_movie_files, which removes its files and then the row and
+    everything that cascades from it. Nothing to do if it is already gone.
+    """
+    movie = Movie.objects.filter(id=movie_id, status="deleting").only("file", "poster").first()
+    if movie is not None:
+        cleanup_movie_files.delay(movie_id, [field.name for field in (movie.file, movie.poster) if field])
+
+
+@shared_task(bind=True, autoretry_for=(OSError,), retry_backoff=True, max_retries=settings.MEDIA_CLEANUP_MAX_RETRIES)
+def cleanup_movie_files(self, movie_id, file_names=()):
+    """
+    Remove a deleted movie's poster and original upload, then its HLS output
+    (local folder or bucket objects) and chunk work folder,
+    MEDIA_CLEANUP_BATCH_SIZE files per run: a big ABR ladder continues in a
+    fresh task instead of holding a worker. Idempotent, retried with backoff
+    on filesystem and storage errors. A movie queued for deletion loses its
+    row last, so until its files are gone it can be found (and queued again)
+    by its status.
+    """
+    for name in file_names:
+        default_storage.delete(name)
+
+    batch_size = settings.MEDIA_CLEANUP_BATCH_SIZE
+    if not get_hls_storage().delete_movie(movie_id, batch_size) or not remove_tree_batch(hls_work_dir(movie_id), batch_size):
+        cleanup_movie_files.delay(movie_id)
+        return
+    print(f"[CLEANUP] Removed files of movie {movie_id}")
+    if Movie.objects.filter(id=movie_id, status="deleting").delete()[0]:
+        print(f"[TASK] Movie {movie_id} deleted")
+
+
+@shared_task
+def collect_orphaned_media():
+    """
+    Scheduled by Celery beat: finish deletions whose task was lost, remove
+    unreferenced media past the grace period (including the output of
+    deleted movies) and log disk usage.
+    """
+    for movie_id in Movie.objects.filter(status="deleting").values_list("id", flat=True):
+        print(f"[CLEANUP] Movie {movie_id} still marked deleting, queueing it again")
+        delete_movie.delay(movie_id)
+
+    report = collect_media_garbage()
+    print(f"[CLEANUP] {report.expired_uploads} abandoned uploads expired")
+    for category, counters in report.categories.items():
+        print(f"[CLEANUP] {category}: {counters['entries']} entries, {counters['bytes']} bytes, "
+              f"{counters['orphans']} orphaned, {counters['removed']} removed ({counters['removed_bytes']} bytes)")
+
+
+def set_hls_status(movie, status):
+    """Point the movie at its master playlist and set its status."""
+    output_file = os.path.join(hls_output_dir(movie.id), MASTER_PLAYLIST)
+    rel_path = os.path.relpath(output_file, settings.MEDIA_ROOT).replace("\\", "/")
+    movie.hls_path = rel_path
+    movie.status = status
+    movie.save(update_fields=["status", "hls_path"])
+
+
+def publish_partial(movie, variants, uploader):
+    """
+    Make a movie watchable while it is still converting, once every variant
+    has HLS_PUBLISH_MIN_SEGMENTS segments in the HLS storage (`uploader`
+    knows what was uploaded so far). Returns True if it was published.
+    """
+    if uploader.available_segments(variants) < settings.HLS_PUBLISH_MIN_SEGMENTS:
+        return False
+    set_hls_status(movie, "partially_ready")
+    print(f"[TASK] Movie {movie.id} first segments available. Status set to PARTIALLY_READY.")
+    return True
+
+
+def finish_conversion(movie, uploader=None):
+    """Finalize the playlists to VOD, store the output, mark the movie ready and drop the original upload."""
+    finalize_playlists(hls_output_dir(movie.id))
+    # Upload what is not in the HLS storage yet (nothing to do when it is local)
+    (uploader or get_hls_storage().uploader(movie.id)).finish()
+
+    # Conversion succeeded
+    set_hls_status(movie, "ready")
+    print(f"[TASK] Movie {movie.id} conversion completed. Status set to READY.")
+
+    # Delete original file after successful conversion
+    delete_original_after_conversion(movie)
+
+
+def mark_conversion_failed(movie_id, error):
+    try:
+        movie = Movie.objects.get(id=movie_id)
+        movie.status = "failed"
+        movie.save(update_fields=["status"])
+        print(f"[TASK] Movie {movie.id} conversion FAILED: {str(error)}")
+
+        # 🧹 Cleanup: remove empty HLS folder if FFmpeg didn’t produce output
+        output_dir = hls_output_dir(movie_id)
+        if os.path.isdir(output_dir) and not os.listdir(output_dir):
+            os.rmdir(output_dir)
+            print(f"[CLEANUP] Removed empty HLS folder: {output_dir}")
+
+    except Movie.DoesNotExist:
+        print(f"[TASK] Failed movie {movie_id} not found in DB.")
@@ -1,3 +1,1537 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import base36_to_int, int_to_base36
+from PIL import Image
+from watchdoge.context_processors import genres_list
+from . import views
+from .cache import build_once, local_cache, page_cache_key
+from .media_gc import collect_media_garbage
+from .models import Genre, Movie, MovieSimilarity, MovieUpload
+from .pagination import KeysetPaginator, decode_cursor, encode_cursor
+from .serving import parse_range
+from .similarity import get_similar_movies
+from .storage import LocalHLSUploader
+from .progress import ProgressReporter, get_progress, progress_key, start_chunked_progress
+from .recommender import rebuild_index
+from .search import SEARCH_TABLE, filter_by_genres, search_movies
+from .suggest import SUGGEST_VERSION_KEY, build_prefix_index
+from .tasks import (
+    adopt_ingest_output, cleanup_movie_files, collect_orphaned_media, delete_movie, ingest_upload_to_hls,
+    publish_partial, rebuild_movie_similarities, schedule_similarity_rebuild,
+)
+from .tokens import check_playback_token, make_playback_token, playback_token_ttl
+from .hls import finalize_media_playlist, parse_media_playlist, read_media_playlist
+from .transcode import (
+    FMP4_INIT_FILENAME, MASTER_PLAYLIST, MODE_AUDIO, MODE_COPY, MODE_FULL, PASSTHROUGH_VARIANT, SEGMENT_FMP4,
+    SEGMENT_MPEGTS, VARIANT_PLAYLIST, build_hls_command, build_passthrough_command, choose_conversion_mode,
+    chunk_output_dir, chunk_starts, get_renditions, hls_output_dir, hls_work_dir, ingest_output_dir,
+    max_keyframe_interval, output_segment_format, plan_chunk_splits, probe_source, stitch_chunks,
+)
+from .uploads import chain_checksum, upload_abspath
+
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class StreamingTestCase(TestCase):
+    """
+    Local-memory cache, no Redis progress buffer and a throwaway MEDIA_ROOT,
+    so the tests run without Redis and never touch the real media folder.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.test_settings = override_settings(CACHES=TEST_CACHES, MEDIA_ROOT=cls.media_root, WATCH_PROGRESS_REDIS_URL=None)
+        cls.test_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.test_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        local_cache.clear()
+        # Ids are reused once a test's transaction is rolled back, so media must go too
+        for entry in os.scandir(self.media_root):
+            shutil.rmtree(entry.path)
+
+    def assertConstantQueries(self, expected, url, add_rows):
+        """
+        GET `url` after add_rows(), then again after adding as many rows: both
+        take `expected` queries, so the page does not query per row. The cache
+        is cleared before each request to count its cold path.
+        """
+        for _ in range(2):
+            add_rows()
+            cache.clear()
+            local_cache.clear()
+            with self.assertNumQueries(expected):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+
+
+def poster_file(name='poster.png'):
+    image = io.BytesIO()
+    Image.new('RGB', (2, 2)).save(image, 'PNG')
+    return SimpleUploadedFile(name, image.getvalue(), content_type='image/png')
+
+
+def sha256_header(data):
+    return 'sha256 ' + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+@override_settings(MOVIE_UPLOAD_STREAM_INGEST=False, MOVIE_UPLOAD_CHUNK_SIZE=4)
+class ResumableUploadTests(StreamingTestCase):
+    DATA = b'0123456789'
+
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('create-upload'), {'filename': 'movie.mp4', 'size': len(self.DATA)})
+        self.assertEqual(response.status_code, 201)
+        self.upload = MovieUpload.objects.get(id=response.json()['id'])
+        self.url = reverse('upload-chunk', args=[self.upload.id])
+
+    def patch(self, data, offset, checksum=None):
+        return self.client.generic(
+            'PATCH', self.url, data, content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset), HTTP_UPLOAD_CHECKSUM=checksum or sha256_header(data),
+        )
+
+    def send_all(self):
+        for offset in range(0, len(self.DATA), 4):
+            self.assertEqual(self.patch(self.DATA[offset:offset + 4], offset).status_code, 204)
+
+    def file_content(self):
+        with open(upload_abspath(self.upload), 'rb') as source:
+            return source.read()
+
+    def part_files(self):
+        return [name for name in os.listdir(os.path.dirname(upload_abspath(self.upload))) if name.endswith('.part')]
+
+    def final_checksum(self):
+        checksum = ''
+        for offset in range(0, len(self.DATA), 4):
+            checksum = chain_checksum(checksum, hashlib.sha256(self.DATA[offset:offset + 4]).digest())
+        return checksum
+
+    def test_create_reserves_an_empty_file(self):
+        self.assertTrue(self.upload.file_path.startswith('movies/files/'))
+        self.assertEqual(self.file_content(), b'')
+
+    def test_create_rejects_unsupported_formats_and_sizes(self):
+        response = self.client.post(reverse('create-upload'), {'filename': 'movie.exe', 'size': 10})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('create-upload'), {'filename': 'movie.mp4', 'size': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_chunks_are_appended_and_offset_reported(self):
+        self.assertEqual(self.patch(self.DATA[:4], 0)['Upload-Offset'], '4')
+        response = self.client.head(self.url)
+        self.assertEqual(response['Upload-Offset'], '4')
+        self.assertEqual(response['Upload-Length'], str(len(self.DATA)))
+        self.assertEqual(self.file_content(), self.DATA[:4])
+
+    def test_offset_mismatch_is_a_conflict(self):
+        self.patch(self.DATA[:4], 0)
+        response = self.patch(self.DATA[:4], 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '4')
+        self.assertEqual(self.file_content(), self.DATA[:4])
+
+    def test_checksum_mismatch_discards_the_chunk(self):
+        self.patch(self.DATA[:4], 0)
+        response = self.patch(self.DATA[4:8], 4, checksum=sha256_header(b'else'))
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(response.json()['offset'], 4)
+        self.assertEqual(self.file_content(), self.DATA[:4])
+
+        # The same chunk can be sent again
+        self.assertEqual(self.patch(self.DATA[4:8], 4).status_code, 204)
+        self.assertEqual(self.file_content(), self.DATA[:8])
+
+    def test_chunks_are_verified_before_they_reach_the_upload_file(self):
+        self.patch(self.DATA[:4], 0)
+        self.patch(self.DATA[4:8], 4, checksum=sha256_header(b'else'))
+        self.assertEqual(self.file_content(), self.DATA[:4])
+        self.assertEqual(self.part_files(), [])
+
+    def test_the_body_is_read_before_the_row_is_locked(self):
+        calls = []
+        real_receive, real_lock = views.receive_chunk, MovieUpload.objects.select_for_update
+
+        def receive(*args):
+            calls.append('read body')
+            return real_receive(*args)
+
+        def lock():
+            calls.append('lock')
+            return real_lock()
+
+        with mock.patch('streaming.views.receive_chunk', side_effect=receive), \
+                mock.patch.object(MovieUpload.objects, 'select_for_update', side_effect=lock):
+            self.assertEqual(self.patch(self.DATA[:4], 0).status_code, 204)
+        self.assertEqual(calls, ['read body', 'lock'])
+        self.assertEqual(self.file_content(), self.DATA[:4])
+        self.assertEqual(self.part_files(), [])
+
+    def test_a_chunk_appended_while_the_body_was_read_wins(self):
+        real_receive = views.receive_chunk
+
+        def receive(*args):
+            part_path = real_receive(*args)
+            # Another request for the same offset appended first
+            with open(upload_abspath(self.upload), 'ab') as target:
+                target.write(self.DATA[:4])
+            MovieUpload.objects.filter(id=self.upload.id).update(offset=4)
+            return part_path
+
+        with mock.patch('streaming.views.receive_chunk', side_effect=receive):
+            response = self.patch(b'abcd', 0)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '4')
+        self.assertEqual(self.file_content(), self.DATA[:4])
+        self.assertEqual(self.part_files(), [])
+
+    def test_rewinding_a_crashed_append_abandons_the_streaming_ingest(self):
+        self.patch(self.DATA[:4], 0)
+        MovieUpload.objects.filter(id=self.upload.id).update(ingest_status='running')
+        with open(upload_abspath(self.upload), 'ab') as target:
+            target.write(b'half a chunk')
+
+        self.assertEqual(self.patch(self.DATA[4:8], 4).status_code, 204)
+        self.assertEqual(self.file_content(), self.DATA[:8])
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.ingest_status, 'failed')
+
+    def test_missing_checksum_and_oversized_chunks_are_rejected(self):
+        response = self.client.generic('PATCH', self.url, b'0123', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.patch(b'01234', 0).status_code, 413)
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.offset, 0)
+
+    def test_other_users_cannot_see_the_upload(self):
+        other = User.objects.create_user('other', password='pw', is_staff=True)
+        self.client.force_login(other)
+        self.assertEqual(self.client.head(self.url).status_code, 404)
+
+    def test_complete_requires_every_byte(self):
+        self.patch(self.DATA[:4], 0)
+        response = self.client.post(reverse('complete-upload', args=[self.upload.id]), {'checksum': self.final_checksum()})
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Movie.objects.exists())
+
+    def test_complete_requires_the_chained_checksum(self):
+        self.send_all()
+        response = self.client.post(reverse('complete-upload', args=[self.upload.id]), {'checksum': '0' * 64})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Movie.objects.exists())
+
+    def test_complete_creates_the_movie(self):
+        self.send_all()
+        genre = Genre.objects.create(name='drama')
+        response = self.client.post(reverse('complete-upload', args=[self.upload.id]), {
+            'checksum': self.final_checksum(),
+            'title': 'Chunked',
+            'description': 'Uploaded in chunks',
+            'trailerUrl': 'https://example.com/trailer',
+            'genres': [genre.id],
+            'release_year': 2020,
+            'duration_minutes': 90,
+            'poster': poster_file(),
+        })
+        self.assertEqual(response.status_code, 200, response.content)
+
+        movie = Movie.objects.get(title='Chunked')
+        self.assertEqual(movie.file.name, self.upload.file_path)
+        self.assertEqual(movie.status, 'uploaded')
+        self.upload.refresh_from_db()
+        self.assertEqual(self.upload.movie, movie)
+
+        # A completed upload takes no more chunks
+        self.assertEqual(self.patch(self.DATA[:4], 0).status_code, 409)
+
+
+class ParseRangeTests(SimpleTestCase):
+    def test_ranges(self):
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=990-2000', 1000), (990, 999))
+        self.assertEqual(parse_range('bytes=-2000', 1000), (0, 999))
+
+    def test_ignored_headers_serve_the_whole_file(self):
+        for header in (None, '', 'bytes=-', 'items=0-1', 'bytes=0-1,5-6', 'bytes=a-b'):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+    def test_unsatisfiable_ranges(self):
+        for header in ('bytes=1000-', 'bytes=5-4', 'bytes=-0'):
+            self.assertIs(parse_range(header, 1000), False, header)
+        self.assertIs(parse_range('bytes=-10', 0), False)
+
+
+class HLSServingTests(StreamingTestCase):
+    SEGMENT = b'0123456789'
+
+    def setUp(self):
+        super().setUp()
+        self.movie = Movie.objects.create(
+            title='Served', description='', release_year=2020, status='ready', hls_path='movies/hls/1/master.m3u8',
+        )
+        output_dir = hls_output_dir(self.movie.id)
+        os.makedirs(os.path.join(output_dir, '720p'))
+        with open(os.path.join(output_dir, MASTER_PLAYLIST), 'w') as playlist:
+            playlist.write('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1\n720p/index.m3u8\n')
+        with open(os.path.join(output_dir, '720p', 'segment_000.ts'), 'wb') as segment:
+            segment.write(self.SEGMENT)
+        self.token = make_playback_token(self.movie.id)
+
+    def get(self, name, token=None, **headers):
+        url = reverse('hls-file', args=[self.movie.id, name])
+        return self.client.get(url, {'token': token or self.token}, **headers)
+
+    def test_playlists_are_rewritten_with_the_token(self):
+        response = self.get(MASTER_PLAYLIST)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'720p/index.m3u8?token={self.token}', response.content.decode())
+        self.assertEqual(response['Cache-Control'], 'private, max-age=2')
+
+    def test_segments_are_privately_cached(self):
+        response = self.get('720p/segment_000.ts')
+        self.assertEqual(b''.join(response.streaming_content), self.SEGMENT)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=31536000, immutable')
+
+    def test_range_requests(self):
+        response = self.get('720p/segment_000.ts', HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+    def test_unsatisfiable_range_is_not_cached(self):
+        response = self.get('720p/segment_000.ts', HTTP_RANGE='bytes=50-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+    def test_etag_revalidation(self):
+        etag = self.get('720p/segment_000.ts')['ETag']
+        response = self.get('720p/segment_000.ts', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_missing_files_and_bad_tokens(self):
+        self.assertEqual(self.get('720p/segment_001.ts').status_code, 404)
+        self.assertEqual(self.get('../../files/secret.ts').status_code, 404)
+        self.assertEqual(self.get('720p/segment_000.ts', token='x-y').status_code, 403)
+
+
+@override_settings(PLAYBACK_TOKEN_TTL=600)
+class PlaybackTokenTests(StreamingTestCase):
+    def test_tokens_are_bound_to_the_movie(self):
+        token = make_playback_token(1)
+        self.assertTrue(check_playback_token(1, token))
+        self.assertFalse(check_playback_token(2, token))
+
+    def test_tampered_and_malformed_tokens(self):
+        expires, _, signature = make_playback_token(1).partition('-')
+        later = int_to_base36(base36_to_int(expires) + 3600)
+        self.assertFalse(check_playback_token(1, f'{later}-{signature}'))
+        for token in (None, '', 'garbage', '-', f'{expires}-'):
+            self.assertFalse(check_playback_token(1, token), token)
+
+    def test_tokens_expire(self):
+        token = make_playback_token(1, ttl=60)
+        with mock.patch('streaming.tokens.time.time', return_value=time.time() + 61):
+            self.assertFalse(check_playback_token(1, token))
+
+    def test_ttl_covers_the_runtime(self):
+        movie = Movie(id=1, status='ready', source_duration=7200.5)
+        self.assertEqual(playback_token_ttl(movie), 600 + 7200)
+        movie = Movie(id=1, status='ready', duration_minutes=600)
+        self.assertEqual(playback_token_ttl(movie), 600 + 36000)
+
+    def test_ttl_covers_the_rest_of_a_running_conversion(self):
+        movie = Movie(id=1, status='partially_ready', source_duration=3600)
+        self.assertEqual(playback_token_ttl(movie), 600 + 3600 + 3600)
+        cache.set(progress_key(1), {'eta': 5000})
+        self.assertEqual(playback_token_ttl(movie), 600 + 3600 + 5000)
+
+
+class SimilarityRebuildTests(StreamingTestCase):
+    def test_changes_share_one_debounced_rebuild(self):
+        with mock.patch('streaming.tasks.rebuild_movie_similarities.apply_async') as apply_async:
+            schedule_similarity_rebuild()
+            schedule_similarity_rebuild()
+        apply_async.assert_called_once_with(countdown=settings.SIMILAR_MOVIES_REBUILD_DELAY)
+
+    def test_a_change_after_the_rebuild_started_schedules_another(self):
+        with mock.patch('streaming.tasks.rebuild_movie_similarities.apply_async') as apply_async, \
+                mock.patch('streaming.tasks.rebuild_index', return_value=0):
+            schedule_similarity_rebuild()
+            rebuild_movie_similarities()
+            schedule_similarity_rebuild()
+        self.assertEqual(apply_async.call_count, 2)
+
+
+class SimilarMoviesTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.drama = Genre.objects.create(name='drama')
+        self.movie = Movie.objects.create(title='Dune', status='ready', release_year=2000)
+        self.movie.genres.set([self.drama])
+
+    def neighbour(self, title, score, status='ready', **fields):
+        movie = Movie.objects.create(title=title, status=status, release_year=fields.pop('release_year', 2000), **fields)
+        MovieSimilarity.objects.create(movie=self.movie, similar=movie, score=score)
+        return movie
+
+    def test_neighbours_are_read_in_one_query_best_first(self):
+        second = self.neighbour('Arrival', 0.5)
+        first = self.neighbour('Solaris', 0.9, status='partially_ready')
+        self.neighbour('Stalker', 0.1)
+        with self.assertNumQueries(1):
+            similar = get_similar_movies(self.movie, limit=2)
+            # Card fields are loaded with the row
+            [(movie.title, movie.poster, movie.release_year) for movie in similar]
+        self.assertEqual(similar, [first, second])
+
+    def test_only_playable_released_neighbours_are_listed(self):
+        ready = self.neighbour('Ready', 0.1)
+        for status in ('uploaded', 'processing', 'failed', 'deleting'):
+            self.neighbour(status, 0.9, status=status)
+        self.neighbour('Coming soon', 0.9, release_year=timezone.now().year + 1)
+        self.assertEqual(get_similar_movies(self.movie), [ready])
+
+    def test_movies_not_indexed_yet_get_the_latest_of_their_genres(self):
+        now = timezone.now()
+        comedy = Genre.objects.create(name='comedy')
+        older = Movie.objects.create(title='Older', status='ready', release_year=2000, upload_date=now - timedelta(days=2))
+        newer = Movie.objects.create(title='Newer', status='ready', release_year=2000, upload_date=now - timedelta(days=1))
+        failed = Movie.objects.create(title='Failed', status='failed', release_year=2000)
+        other = Movie.objects.create(title='Other genre', status='ready', release_year=2000)
+        for movie in (older, newer, failed):
+            movie.genres.set([self.drama, comedy])
+        other.genres.set([comedy])
+
+        with self.assertNumQueries(2):
+            similar = get_similar_movies(self.movie)
+        self.assertEqual(similar, [newer, older])
+
+    def test_a_movie_without_neighbours_or_genres(self):
+        self.movie.genres.clear()
+        Movie.objects.create(title='Arrival', status='ready', release_year=2000)
+        self.assertEqual(get_similar_movies(self.movie), [])
+
+
+class SimilarityIndexTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        scifi, horror, romance, comedy = (Genre.objects.create(name=name) for name in ('scifi', 'horror', 'romance', 'comedy'))
+        self.movies = {}
+        for title, description, genres in (
+            ('Star Wars: A New Hope', 'A farm boy joins the rebels against the galactic empire.', [scifi]),
+            ('Star Wars: The Empire Strikes Back', 'The rebels flee the empire across the galaxy.', [scifi]),
+            ('Alien', 'The crew of a space freighter is hunted by a creature.', [scifi, horror]),
+            ('Pride and Prejudice', 'Elizabeth Bennet meets the proud Mr Darcy.', [romance]),
+            ('Notting Hill', 'A London bookseller falls for a film star.', [romance, comedy]),
+        ):
+            movie = Movie.objects.create(title=title, description=description, status='ready')
+            movie.genres.set(genres)
+            self.movies[title] = movie.id
+
+    def neighbours(self, title):
+        rows = MovieSimilarity.objects.filter(movie_id=self.movies[title]).order_by('-score')
+        return [row.similar.title for row in rows]
+
+    def test_related_movies_rank_first(self):
+        rebuild_index()
+        self.assertEqual(self.neighbours('Star Wars: A New Hope')[:2], ['Star Wars: The Empire Strikes Back', 'Alien'])
+        self.assertEqual(self.neighbours('Pride and Prejudice')[0], 'Notting Hill')
+        for title in self.movies:
+            self.assertNotIn(title, self.neighbours(title))
+
+    def test_top_k_neighbours_are_kept(self):
+        def scores(title):
+            rows = MovieSimilarity.objects.filter(movie_id=self.movies[title]).order_by('-score')
+            return [round(score, 5) for score in rows.values_list('score', flat=True)]
+
+        rebuild_index()
+        everything = {title: scores(title) for title in self.movies}
+        with self.settings(SIMILAR_MOVIES_INDEX_SIZE=2):
+            rebuild_index()
+        for title in self.movies:
+            self.assertEqual(scores(title), everything[title][:2])
+        self.assertEqual(len(self.neighbours('Star Wars: A New Hope')), 2)
+
+    @override_settings(RECOMMENDER_EMBEDDING_DIM=3)
+    def test_reduced_embeddings(self):
+        # More features than dimensions: the truncated SVD runs
+        rebuild_index()
+        self.assertEqual(self.neighbours('Star Wars: A New Hope')[0], 'Star Wars: The Empire Strikes Back')
+
+    def test_rebuild_replaces_the_index(self):
+        rebuild_index()
+        Movie.objects.filter(title='Alien').delete()
+        rebuild_index()
+        self.assertNotIn('Alien', self.neighbours('Star Wars: A New Hope'))
+
+    def test_tiny_catalogs(self):
+        Movie.objects.all().delete()
+        self.assertEqual(rebuild_index(), 0)
+        Movie.objects.create(title='Dune', status='ready')
+        self.assertEqual(rebuild_index(), 0)
+        self.assertFalse(MovieSimilarity.objects.exists())
+
+    def test_movies_without_text_or_genres(self):
+        Movie.objects.all().delete()
+        for _ in range(3):
+            Movie.objects.create(title='', status='ready')
+        self.assertEqual(rebuild_index(), 0)
+
+
+class SuggestIndexTests(StreamingTestCase):
+    def test_only_playable_movies_are_suggested(self):
+        for status in ('uploaded', 'partially_ready', 'ready', 'failed', 'deleting'):
+            Movie.objects.create(title=f'Dune {status}', status=status)
+        titles = {title for _, title, _ in build_prefix_index().suggest('dune', 10)}
+        self.assertEqual(titles, {'Dune partially_ready', 'Dune ready'})
+
+    def test_status_changes_bump_the_version(self):
+        movie = Movie.objects.create(title='Dune', status='processing')
+        version = cache.get(SUGGEST_VERSION_KEY)
+        movie.status = 'ready'
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.save(update_fields=['status'])
+        self.assertNotEqual(cache.get(SUGGEST_VERSION_KEY), version)
+
+
+class SearchIndexTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.scifi = Genre.objects.create(name='science fiction')
+        self.drama = Genre.objects.create(name='drama')
+        self.dune = Movie.objects.create(title='Dune', description='Sand and spice on a desert planet.')
+        self.arrakis = Movie.objects.create(title='Arrakis', description='A documentary about the dune worms.')
+        self.drive = Movie.objects.create(title='Drive', description='A stunt driver in Los Angeles.')
+        self.dune.genres.set([self.scifi, self.drama])
+        self.drive.genres.set([self.drama])
+
+    def search(self, query, queryset=None):
+        return [movie.id for movie in search_movies(queryset or Movie.objects.all(), query)]
+
+    def indexed_rows(self, movie):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE} WHERE rowid = %s', [movie.id])
+            return cursor.fetchone()[0]
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('dune'), [self.dune.id, self.arrakis.id])
+
+    def test_words_match_as_prefixes(self):
+        self.assertEqual(self.search('dun'), [self.dune.id, self.arrakis.id])
+        self.assertEqual(self.search('dune spi'), [self.dune.id])
+        # Two letters only look at titles: "dr" finds Drive, not the drama or driver descriptions of others
+        self.assertEqual(self.search('dr'), [self.drive.id])
+
+    def test_genre_names_are_searchable(self):
+        self.assertEqual(self.search('science'), [self.dune.id])
+
+    def test_query_syntax_in_user_input_is_ignored(self):
+        for query in ('"dune', 'dune*', 'dune"*', '(dune)', 'dune:', '^dune', '"dune" +spice -'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query)[0], self.dune.id)
+        for query in ('', '"', '*', '()', '" OR "', '-+^:'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), [])
+        # FTS keywords typed as words are plain terms, not operators
+        self.assertEqual(self.search('dune OR drive'), [])
+        self.assertEqual(self.search('dune NOT spice'), [])
+        self.assertEqual(self.search('title:dune'), [])
+
+    def test_filters_already_on_the_queryset_are_kept(self):
+        self.assertEqual(self.search('dune', Movie.objects.exclude(id=self.dune.id)), [self.arrakis.id])
+
+    def test_filter_by_genres_lists_each_movie_once(self):
+        movies = filter_by_genres(Movie.objects.order_by('id'), [self.scifi.id, self.drama.id])
+        self.assertEqual(list(movies), [self.dune, self.drive])
+        self.assertEqual(list(filter_by_genres(search_movies(Movie.objects.all(), 'd'), [self.scifi.id])), [self.dune])
+
+    def test_index_follows_movie_changes(self):
+        movie = Movie.objects.create(title='Solaris', description='A space station.')
+        self.assertEqual(self.search('solaris'), [movie.id])
+
+        movie.title = 'Stalker'
+        movie.save()
+        self.assertEqual(self.search('solaris'), [])
+        self.assertEqual(self.search('stalker'), [movie.id])
+
+        movie.description = 'The zone.'
+        movie.save(update_fields=['description'])
+        self.assertEqual(self.search('zone'), [movie.id])
+        self.assertEqual(self.search('station'), [])
+
+        movie.delete()
+        self.assertEqual(self.search('stalker'), [])
+        self.assertEqual(self.indexed_rows(movie), 0)
+
+    def test_index_follows_genre_changes(self):
+        self.arrakis.genres.add(self.scifi)
+        self.assertEqual(set(self.search('fiction')), {self.dune.id, self.arrakis.id})
+        self.arrakis.genres.remove(self.scifi)
+        self.assertEqual(self.search('fiction'), [self.dune.id])
+
+        # From the genre side
+        self.scifi.movie_set.add(self.drive)
+        self.assertEqual(set(self.search('fiction')), {self.dune.id, self.drive.id})
+        self.scifi.movie_set.clear()
+        self.assertEqual(self.search('fiction'), [])
+
+        self.drama.name = 'thriller'
+        self.drama.save()
+        self.assertEqual(set(self.search('thriller')), {self.dune.id, self.drive.id})
+        self.drama.delete()
+        self.assertEqual(self.search('thriller'), [])
+
+    def test_result_pages_follow_the_rank(self):
+        for number in range(12):
+            Movie.objects.create(
+                title=f'Spice {number:02}', description='Spice trade.', status='ready', poster=poster_file()
+            )
+        Movie.objects.filter(id=self.dune.id).update(status='ready', poster=poster_file().name)
+
+        def page(cursor=None):
+            params = {'query': 'spice'}
+            if cursor:
+                params['cursor'] = cursor
+            response = self.client.get(reverse('movie-search'), params)
+            self.assertEqual(response.status_code, 200)
+            return response.context['page_obj']
+
+        first = page()
+        second = page(first.next_cursor)
+        ids = [movie.id for movie in first] + [movie.id for movie in second]
+        self.assertEqual(ids, self.search('spice', Movie.objects.catalog()))
+        self.assertEqual(len(ids), 13)
+        self.assertFalse(second.has_next())
+        self.assertEqual([movie.id for movie in page(second.previous_cursor)], [movie.id for movie in first])
+
+
+class CachedPageTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        # Only the cache invalidation is under test: keep the after-commit Celery hand-offs local
+        for target in ('streaming.tasks.schedule_similarity_rebuild', 'streaming.tasks.cleanup_movie_files.delay'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.genre = Genre.objects.create(name='drama')
+        self.movie = Movie.objects.create(title='Dune', status='ready', release_year=2000, poster=poster_file())
+
+    def get(self, name='movies-list'):
+        return self.client.get(reverse(name))
+
+    def assertCached(self, response):
+        # A cached page is sent as is: no template is rendered
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context)
+
+    def assertRendered(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.context)
+
+    def save(self, instance, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            instance.save(**kwargs)
+
+    def test_anonymous_pages_are_served_from_the_cache(self):
+        self.assertRendered(self.get())
+        with self.assertNumQueries(0):
+            response = self.get()
+        self.assertCached(response)
+        self.assertContains(response, 'Dune')
+
+    def test_signed_in_users_are_not_served_cached_pages(self):
+        self.get()
+        self.client.force_login(User.objects.create_user('viewer', password='pw'))
+        self.assertRendered(self.get())
+        self.assertRendered(self.get())
+
+    def test_editing_a_movie_card_invalidates_the_pages(self):
+        self.get()
+        self.movie.title = 'Dune: Part Two'
+        self.save(self.movie, update_fields=['title'])
+        response = self.get()
+        self.assertRendered(response)
+        self.assertContains(response, 'Dune: Part Two')
+
+    def test_conversion_progress_keeps_the_pages(self):
+        self.get()
+        self.movie.status = 'partially_ready'
+        self.movie.hls_path = 'hls/1/master.m3u8'
+        self.save(self.movie, update_fields=['status', 'hls_path'])
+        self.movie.width = 1920
+        self.save(self.movie, update_fields=['width'])
+        self.assertCached(self.get())
+
+    def test_queueing_a_movie_for_deletion_invalidates_the_pages(self):
+        self.get()
+        self.movie.status = 'deleting'
+        self.save(self.movie, update_fields=['status'])
+        response = self.get()
+        self.assertRendered(response)
+        self.assertNotContains(response, 'Dune')
+
+    def test_new_and_deleted_movies_invalidate_the_pages(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Movie.objects.create(title='Arrival', release_year=2000, poster=poster_file())
+        self.assertContains(self.get(), 'Arrival')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movie.delete()
+        self.assertNotContains(self.get(), 'Dune')
+
+    def test_genre_changes_invalidate_the_pages(self):
+        self.get('genres-list')
+        self.genre.name = 'thriller'
+        self.save(self.genre)
+        self.assertContains(self.get('genres-list'), 'Thriller')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.movie.genres.add(self.genre)
+        self.assertRendered(self.get('genres-list'))
+
+    def test_the_cursor_is_part_of_the_key(self):
+        factory = RequestFactory()
+
+        def key(params):
+            return page_cache_key(CachedPageTests, (), {}, factory.get('/movies/', params), ('cursor',))
+
+        self.assertNotEqual(key({}), key({'cursor': 'abc'}))
+        self.assertNotEqual(key({'cursor': 'abc'}), key({'cursor': 'abd'}))
+        # Other parameters (tracking tags...) share the entry
+        self.assertEqual(key({'cursor': 'abc'}), key({'cursor': 'abc', 'utm_source': 'mail'}))
+
+
+class GenreMenuTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.drama = Genre.objects.create(name='drama')
+        Genre.objects.create(name='comedy')
+        self.request = RequestFactory().get('/')
+
+    def menu(self):
+        return sorted(genre.name for genre in genres_list(self.request)['all_genres'])
+
+    def test_the_menu_is_only_looked_up_when_rendered(self):
+        with self.assertNumQueries(0):
+            genres_list(self.request)
+
+    def test_a_warm_cache_serves_the_menu_without_queries(self):
+        self.assertEqual(self.menu(), ['Comedy', 'Drama'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.menu(), ['Comedy', 'Drama'])
+        # Another process: its own local cache is cold, the shared cache is not
+        local_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.menu(), ['Comedy', 'Drama'])
+
+    def test_saving_or_deleting_a_genre_invalidates_the_menu(self):
+        self.menu()
+        with self.captureOnCommitCallbacks(execute=True):
+            Genre.objects.create(name='thriller')
+        self.assertEqual(self.menu(), ['Comedy', 'Drama', 'Thriller'])
+
+        self.drama.name = 'documentary'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drama.save()
+        self.assertEqual(self.menu(), ['Comedy', 'Documentary', 'Thriller'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.drama.delete()
+        self.assertEqual(self.menu(), ['Comedy', 'Thriller'])
+
+
+@override_settings(CACHE_BUILD_LOCK_TIMEOUT=5)
+class BuildOnceTests(SimpleTestCase):
+    def setUp(self):
+        self.test_settings = override_settings(CACHES=TEST_CACHES)
+        self.test_settings.enable()
+        self.addCleanup(self.test_settings.disable)
+        cache.clear()
+
+    def test_concurrent_callers_share_one_build(self):
+        calls = []
+        start = threading.Barrier(5)
+        results = []
+
+        def builder():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'page'
+
+        def request():
+            start.wait()
+            results.append(build_once('page:key', 1, builder, None))
+
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['page'] * 5)
+        self.assertEqual(cache.get('page:key', version=1), 'page')
+
+    @override_settings(CACHE_BUILD_LOCK_TIMEOUT=0.2)
+    def test_waiters_build_it_themselves_when_the_builder_died(self):
+        cache.add('page:key:lock', 1, 60, version=1)
+        self.assertEqual(build_once('page:key', 1, lambda: 'page', None), 'page')
+
+
+class KeysetPaginatorTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        # Duplicate titles: the id tie-breaker must keep pages from skipping or repeating rows
+        for title in ('b', 'a', 'c', 'a', 'b', 'a', 'd'):
+            Movie.objects.create(title=title)
+        self.expected = list(Movie.objects.order_by('title', 'id').values_list('id', flat=True))
+
+    def pages(self, cursor=None):
+        paginator = KeysetPaginator(Movie.objects.order_by('title'), 3, QueryDict('q=x'))
+        page = paginator.get_page(cursor)
+        return page, [movie.id for movie in page]
+
+    def test_forward_and_back(self):
+        first, ids = self.pages()
+        self.assertEqual(ids, self.expected[:3])
+        self.assertFalse(first.has_previous())
+        second, ids = self.pages(first.next_cursor)
+        self.assertEqual(ids, self.expected[3:6])
+        self.assertEqual((second.start_index(), second.end_index()), (4, 6))
+        third, ids = self.pages(second.next_cursor)
+        self.assertEqual(ids, self.expected[6:])
+        self.assertFalse(third.has_next())
+
+        back, ids = self.pages(third.previous_cursor)
+        self.assertEqual(ids, self.expected[3:6])
+        self.assertEqual(back.start_index(), 4)
+        back, ids = self.pages(back.previous_cursor)
+        self.assertEqual(ids, self.expected[:3])
+        self.assertFalse(back.has_previous())
+
+    def test_cursor_round_trip(self):
+        values = ['Amélie', 42]
+        self.assertEqual(decode_cursor(encode_cursor(values, 'n', 15)), (values, 'n', 15))
+
+    def test_mangled_cursors_restart_at_the_first_page(self):
+        for cursor in ('garbage', encode_cursor(['a'], 'n', 3), 'eyJ2IjoxfQ', encode_cursor(['a', 'notanint'], 'n', 3)):
+            page, ids = self.pages(cursor)
+            self.assertEqual(ids, self.expected[:3])
+            self.assertEqual(page.start_index(), 1)
+
+    def test_anonymous_catalog_pages_survive_bad_cursors(self):
+        # The cursor is checked before any row is read, so an empty catalog will do
+        Movie.objects.all().delete()
+        for cursor in (encode_cursor(['a', 'notanint'], 'n', 3), encode_cursor([None, {}], 'p', -1)):
+            self.assertEqual(self.client.get(reverse('movies-list'), {'cursor': cursor}).status_code, 200)
+
+    def test_querystring_keeps_the_other_parameters(self):
+        page, _ = self.pages()
+        params = QueryDict(page.next_querystring())
+        self.assertEqual(params['q'], 'x')
+        self.assertEqual(params['cursor'], page.next_cursor)
+
+
+class MovieDeletionTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.movie = Movie.objects.create(
+            title='Dune', status='ready', poster=poster_file(), file=SimpleUploadedFile('dune.mp4', b'movie'),
+        )
+        self.file_names = [self.movie.file.name, self.movie.poster.name]
+        # Three renditions of two segments, and a chunk work folder
+        for variant in ('360p', '720p', '1080p'):
+            os.makedirs(os.path.join(hls_output_dir(self.movie.id), variant))
+            for segment in ('segment_000.ts', 'segment_001.ts'):
+                with open(os.path.join(hls_output_dir(self.movie.id), variant, segment), 'wb') as segment_file:
+                    segment_file.write(b'ts')
+        os.makedirs(chunk_output_dir(hls_work_dir(self.movie.id), 0))
+
+    def files_left(self):
+        names = [name for name in self.file_names if os.path.exists(os.path.join(self.media_root, name))]
+        return names + [path for path in (hls_output_dir(self.movie.id), hls_work_dir(self.movie.id)) if os.path.exists(path)]
+
+    def test_delete_only_hides_the_movie_and_queues_the_task(self):
+        admin = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.client.force_login(admin)
+        with mock.patch('streaming.views.delete_movie.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.get(reverse('delete-movie', args=[self.movie.id]))
+        self.assertRedirects(response, reverse('admin-movies-list'), fetch_redirect_response=False)
+        delay.assert_called_once_with(self.movie.id)
+        self.movie.refresh_from_db()
+        self.assertEqual(self.movie.status, 'deleting')
+        self.assertEqual(len(self.files_left()), 4)
+        self.assertFalse(Movie.objects.live().filter(id=self.movie.id).exists())
+
+    def test_delete_movie_queues_the_cleanup_of_its_files(self):
+        Movie.objects.filter(id=self.movie.id).update(status='deleting')
+        with mock.patch('streaming.tasks.cleanup_movie_files.delay') as delay:
+            delete_movie(self.movie.id)
+            delete_movie(self.movie.id + 1)
+        delay.assert_called_once_with(self.movie.id, self.file_names)
+
+    def test_the_row_goes_after_its_files(self):
+        Movie.objects.filter(id=self.movie.id).update(status='deleting')
+        with mock.patch('streaming.tasks.cleanup_movie_files.delay') as delay:
+            with self.settings(MEDIA_CLEANUP_BATCH_SIZE=4):
+                cleanup_movie_files(self.movie.id, self.file_names)
+                # Two of six segments left: the row stays and a fresh task continues
+                self.assertTrue(Movie.objects.filter(id=self.movie.id).exists())
+                delay.assert_called_once_with(self.movie.id)
+                self.assertEqual(self.files_left(), [hls_output_dir(self.movie.id), hls_work_dir(self.movie.id)])
+
+                cleanup_movie_files(self.movie.id)
+        self.assertEqual(self.files_left(), [])
+        self.assertFalse(Movie.objects.filter(id=self.movie.id).exists())
+        # Deleting the row itself queued nothing more
+        self.assertEqual(delay.call_count, 1)
+
+    def test_cleanup_can_run_twice(self):
+        Movie.objects.filter(id=self.movie.id).update(status='deleting')
+        cleanup_movie_files(self.movie.id, self.file_names)
+        cleanup_movie_files(self.movie.id, self.file_names)
+        self.assertEqual(self.files_left(), [])
+        self.assertFalse(Movie.objects.filter(id=self.movie.id).exists())
+
+    def test_filesystem_errors_are_retried(self):
+        Movie.objects.filter(id=self.movie.id).update(status='deleting')
+        with mock.patch('streaming.tasks.default_storage.delete', side_effect=[OSError('busy'), None, None]) as delete:
+            result = cleanup_movie_files.apply(args=(self.movie.id, self.file_names))
+        self.assertTrue(result.successful())
+        self.assertEqual(delete.call_count, 3)
+        self.assertFalse(Movie.objects.filter(id=self.movie.id).exists())
+
+    def test_movies_deleted_elsewhere_still_lose_their_files(self):
+        movie_id = self.movie.id
+        with mock.patch('streaming.tasks.cleanup_movie_files.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.movie.delete()
+        delay.assert_called_once_with(movie_id, self.file_names)
+
+    def test_lost_deletions_are_queued_again(self):
+        Movie.objects.filter(id=self.movie.id).update(status='deleting')
+        with mock.patch('streaming.tasks.delete_movie.delay') as delay, \
+                mock.patch('streaming.tasks.collect_media_garbage') as collect:
+            collect.return_value.expired_uploads = 0
+            collect.return_value.categories = {}
+            collect_orphaned_media()
+        delay.assert_called_once_with(self.movie.id)
+
+
+@override_settings(HLS_SEGMENT_SECONDS=6)
+class StreamIngestTests(StreamingTestCase):
+    # Only the 360p rung fits the source
+    SOURCE = {'height': 360, 'has_audio': True, 'duration': 12.0}
+
+    def setUp(self):
+        super().setUp()
+        admin = User.objects.create_user('admin', password='pw', is_staff=True)
+        self.upload = MovieUpload.objects.create(
+            user=admin, filename='dune.mkv', file_path='movies/files/dune.mkv', size=100, offset=100,
+            ingest_status='running',
+        )
+        self.write_source(100)
+        self.commands = []
+
+    def write_source(self, size):
+        os.makedirs(os.path.dirname(upload_abspath(self.upload)), exist_ok=True)
+        with open(upload_abspath(self.upload), 'wb') as source:
+            source.write(b'x' * size)
+
+    def fake_ffmpeg(self, cmd, *args, **kwargs):
+        self.commands.append(cmd)
+        write_hls_output(ingest_output_dir(self.upload.id), [6.0, 6.0])
+
+    def ingest(self):
+        with mock.patch('streaming.tasks.probe_source', return_value=self.SOURCE), \
+                mock.patch('streaming.tasks.run_ffmpeg', side_effect=self.fake_ffmpeg), \
+                mock.patch('streaming.tasks.analyse_source'), \
+                mock.patch('streaming.tasks.convert_movie_to_hls.delay') as convert:
+            ingest_upload_to_hls(self.upload.id)
+        self.upload.refresh_from_db()
+        return convert
+
+    def complete(self):
+        movie = Movie.objects.create(title='Dune', status='processing', file=self.upload.file_path)
+        MovieUpload.objects.filter(id=self.upload.id).update(movie=movie)
+        return movie
+
+    def test_ffmpeg_reads_up_to_the_upload_size(self):
+        self.ingest()
+        cmd = self.commands[0]
+        self.assertEqual(cmd[cmd.index('-i') + 1], f'subfile,,start,0,end,100,,:file:{upload_abspath(self.upload)}')
+        self.assertIn('-follow', cmd[:cmd.index('-i')])
+
+    def test_output_finished_after_completion_waits_for_adoption(self):
+        self.ingest()
+        self.assertEqual(self.upload.ingest_status, 'finished')
+        self.assertTrue(os.path.exists(os.path.join(ingest_output_dir(self.upload.id), MASTER_PLAYLIST)))
+
+    def test_output_finished_after_completion_is_adopted(self):
+        movie = self.complete()
+        convert = self.ingest()
+        convert.assert_not_called()
+        self.assertEqual(self.upload.ingest_status, 'finished')
+        movie.refresh_from_db()
+        self.assertEqual(movie.status, 'ready')
+        self.assertEqual(movie.hls_path, f'movies/hls/{movie.id}/{MASTER_PLAYLIST}')
+        self.assertFalse(os.path.exists(ingest_output_dir(self.upload.id)))
+        segments, ended = read_media_playlist(os.path.join(hls_output_dir(movie.id), '360p', VARIANT_PLAYLIST))
+        self.assertEqual((len(segments), ended), (2, True))
+
+    def test_adopting_a_finished_ingest(self):
+        self.ingest()
+        movie = self.complete()
+        with mock.patch('streaming.tasks.analyse_source'):
+            adopt_ingest_output(self.upload.id)
+        movie.refresh_from_db()
+        self.assertEqual(movie.status, 'ready')
+        self.assertFalse(os.path.exists(ingest_output_dir(self.upload.id)))
+        self.assertTrue(os.path.exists(os.path.join(hls_output_dir(movie.id), MASTER_PLAYLIST)))
+
+    def test_an_encode_that_stopped_short_of_the_upload_size_is_dropped(self):
+        # FFmpeg gave up on a stalled upload (it exits cleanly then too): the file was shorter than the upload
+        self.write_source(60)
+        movie = self.complete()
+        convert = self.ingest()
+        self.assertEqual(self.upload.ingest_status, 'failed')
+        self.assertFalse(os.path.exists(ingest_output_dir(self.upload.id)))
+        convert.assert_called_once_with(movie.id)
+
+    def test_an_incomplete_encode_is_dropped(self):
+        self.SOURCE = dict(self.SOURCE, duration=30.0)
+        self.ingest()
+        self.assertEqual(self.upload.ingest_status, 'failed')
+        self.assertFalse(os.path.exists(ingest_output_dir(self.upload.id)))
+
+
+@override_settings(MEDIA_GC_GRACE_SECONDS=3600)
+class MediaGarbageTests(StreamingTestCase):
+    OLD = time.time() - 2 * 3600
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('admin', password='pw', is_staff=True)
+
+    def write(self, name, old=True):
+        path = os.path.join(self.media_root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(b'data')
+        if old:
+            # Per-movie folders count as touched by their own mtime too
+            for touched in (path, os.path.dirname(path)):
+                os.utime(touched, (self.OLD, self.OLD))
+        return path
+
+    def upload(self, idle_hours):
+        upload = MovieUpload.objects.create(
+            user=self.user, filename='movie.mp4', file_path='movies/files/upload.mp4', size=10, offset=4,
+        )
+        MovieUpload.objects.filter(id=upload.id).update(updated_at=timezone.now() - timedelta(hours=idle_hours))
+        return upload, self.write(upload.file_path), self.write(os.path.join(ingest_output_dir(upload.id), 'index.m3u8'))
+
+    def test_categories(self):
+        movie = Movie.objects.create(title='Dune', status='ready', poster=poster_file())
+        failed = Movie.objects.create(title='Arrival', status='failed')
+        poster = os.path.join(self.media_root, movie.poster.name)
+        os.utime(poster, (self.OLD, self.OLD))
+        kept = [poster, self.write(os.path.join(hls_output_dir(movie.id), MASTER_PLAYLIST))]
+        removed = [
+            self.write('movies/posters/replaced.png'),
+            self.write('movies/files/orphan.mp4'),
+            self.write('profile_pictures/old.png'),
+            self.write(os.path.join(hls_output_dir(failed.id), MASTER_PLAYLIST)),
+            self.write(os.path.join(hls_work_dir(movie.id), 'chunk.ts')),
+        ]
+
+        report = collect_media_garbage()
+        for path in kept:
+            self.assertTrue(os.path.exists(path), path)
+        for path in removed:
+            self.assertFalse(os.path.exists(path), path)
+        self.assertEqual(report.categories['hls']['removed'], 1)
+        self.assertEqual({movie_id for movie_id, _ in report.movies()}, {movie.id, failed.id})
+
+    def test_grace_period(self):
+        fresh = self.write('movies/posters/fresh.png', old=False)
+        report = collect_media_garbage()
+        self.assertTrue(os.path.exists(fresh))
+        self.assertEqual((report.categories['posters']['orphans'], report.categories['posters']['removed']), (1, 0))
+
+    def test_abandoned_uploads_expire(self):
+        upload, upload_file, ingest_playlist = self.upload(idle_hours=2)
+        report = collect_media_garbage()
+        self.assertEqual(report.expired_uploads, 1)
+        self.assertFalse(MovieUpload.objects.filter(id=upload.id).exists())
+        self.assertFalse(os.path.exists(upload_file))
+        self.assertFalse(os.path.exists(ingest_playlist))
+
+    def test_active_uploads_and_dry_runs_keep_everything(self):
+        upload, upload_file, ingest_playlist = self.upload(idle_hours=0)
+        self.assertEqual(collect_media_garbage().expired_uploads, 0)
+        MovieUpload.objects.filter(id=upload.id).update(updated_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(collect_media_garbage(dry_run=True).expired_uploads, 1)
+        self.assertTrue(MovieUpload.objects.filter(id=upload.id).exists())
+        self.assertTrue(os.path.exists(upload_file))
+        self.assertTrue(os.path.exists(ingest_playlist))
+
+    def test_bucket_prefixes_of_failed_and_deleted_movies_are_removed(self):
+        movie = Movie.objects.create(title='Dune', status='ready')
+        failed = Movie.objects.create(title='Arrival', status='failed')
+        storage = mock.Mock(is_local=False)
+        storage.movie_ids.return_value = [movie.id, failed.id, failed.id + 1]
+        storage.movie_usage.return_value = (100, self.OLD)
+        with mock.patch('streaming.media_gc.get_hls_storage', return_value=storage):
+            report = collect_media_garbage()
+        self.assertEqual(sorted(call.args[0] for call in storage.clear.call_args_list), [failed.id, failed.id + 1])
+        self.assertEqual(report.categories['hls_bucket']['removed_bytes'], 200)
+
+
+def write_chunk(work_dir, index, durations, variant='360p', fmp4=False, bandwidth=1000):
+    """A chunk's HLS output as FFmpeg writes it: one variant playlist, its segments and a master playlist."""
+    write_hls_output(chunk_output_dir(work_dir, index), durations, variant, fmp4, bandwidth, init_tag=index)
+
+
+def write_hls_output(output_dir, durations, variant='360p', fmp4=False, bandwidth=1000, init_tag=0):
+    variant_dir = os.path.join(output_dir, variant)
+    os.makedirs(variant_dir)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7' if fmp4 else '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6']
+    if fmp4:
+        lines.append('#EXT-X-MAP:URI="init.mp4"')
+        with open(os.path.join(variant_dir, 'init.mp4'), 'wb') as init:
+            init.write(b'init %d' % init_tag)
+    for position, duration in enumerate(durations):
+        name = f'segment_{position:03d}.{"m4s" if fmp4 else "ts"}'
+        with open(os.path.join(variant_dir, name), 'wb') as segment:
+            segment.write(b'x' * int(duration * 100))
+        lines += [f'#EXTINF:{duration:.6f},', name]
+    lines.append('#EXT-X-ENDLIST')
+    with open(os.path.join(variant_dir, VARIANT_PLAYLIST), 'w') as playlist:
+        playlist.write('\n'.join(lines) + '\n')
+    with open(os.path.join(output_dir, MASTER_PLAYLIST), 'w') as master:
+        master.write(
+            '#EXTM3U\n#EXT-X-VERSION:3\n'
+            f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},AVERAGE-BANDWIDTH={bandwidth},RESOLUTION=640x360,CODECS="avc1.4d4028,mp4a.40.2"\n'
+            f'{variant}/index.m3u8\n'
+        )
+
+
+@override_settings(HLS_SEGMENT_SECONDS=6)
+class ChunkedConversionTests(SimpleTestCase):
+    RENDITIONS = [{'name': '360p', 'height': 360}]
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def stitched(self, chunk_count, ended=True):
+        stitch_chunks(self.work_dir, self.output_dir, chunk_count, self.RENDITIONS, ended=ended)
+        with open(os.path.join(self.output_dir, '360p', VARIANT_PLAYLIST)) as playlist:
+            return playlist.read()
+
+    def test_splits_fall_on_the_segment_grid(self):
+        # Keyframes every 2.5 s: only multiples of 30 s are on both grids
+        keyframes = [n * 2.5 for n in range(100)]
+        self.assertEqual(plan_chunk_splits(keyframes, 20), [30.0, 60.0, 90.0, 120.0, 150.0, 180.0, 210.0, 240.0])
+        self.assertEqual(plan_chunk_splits(keyframes, 50), [60.0, 120.0, 180.0, 240.0])
+
+    def test_splits_are_measured_from_the_first_keyframe(self):
+        keyframes = [0.5 + n * 2 for n in range(40)]
+        self.assertEqual(plan_chunk_splits(keyframes, 20), [24.5, 48.5, 72.5])
+        self.assertEqual(chunk_starts(keyframes, [24.5, 48.5]), [0.0, 24.0, 48.0])
+
+    def test_rounding_is_tolerated_but_off_grid_keyframes_are_not(self):
+        self.assertEqual(plan_chunk_splits([0, 23.9, 24.0004, 30.1], 20), [24.0004])
+        self.assertEqual(plan_chunk_splits([0, 13.7, 25.1, 31.3], 10), [])
+        self.assertEqual(plan_chunk_splits([], 10), [])
+
+    def test_chunks_only_pass_frames_through_with_an_offset(self):
+        single = build_hls_command('in.mkv', 'out')
+        self.assertNotIn('-output_ts_offset', single)
+        self.assertNotIn('-fps_mode', single)
+        chunk = build_hls_command('in.mkv', 'out', output_ts_offset=24)
+        self.assertEqual(chunk[chunk.index('-output_ts_offset') + 1], '24.000000')
+        self.assertEqual(chunk[chunk.index('-fps_mode') + 1], 'passthrough')
+        self.assertLess(chunk.index('-output_ts_offset'), chunk.index('-f'))
+
+    def test_segments_are_renumbered_into_one_timeline(self):
+        write_chunk(self.work_dir, 0, [6, 6])
+        write_chunk(self.work_dir, 1, [6, 4.5])
+        playlist = self.stitched(2)
+        self.assertNotIn('#EXT-X-DISCONTINUITY', playlist)
+        self.assertTrue(playlist.rstrip().endswith('#EXT-X-ENDLIST'))
+        self.assertIn('#EXT-X-PLAYLIST-TYPE:VOD', playlist)
+        segments, ended = parse_media_playlist(playlist.splitlines())
+        self.assertTrue(ended)
+        self.assertEqual([segment['uri'] for segment in segments], [f'segment_{n:03d}.ts' for n in range(4)])
+        self.assertEqual([segment['duration'] for segment in segments], [6, 6, 6, 4.5])
+        for segment in segments:
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, '360p', segment['uri'])))
+
+    def test_fmp4_chunks_keep_their_init_segment(self):
+        write_chunk(self.work_dir, 0, [6, 6], fmp4=True)
+        write_chunk(self.work_dir, 1, [6], fmp4=True)
+        playlist = self.stitched(2)
+        segments, _ = parse_media_playlist(playlist.splitlines())
+        self.assertEqual([segment['map'] for segment in segments], ['init_000.mp4', 'init_000.mp4', 'init_001.mp4'])
+        self.assertEqual(playlist.count('#EXT-X-MAP'), 2)
+        self.assertIn('#EXT-X-VERSION:7', playlist)
+        with open(os.path.join(self.output_dir, '360p', 'init_001.mp4'), 'rb') as init:
+            self.assertEqual(init.read(), b'init 1')
+
+    def test_finished_prefix_is_an_event_playlist_and_restitching_is_safe(self):
+        write_chunk(self.work_dir, 0, [6, 6])
+        write_chunk(self.work_dir, 1, [6])
+        playlist = self.stitched(1, ended=False)
+        self.assertIn('#EXT-X-PLAYLIST-TYPE:EVENT', playlist)
+        self.assertNotIn('#EXT-X-ENDLIST', playlist)
+
+        # The prefix segments were already moved: stitching again finds them in place
+        segments, ended = parse_media_playlist(self.stitched(2).splitlines())
+        self.assertTrue(ended)
+        self.assertEqual(len(segments), 3)
+        for segment in segments:
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, '360p', segment['uri'])))
+
+    def test_master_bandwidth_covers_every_chunk(self):
+        write_chunk(self.work_dir, 0, [6, 6], bandwidth=1)
+        write_chunk(self.work_dir, 1, [2], bandwidth=1)
+        self.stitched(2)
+        with open(os.path.join(self.output_dir, MASTER_PLAYLIST)) as master:
+            text = master.read()
+        # Segments hold 100 bytes per second of media: 800 bit/s, whichever chunk they came from
+        self.assertIn('BANDWIDTH=800,', text)
+        self.assertIn('AVERAGE-BANDWIDTH=800,', text)
+        self.assertIn('CODECS="avc1.4d4028,mp4a.40.2"', text)
+        self.assertIn('\n360p/index.m3u8\n', text)
+
+
+LADDER = [
+    {'name': '1080p', 'height': 1080, 'video_bitrate': '5000k', 'maxrate': '5350k', 'bufsize': '7500k', 'audio_bitrate': '192k'},
+    {'name': '720p', 'height': 720, 'video_bitrate': '2800k', 'maxrate': '2996k', 'bufsize': '4200k', 'audio_bitrate': '128k'},
+    {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'maxrate': '856k', 'bufsize': '1200k', 'audio_bitrate': '96k'},
+]
+
+
+def option(cmd, name):
+    """Value following `name` in an FFmpeg command."""
+    return cmd[cmd.index(name) + 1]
+
+
+@override_settings(HLS_RENDITIONS=LADDER, HLS_SEGMENT_SECONDS=6, FFMPEG_PATH='ffmpeg')
+class RenditionLadderTests(SimpleTestCase):
+    def names(self, renditions):
+        return [rendition['name'] for rendition in renditions]
+
+    def test_rungs_taller_than_the_source_are_dropped(self):
+        self.assertEqual(self.names(get_renditions()), ['1080p', '720p', '360p'])
+        self.assertEqual(self.names(get_renditions(1080)), ['1080p', '720p', '360p'])
+        self.assertEqual(self.names(get_renditions(800)), ['720p', '360p'])
+        self.assertEqual(self.names(get_renditions(360)), ['360p'])
+        # Smaller than every rung: the smallest one is kept, never an empty ladder
+        self.assertEqual(self.names(get_renditions(240)), ['360p'])
+
+    def test_one_variant_per_rung(self):
+        cmd = build_hls_command('in.mp4', '/out', get_renditions(720))
+        self.assertEqual(option(cmd, '-var_stream_map'), 'v:0,a:0,name:720p v:1,a:1,name:360p')
+        self.assertEqual(
+            option(cmd, '-filter_complex'), '[0:v]split=2[v0][v1];[v0]scale=-2:720[v0out];[v1]scale=-2:360[v1out]'
+        )
+        self.assertEqual((option(cmd, '-b:v:0'), option(cmd, '-b:v:1')), ('2800k', '800k'))
+        self.assertEqual((option(cmd, '-b:a:0'), option(cmd, '-b:a:1')), ('128k', '96k'))
+        self.assertEqual(cmd.count('0:a:0'), 2)
+        self.assertEqual(option(cmd, '-master_pl_name'), MASTER_PLAYLIST)
+        self.assertEqual(cmd[-1], os.path.join('/out', '%v', VARIANT_PLAYLIST))
+
+    def test_sources_without_audio_map_video_only(self):
+        cmd = build_hls_command('in.mp4', '/out', get_renditions(720), has_audio=False)
+        self.assertEqual(option(cmd, '-var_stream_map'), 'v:0,name:720p v:1,name:360p')
+        self.assertNotIn('0:a:0', cmd)
+        self.assertNotIn('-c:a:0', cmd)
+
+    def test_keyframes_are_forced_on_segment_boundaries(self):
+        cmd = build_hls_command('in.mp4', '/out', get_renditions())
+        self.assertEqual(option(cmd, '-force_key_frames'), 'expr:gte(t,n_forced*6)')
+        self.assertEqual(option(cmd, '-hls_time'), '6')
+        self.assertEqual(option(cmd, '-sc_threshold'), '0')
+
+
+def ffprobe_output(video=None, audio=None, duration='120.5', bit_rate='2500000'):
+    """ffprobe -show_format -show_streams JSON for one video and an optional audio stream."""
+    video = {'codec_type': 'video', 'codec_name': 'h264', 'profile': 'High', 'pix_fmt': 'yuv420p',
+             'width': 1920, 'height': 1080, **(video or {})}
+    streams = [video] + ([{'codec_type': 'audio', 'codec_name': 'aac', **audio}] if audio is not None else [])
+    return json.dumps({'streams': streams, 'format': {'duration': duration, 'bit_rate': bit_rate}})
+
+
+@override_settings(HLS_PASSTHROUGH_MAX_KEYFRAME_INTERVAL=10, HLS_SEGMENT_SECONDS=6,
+                   FFMPEG_PATH='ffmpeg', FFPROBE_PATH='ffprobe')
+class ConversionModeTests(SimpleTestCase):
+    def probe(self, **kwargs):
+        completed = subprocess.CompletedProcess([], 0, stdout=ffprobe_output(**kwargs))
+        with mock.patch('streaming.transcode.subprocess.run', return_value=completed):
+            return probe_source('in.mp4')
+
+    def test_probe_reads_the_first_video_and_audio_stream(self):
+        self.assertEqual(self.probe(audio={'codec_name': 'mp3'}), {
+            'video_codec': 'h264', 'video_profile': 'High', 'pix_fmt': 'yuv420p', 'width': 1920, 'height': 1080,
+            'audio_codec': 'mp3', 'has_audio': True, 'duration': 120.5, 'bitrate': 2500000,
+        })
+        source = self.probe()
+        self.assertFalse(source['has_audio'])
+        self.assertEqual(source['audio_codec'], '')
+
+    def test_h264_with_aac_or_no_audio_is_remuxed(self):
+        self.assertEqual(choose_conversion_mode(self.probe(audio={}), 4), MODE_COPY)
+        self.assertEqual(choose_conversion_mode(self.probe(), 4), MODE_COPY)
+
+    def test_other_audio_is_reencoded_alone(self):
+        self.assertEqual(choose_conversion_mode(self.probe(audio={'codec_name': 'ac3'}), 4), MODE_AUDIO)
+
+    def test_incompatible_video_is_fully_converted(self):
+        for video in ({'codec_name': 'hevc'}, {'profile': 'High 10'}, {'pix_fmt': 'yuv444p'}):
+            with self.subTest(video=video):
+                self.assertEqual(choose_conversion_mode(self.probe(video=video, audio={}), 4), MODE_FULL)
+
+    def test_sparse_keyframes_are_fully_converted(self):
+        source = self.probe(audio={})
+        self.assertEqual(choose_conversion_mode(source, 10), MODE_COPY)
+        self.assertEqual(choose_conversion_mode(source, 10.5), MODE_FULL)
+
+    def test_keyframe_interval_counts_the_tail(self):
+        self.assertEqual(max_keyframe_interval([0.0, 4.0, 8.0], 20.0), 12.0)
+        self.assertEqual(max_keyframe_interval([0.0, 5.0, 8.0], 8.0), 5.0)
+        self.assertEqual(max_keyframe_interval([], 30.0), 30.0)
+
+    def test_passthrough_copies_the_video(self):
+        cmd = build_passthrough_command('in.mp4', '/out')
+        self.assertEqual(option(cmd, '-c:v'), 'copy')
+        self.assertEqual(option(cmd, '-c:a'), 'copy')
+        self.assertEqual(option(cmd, '-var_stream_map'), f'v:0,a:0,name:{PASSTHROUGH_VARIANT}')
+
+        cmd = build_passthrough_command('in.mp4', '/out', reencode_audio=True)
+        self.assertEqual((option(cmd, '-c:v'), option(cmd, '-c:a')), ('copy', 'aac'))
+
+        cmd = build_passthrough_command('in.mp4', '/out', has_audio=False)
+        self.assertNotIn('-c:a', cmd)
+        self.assertEqual(option(cmd, '-var_stream_map'), f'v:0,name:{PASSTHROUGH_VARIANT}')
+
+
+@override_settings(CACHES=TEST_CACHES, HLS_PROGRESS_INTERVAL=5)
+class ProgressReporterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        clock = mock.patch('streaming.progress.time.monotonic', return_value=100.0)
+        self.monotonic = clock.start()
+        self.addCleanup(clock.stop)
+
+    def stats(self, seconds, speed='2x', progress='continue'):
+        return {'out_time_us': str(int(seconds * 1_000_000)), 'speed': speed, 'progress': progress}
+
+    def test_updates_are_throttled(self):
+        reporter = ProgressReporter(1, 100)
+        reporter.update(self.stats(10))
+        self.monotonic.return_value = 104.0
+        reporter.update(self.stats(20))
+        self.assertEqual(get_progress(1)['out_time'], 10)
+
+        self.monotonic.return_value = 105.0
+        reporter.update(self.stats(30))
+        self.assertEqual(get_progress(1)['out_time'], 30)
+
+        self.monotonic.return_value = 106.0
+        reporter.update(self.stats(40), force=True)
+        self.assertEqual(get_progress(1)['out_time'], 40)
+
+    def test_percent_and_eta(self):
+        reporter = ProgressReporter(1, 100)
+        reporter.update(self.stats(25, speed='1.5x'))
+        progress = get_progress(1)
+        self.assertEqual(progress['percent'], 25.0)
+        # 75 seconds of media left at 1.5x realtime
+        self.assertEqual(progress['eta'], 50)
+        self.assertFalse(progress['finished'])
+
+    def test_unknown_speed_has_no_eta(self):
+        ProgressReporter(1, 100).update(self.stats(25, speed='N/A'))
+        self.assertEqual(get_progress(1)['speed'], 0.0)
+        self.assertIsNone(get_progress(1)['eta'])
+
+    def test_out_time_is_clamped_and_finishes_at_the_duration(self):
+        reporter = ProgressReporter(1, 100)
+        reporter.update(self.stats(104))
+        self.assertEqual(get_progress(1)['percent'], 100.0)
+        reporter.update(self.stats(99, progress='end'), force=True)
+        progress = get_progress(1)
+        self.assertEqual((progress['out_time'], progress['finished']), (100, True))
+
+    def test_task_state_follows_the_reports(self):
+        task = mock.Mock()
+        task.request.id = 'task-id'
+        ProgressReporter(1, 100, task=task).update(self.stats(50))
+        task.update_state.assert_called_once_with(state='PROGRESS', meta=get_progress(1))
+
+    def test_chunk_parts_are_summed(self):
+        start_chunked_progress(1, 300, parts=3)
+        self.assertEqual(get_progress(1)['out_time'], 0)
+        self.assertIsNone(get_progress(1)['eta'])
+
+        ProgressReporter(1, 100, part=0).finish()
+        ProgressReporter(1, 100, part=1).update(self.stats(40, speed='1x'))
+        ProgressReporter(1, 100, part=2).update(self.stats(20, speed='1.5x'))
+        progress = get_progress(1)
+        self.assertEqual(progress['out_time'], 160)
+        # Finished chunks no longer add to the speed
+        self.assertEqual(progress['speed'], 2.5)
+        self.assertEqual(progress['eta'], 56)
+        self.assertEqual(progress['percent'], 53.3)
+        self.assertFalse(progress['finished'])
+
+        ProgressReporter(1, 100, part=1).finish()
+        ProgressReporter(1, 100, part=2).finish()
+        progress = get_progress(1)
+        self.assertEqual((progress['out_time'], progress['eta'], progress['finished']), (300, None, True))
+
+
+def write_event_playlist(path, segments, trailing=''):
+    """A media playlist as FFmpeg leaves it while an EVENT conversion is running."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0',
+             '#EXT-X-PLAYLIST-TYPE:EVENT']
+    for position in range(segments):
+        lines += ['#EXTINF:6.000000,', f'segment_{position:03d}.ts']
+    with open(path, 'w') as playlist:
+        playlist.write('\n'.join(lines) + '\n' + trailing)
+
+
+class FinalizePlaylistTests(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), VARIANT_PLAYLIST)
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def read(self):
+        with open(self.path) as playlist:
+            return playlist.read().splitlines()
+
+    def test_event_playlist_becomes_vod(self):
+        write_event_playlist(self.path, 2, trailing='\n\n')
+        finalize_media_playlist(self.path)
+        self.assertEqual(self.read(), [
+            '#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:6', '#EXT-X-MEDIA-SEQUENCE:0',
+            '#EXT-X-PLAYLIST-TYPE:VOD',
+            '#EXTINF:6.000000,', 'segment_000.ts', '#EXTINF:6.000000,', 'segment_001.ts',
+            '#EXT-X-ENDLIST',
+        ])
+        segments, ended = read_media_playlist(self.path)
+        self.assertEqual((len(segments), ended), (2, True))
+
+    def test_finalizing_twice_keeps_one_endlist(self):
+        write_event_playlist(self.path, 1, trailing='#EXT-X-ENDLIST\n')
+        finalize_media_playlist(self.path)
+        finalize_media_playlist(self.path)
+        lines = self.read()
+        self.assertEqual(lines.count('#EXT-X-ENDLIST'), 1)
+        self.assertEqual(lines[-1], '#EXT-X-ENDLIST')
+        self.assertIn('#EXT-X-PLAYLIST-TYPE:VOD', lines)
+
+
+@override_settings(HLS_PUBLISH_MIN_SEGMENTS=3)
+class PartialPublishTests(StreamingTestCase):
+    VARIANTS = ['720p', '360p']
+
+    def setUp(self):
+        super().setUp()
+        self.movie = Movie.objects.create(title='Dune', status='processing', release_year=2000)
+        self.output_dir = hls_output_dir(self.movie.id)
+        self.uploader = LocalHLSUploader(self.movie.id)
+
+    def write_output(self, segments):
+        for name in self.VARIANTS:
+            write_event_playlist(os.path.join(self.output_dir, name, VARIANT_PLAYLIST), segments[name])
+        with open(os.path.join(self.output_dir, MASTER_PLAYLIST), 'w') as master:
+            master.write('#EXTM3U\n')
+
+    def publish(self):
+        with mock.patch('builtins.print'):
+            published = publish_partial(self.movie, self.VARIANTS, self.uploader)
+        self.movie.refresh_from_db()
+        return published
+
+    def test_nothing_written_yet(self):
+        self.assertFalse(self.publish())
+        self.assertEqual(self.movie.status, 'processing')
+
+    def test_every_variant_needs_the_minimum(self):
+        self.write_output({'720p': 2, '360p': 5})
+        self.assertFalse(self.publish())
+        self.assertEqual(self.movie.status, 'processing')
+
+    def test_published_once_the_minimum_exists(self):
+        self.write_output({'720p': 3, '360p': 4})
+        self.assertTrue(self.publish())
+        self.assertEqual(self.movie.status, 'partially_ready')
+        self.assertEqual(self.movie.hls_path, f'movies/hls/{self.movie.id}/{MASTER_PLAYLIST}')
+
+
+@override_settings(HLS_RENDITIONS=LADDER, HLS_SEGMENT_SECONDS=6, FFMPEG_PATH='ffmpeg')
+class SegmentFormatTests(SimpleTestCase):
+    def test_mpegts_segments_by_default(self):
+        for cmd in (build_hls_command('in.mp4', '/out'), build_passthrough_command('in.mp4', '/out')):
+            self.assertNotIn('-hls_segment_type', cmd)
+            self.assertNotIn('-hls_fmp4_init_filename', cmd)
+            self.assertEqual(option(cmd, '-hls_segment_filename'), os.path.join('/out', '%v', 'segment_%03d.ts'))
+
+    def test_fmp4_segments_with_an_init_segment(self):
+        for cmd in (build_hls_command('in.mp4', '/out', segment_format=SEGMENT_FMP4),
+                    build_passthrough_command('in.mp4', '/out', segment_format=SEGMENT_FMP4)):
+            self.assertEqual(option(cmd, '-hls_segment_type'), 'fmp4')
+            self.assertEqual(option(cmd, '-hls_fmp4_init_filename'), FMP4_INIT_FILENAME)
+            self.assertEqual(option(cmd, '-hls_segment_filename'), os.path.join('/out', '%v', 'segment_%03d.m4s'))
+            # Muxer options go before the output playlist
+            self.assertEqual(cmd[-1], os.path.join('/out', '%v', VARIANT_PLAYLIST))
+
+    def test_format_of_an_existing_output(self):
+        for fmp4, segment_format in ((False, SEGMENT_MPEGTS), (True, SEGMENT_FMP4)):
+            with self.subTest(segment_format=segment_format):
+                output_dir = tempfile.mkdtemp()
+                self.addCleanup(shutil.rmtree, output_dir)
+                write_hls_output(output_dir, [6.0, 6.0], fmp4=fmp4)
+                self.assertEqual(output_segment_format(output_dir), segment_format)
 
-# Create your tests here.
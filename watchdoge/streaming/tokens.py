@@ -0,0 +1,54 @@
+import time
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.http import base36_to_int, int_to_base36, urlencode
+from .progress import get_progress
+
+PLAYBACK_TOKEN_SALT = "streaming.tokens.playback"
+
+
+def _signature(movie_id, expires):
+    return salted_hmac(PLAYBACK_TOKEN_SALT, f"{movie_id}:{expires}", algorithm="sha256").hexdigest()[:32]
+
+
+def make_playback_token(movie_id, ttl=None):
+    """Signed '<expiry base36>-<hmac>' token granting access to one movie's HLS files."""
+    expires = int(time.time()) + (ttl or settings.PLAYBACK_TOKEN_TTL)
+    return f"{int_to_base36(expires)}-{_signature(movie_id, expires)}"
+
+
+def check_playback_token(movie_id, token):
+    """
+    Validate a playback token without touching the session or the database:
+    one HMAC over the movie id and expiry, compared in constant time.
+    """
+    expires_b36, _, signature = (token or "").partition("-")
+    try:
+        expires = base36_to_int(expires_b36)
+    except ValueError:
+        return False
+    if expires < time.time():
+        return False
+    return constant_time_compare(signature, _signature(movie_id, expires))
+
+
+def playback_token_ttl(movie):
+    """
+    Seconds a watch page's token must stay valid: the whole runtime plus
+    PLAYBACK_TOKEN_TTL for pauses and seeking. Playlists of a partially ready
+    movie are reloaded until its conversion is done, so the time that still
+    takes (the progress ETA, else the runtime once more) is added on top.
+    """
+    runtime = int(movie.source_duration or (movie.duration_minutes or 0) * 60)
+    ttl = settings.PLAYBACK_TOKEN_TTL + runtime
+    if movie.status == "partially_ready":
+        eta = (get_progress(movie.id) or {}).get("eta")
+        ttl += int(eta) if eta is not None else runtime
+    return ttl
+
+
+def playback_url(movie):
+    """Master playlist URL of a playable movie with a fresh playback token, or None."""
+    if not movie.hls_url:
+        return None
+    return f"{movie.hls_url}?{urlencode({'token': make_playback_token(movie.id, playback_token_ttl(movie))})}"
@@ -0,0 +1,432 @@
+import json
+import math
+import os
+import subprocess
+from django.conf import settings
+from .hls import (
+    finalize_media_playlist, read_media_playlist, replace_playlist, update_stream_inf, write_media_playlist,
+)
+
+MASTER_PLAYLIST = "master.m3u8"
+VARIANT_PLAYLIST = "index.m3u8"
+CHUNK_SOURCE_PATTERN = "source_%03d.mkv"
+# Keyframe timestamps within this many seconds of a segment boundary count as on it (rounding)
+SEGMENT_GRID_TOLERANCE = 0.001
+PASSTHROUGH_VARIANT = "source"
+
+# Segment packaging (Movie.segment_format / HLS_SEGMENT_TYPE)
+SEGMENT_MPEGTS = "mpegts"   # segment_%03d.ts
+SEGMENT_FMP4 = "fmp4"       # CMAF: init.mp4 + segment_%03d.m4s (also usable for DASH)
+SEGMENT_EXTENSIONS = {SEGMENT_MPEGTS: ".ts", SEGMENT_FMP4: ".m4s"}
+FMP4_INIT_FILENAME = "init.mp4"
+
+# Conversion modes picked from the probed source
+MODE_COPY = "copy"          # H.264 + AAC already: remux into HLS, no encoding
+MODE_AUDIO = "audio"        # H.264 video is fine, only the audio is re-encoded
+MODE_FULL = "full"          # Full re-encode into the rendition ladder
+
+HLS_VIDEO_PROFILES = ("Constrained Baseline", "Baseline", "Main", "High")
+
+
+def get_renditions(source_height=None):
+    """
+    Return the configured HLS rendition ladder (highest quality first).
+    With source_height, rungs taller than the source are dropped (never upscale),
+    keeping at least the smallest rung.
+    """
+    renditions = list(settings.HLS_RENDITIONS)
+    if source_height:
+        fitting = [r for r in renditions if r["height"] <= source_height]
+        renditions = fitting or renditions[-1:]
+    return renditions
+
+
+def hls_output_dir(movie_id):
+    """Absolute folder holding the master playlist and one sub-folder per rendition."""
+    return os.path.join(settings.MEDIA_ROOT, "movies", "hls", str(movie_id))
+
+
+def ingest_output_dir(upload_id):
+    """Absolute staging folder for HLS produced while the source was still uploading."""
+    return os.path.join(settings.MEDIA_ROOT, "movies", "ingest", str(upload_id))
+
+
+def hls_work_dir(movie_id):
+    """Absolute scratch folder used while a movie is encoded in parallel chunks."""
+    return os.path.join(settings.MEDIA_ROOT, "movies", "work", str(movie_id))
+
+
+def chunk_source_path(work_dir, index):
+    return os.path.join(work_dir, CHUNK_SOURCE_PATTERN % index)
+
+
+def chunk_output_dir(work_dir, index):
+    return os.path.join(work_dir, f"chunk_{index:03d}")
+
+
+def follow_input(path, size):
+    """
+    Input URL and options to read a file that is still growing to `size` bytes.
+    At the end of what arrived so far FFmpeg keeps retrying (the file
+    protocol's follow mode), and the subfile protocol ends the input exactly
+    at `size`, so the encode finishes as soon as the last byte lands. Only a
+    stall of STREAM_INGEST_READ_TIMEOUT seconds without new data ends it earlier.
+    """
+    return (
+        f"subfile,,start,0,end,{size},,:file:{path}",
+        ["-follow", "1", "-rw_timeout", str(int(settings.STREAM_INGEST_READ_TIMEOUT * 1_000_000))],
+    )
+
+
+def variant_names(output_dir):
+    """Names of the variant folders of an HLS output (one per rendition)."""
+    return sorted(
+        entry.name for entry in os.scandir(output_dir)
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, VARIANT_PLAYLIST))
+    )
+
+
+def output_segment_format(output_dir):
+    """Packaging of an existing HLS output: fMP4 playlists reference an init segment."""
+    name = variant_names(output_dir)[0]
+    segments, _ = read_media_playlist(os.path.join(output_dir, name, VARIANT_PLAYLIST))
+    return SEGMENT_FMP4 if segments and segments[0]["map"] else SEGMENT_MPEGTS
+
+
+def segment_output_options(output_dir, segment_format):
+    """HLS muxer options for the segment packaging (MPEG-TS or fMP4 with an init segment per variant)."""
+    options = []
+    if segment_format == SEGMENT_FMP4:
+        # With several variants FFmpeg names the init segments init_0.mp4, init_1.mp4, ...
+        options += ["-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", FMP4_INIT_FILENAME]
+    extension = SEGMENT_EXTENSIONS[segment_format]
+    options += ["-hls_segment_filename", os.path.join(output_dir, "%v", f"segment_%03d{extension}")]
+    return options
+
+
+def available_segments(output_dir, variants):
+    """
+    Number of segments playable in every variant of a running conversion
+    (0 until the master playlist and all variant playlists exist).
+    """
+    if not os.path.exists(os.path.join(output_dir, MASTER_PLAYLIST)):
+        return 0
+    try:
+        return min(len(read_media_playlist(os.path.join(output_dir, name, VARIANT_PLAYLIST))[0]) for name in variants)
+    except FileNotFoundError:
+        return 0
+
+
+def finalize_playlists(output_dir):
+    """Mark every variant playlist of a finished conversion as VOD with #EXT-X-ENDLIST."""
+    for name in variant_names(output_dir):
+        finalize_media_playlist(os.path.join(output_dir, name, VARIANT_PLAYLIST))
+
+
+def playlist_duration(output_dir, renditions):
+    """Seconds of media in the first variant playlist of an HLS output."""
+    segments, _ = read_media_playlist(os.path.join(output_dir, renditions[0]["name"], VARIANT_PLAYLIST))
+    return sum(segment["duration"] for segment in segments)
+
+
+def probe_keyframes(input_file):
+    """
+    Timestamps (seconds) of every video keyframe in the source.
+    Reads packet flags only, so nothing is decoded and this stays fast on long files.
+    """
+    cmd = [
+        settings.FFPROBE_PATH,
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=print_section=0",
+        input_file,
+    ]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if "K" in flags and pts_time not in ("", "N/A"):
+            keyframes.append(float(pts_time))
+    return sorted(keyframes)
+
+
+def probe_source(input_file):
+    """
+    Inspect the source with ffprobe.
+    Returns a dict with the first video/audio stream details plus duration and bitrate.
+    """
+    cmd = [
+        settings.FFPROBE_PATH,
+        "-v", "error",
+        "-print_format", "json",
+        "-show_format",
+        "-show_streams",
+        input_file,
+    ]
+    output = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    data = json.loads(output)
+
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+    fmt = data.get("format", {})
+
+    return {
+        "video_codec": video.get("codec_name", ""),
+        "video_profile": video.get("profile", ""),
+        "pix_fmt": video.get("pix_fmt", ""),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "audio_codec": audio.get("codec_name", "") if audio else "",
+        "has_audio": audio is not None,
+        "duration": float(fmt.get("duration") or 0),
+        "bitrate": int(fmt.get("bit_rate") or 0),
+    }
+
+
+def max_keyframe_interval(keyframes, duration):
+    """Longest gap between two keyframes (or from the last keyframe to the end)."""
+    points = keyframes + [duration] if keyframes and duration > keyframes[-1] else keyframes
+    if len(points) < 2:
+        return duration
+    return max(b - a for a, b in zip(points, points[1:]))
+
+
+def choose_conversion_mode(source, keyframe_interval):
+    """
+    Decide how much work the source actually needs.
+    Remuxing is only safe when the video is HLS-compatible H.264 and its keyframes
+    are close enough together to cut sensible segments without re-encoding.
+    """
+    video_ok = (
+        source["video_codec"] == "h264"
+        and source["video_profile"] in HLS_VIDEO_PROFILES
+        and source["pix_fmt"] == "yuv420p"
+        and keyframe_interval <= settings.HLS_PASSTHROUGH_MAX_KEYFRAME_INTERVAL
+    )
+    if not video_ok:
+        return MODE_FULL
+    if not source["has_audio"] or source["audio_codec"] == "aac":
+        return MODE_COPY
+    return MODE_AUDIO
+
+
+def build_passthrough_command(input_file, output_dir, reencode_audio=False, has_audio=True,
+                              segment_format=SEGMENT_MPEGTS):
+    """
+    Remux an already compatible source into HLS (single 'source' variant + master.m3u8).
+    Segments are cut on the source keyframes; only the audio may be re-encoded.
+    """
+    cmd = [
+        settings.FFMPEG_PATH,
+        "-y",
+        "-i", input_file,
+        "-map", "0:v:0",
+        "-c:v", "copy",
+    ]
+    if has_audio:
+        cmd += ["-map", "0:a:0"]
+        cmd += ["-c:a", "aac", "-b:a", "128k", "-ac", "2"] if reencode_audio else ["-c:a", "copy"]
+
+    cmd += [
+        "-start_number", "0",
+        "-hls_time", str(settings.HLS_SEGMENT_SECONDS),
+        "-hls_list_size", "0",
+        "-hls_playlist_type", "event",
+        *segment_output_options(output_dir, segment_format),
+        "-master_pl_name", MASTER_PLAYLIST,
+        "-var_stream_map", f"v:0{',a:0' if has_audio else ''},name:{PASSTHROUGH_VARIANT}",
+        "-f", "hls",
+        os.path.join(output_dir, "%v", VARIANT_PLAYLIST),
+    ]
+    return cmd
+
+
+def plan_chunk_splits(keyframes, chunk_seconds, segment_seconds=None):
+    """
+    Pick split points on keyframes so every chunk is at least chunk_seconds long
+    (GOP-aligned, so the source can be cut with stream copy) and a whole number
+    of segments long: each chunk is encoded with keyframes forced every
+    segment_seconds from its own start, so a split off that grid would end the
+    chunk with a short tail segment. A source without keyframes on the grid is
+    encoded as a single chunk.
+    """
+    segment_seconds = segment_seconds or settings.HLS_SEGMENT_SECONDS
+    splits = []
+    last_split = keyframes[0] if keyframes else 0.0
+    for keyframe in keyframes:
+        offset = keyframe - last_split
+        off_grid = abs(offset - round(offset / segment_seconds) * segment_seconds)
+        if offset >= chunk_seconds and off_grid <= SEGMENT_GRID_TOLERANCE:
+            splits.append(keyframe)
+            last_split = keyframe
+    return splits
+
+
+def build_split_command(input_file, work_dir, split_times):
+    """Cut the source into GOP-aligned chunk files without re-encoding."""
+    return [
+        settings.FFMPEG_PATH,
+        "-y",
+        "-i", input_file,
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        "-c", "copy",
+        "-f", "segment",
+        "-segment_times", ",".join(f"{t:.6f}" for t in split_times),
+        "-reset_timestamps", "1",
+        os.path.join(work_dir, CHUNK_SOURCE_PATTERN),
+    ]
+
+
+def chunk_starts(keyframes, split_times):
+    """
+    Start of every chunk, in seconds from the start of the movie. The splits
+    are keyframes, so the segment muxer cuts exactly there; each chunk file
+    restarts its timestamps, shifted the same way as the first one.
+    """
+    first = keyframes[0] if keyframes else 0.0
+    return [0.0] + [split - first for split in split_times]
+
+
+def stitch_chunks(work_dir, output_dir, chunk_count, renditions=None, ended=True):
+    """
+    Join the per-chunk HLS outputs into one continuous playlist per rendition.
+
+    Segments are moved into <output_dir>/<name>/ and renumbered so the final
+    ladder looks exactly like a single-pass encode. Chunks are encoded with
+    their start as timestamp offset, so the timeline simply continues across
+    chunk boundaries (no discontinuity); fMP4 chunks bring their own init
+    segment (init_<chunk>.mp4), referenced by an #EXT-X-MAP where it changes.
+    The master playlist takes BANDWIDTH and AVERAGE-BANDWIDTH from the
+    stitched segments, not from any single chunk.
+    Safe to run more than once: already-moved segments are skipped,
+    so the finished prefix of a conversion can be stitched (ended=False, EVENT
+    playlist) while later chunks are still encoding.
+    """
+    renditions = renditions or get_renditions()
+    bandwidths = {}
+
+    for rendition in renditions:
+        variant_dir = os.path.join(output_dir, rendition["name"])
+        os.makedirs(variant_dir, exist_ok=True)
+        segments = []
+
+        for index in range(chunk_count):
+            chunk_variant_dir = os.path.join(chunk_output_dir(work_dir, index), rendition["name"])
+            chunk_segments, _ = read_media_playlist(os.path.join(chunk_variant_dir, VARIANT_PLAYLIST))
+
+            init_map = None
+            if chunk_segments and chunk_segments[0]["map"]:
+                init_map = f"init_{index:03d}{os.path.splitext(chunk_segments[0]['map'])[1]}"
+                move_if_exists(os.path.join(chunk_variant_dir, chunk_segments[0]["map"]), os.path.join(variant_dir, init_map))
+
+            for segment in chunk_segments:
+                uri = f"segment_{len(segments):03d}{os.path.splitext(segment['uri'])[1]}"
+                move_if_exists(os.path.join(chunk_variant_dir, segment["uri"]), os.path.join(variant_dir, uri))
+                segments.append({"duration": segment["duration"], "uri": uri, "map": init_map})
+
+        write_media_playlist(os.path.join(variant_dir, VARIANT_PLAYLIST), segments, ended=ended)
+        bandwidths[f"{rendition['name']}/{VARIANT_PLAYLIST}"] = segment_bandwidth(variant_dir, segments)
+
+    # Same ladder in every chunk: chunk 0's master has the right variants, resolutions and codecs
+    with open(os.path.join(chunk_output_dir(work_dir, 0), MASTER_PLAYLIST), encoding="utf-8") as master:
+        text = master.read()
+    replace_playlist(os.path.join(output_dir, MASTER_PLAYLIST), update_stream_inf(text, bandwidths).splitlines())
+
+
+def segment_bandwidth(variant_dir, segments):
+    """{'BANDWIDTH': peak segment bit rate, 'AVERAGE-BANDWIDTH': overall bit rate} of a variant, bits/s."""
+    peak = total_bits = total_duration = 0
+    for segment in segments:
+        bits = os.path.getsize(os.path.join(variant_dir, segment["uri"])) * 8
+        if segment["duration"]:
+            peak = max(peak, bits / segment["duration"])
+        total_bits += bits
+        total_duration += segment["duration"]
+    average = total_bits / total_duration if total_duration else 0
+    return {"BANDWIDTH": str(math.ceil(peak)), "AVERAGE-BANDWIDTH": str(math.ceil(average))}
+
+
+def move_if_exists(source, target):
+    if os.path.exists(source):
+        os.replace(source, target)
+
+
+def build_hls_command(input_file, output_dir, renditions=None, has_audio=True, input_options=None,
+                      segment_format=SEGMENT_MPEGTS, output_ts_offset=None):
+    """
+    Build a single-pass FFmpeg command producing every rendition of the ladder.
+
+    The source is decoded once, split and scaled per rung, and written as
+    <output_dir>/<name>/index.m3u8 + segments, with master.m3u8 next to them.
+    Keyframes are forced on segment boundaries so all variants stay aligned
+    and the player can switch between them at any segment.
+    output_ts_offset (seconds) marks a chunk of a parallel conversion: its
+    timestamps are shifted to continue where the previous chunk ends, and
+    frames are passed through as timed, so no frame is duplicated to pad the
+    end of the chunk (it would start a sub-second segment).
+    """
+    renditions = renditions or get_renditions()
+    segment_seconds = settings.HLS_SEGMENT_SECONDS
+
+    # [0:v]split=N[v0][v1]...;[v0]scale=-2:1080[v0out];...
+    filters = [f"[0:v]split={len(renditions)}" + "".join(f"[v{i}]" for i in range(len(renditions)))]
+    for i, rendition in enumerate(renditions):
+        filters.append(f"[v{i}]scale=-2:{rendition['height']}[v{i}out]")
+
+    cmd = [
+        settings.FFMPEG_PATH,
+        "-y",
+        *(input_options or []),
+        "-i", input_file,
+        "-filter_complex", ";".join(filters),
+    ]
+
+    for i, rendition in enumerate(renditions):
+        cmd += [
+            "-map", f"[v{i}out]",
+            f"-c:v:{i}", "libx264",
+            f"-b:v:{i}", rendition["video_bitrate"],
+            f"-maxrate:v:{i}", rendition["maxrate"],
+            f"-bufsize:v:{i}", rendition["bufsize"],
+        ]
+
+    if has_audio:
+        for i, rendition in enumerate(renditions):
+            cmd += [
+                "-map", "0:a:0",
+                f"-c:a:{i}", "aac",
+                f"-b:a:{i}", rendition["audio_bitrate"],
+            ]
+        cmd += ["-ac", "2"]
+
+    var_stream_map = " ".join(
+        f"v:{i}{f',a:{i}' if has_audio else ''},name:{rendition['name']}"
+        for i, rendition in enumerate(renditions)
+    )
+
+    cmd += [
+        "-preset", "veryfast",
+        "-pix_fmt", "yuv420p",
+        "-profile:v", "main",
+        "-level", "4.0",
+        "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{segment_seconds})",
+        "-start_number", "0",
+        "-hls_time", str(segment_seconds),
+        "-hls_list_size", "0",
+        "-hls_playlist_type", "event",
+        *segment_output_options(output_dir, segment_format),
+        "-master_pl_name", MASTER_PLAYLIST,
+        "-var_stream_map", var_stream_map,
+    ]
+    if output_ts_offset is not None:
+        cmd += ["-fps_mode", "passthrough", "-output_ts_offset", f"{output_ts_offset:.6f}"]
+    cmd += [
+        "-f", "hls",
+        os.path.join(output_dir, "%v", VARIANT_PLAYLIST),
+    ]
+    return cmd
@@ -0,0 +1,143 @@
+import base64
+import binascii
+import hashlib
+import os
+import shutil
+import tempfile
+from django.conf import settings
+
+ALLOWED_UPLOAD_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi')
+READ_BLOCK_SIZE = 64 * 1024
+
+MATROSKA_MAGIC = b'\x1a\x45\xdf\xa3'
+ISO_TOP_LEVEL_BOXES = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pdin', b'uuid')
+
+
+class ChunkChecksumError(Exception):
+    pass
+
+
+def upload_abspath(upload):
+    return os.path.join(settings.MEDIA_ROOT, upload.file_path)
+
+
+def parse_upload_checksum(header):
+    """
+    Parse an 'Upload-Checksum: sha256 <base64 digest>' header (tus checksum extension).
+    Returns the raw digest bytes or None if the header is missing/invalid.
+    """
+    algorithm, _, value = (header or '').partition(' ')
+    if algorithm.lower() != 'sha256':
+        return None
+    try:
+        digest = base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest if len(digest) == hashlib.sha256().digest_size else None
+
+
+def chain_checksum(previous, chunk_digest):
+    """Running whole-file checksum: sha256(previous chain bytes + chunk digest), hex."""
+    return hashlib.sha256(bytes.fromhex(previous) + chunk_digest).hexdigest()
+
+
+def receive_chunk(upload, stream, length, expected_digest):
+    """
+    Read one chunk of `length` bytes from `stream` into a side file next to
+    the upload (<file>.<random>.part) and hash it there, without any lock:
+    a slow client only holds its own request. Returns the side file's path
+    for append_chunk(). If the connection drops (UnreadablePostError) or the
+    digest does not match (ChunkChecksumError), the side file is removed and
+    the client can resend the same chunk.
+    """
+    path = upload_abspath(upload)
+    fd, part_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.part', dir=os.path.dirname(path))
+    digest = hashlib.sha256()
+    written = 0
+
+    try:
+        with os.fdopen(fd, 'wb') as part:
+            while written < length:
+                block = stream.read(min(READ_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                part.write(block)
+                digest.update(block)
+                written += len(block)
+
+        if written != length or digest.digest() != expected_digest:
+            raise ChunkChecksumError(f"Chunk rejected after {written} of {length} bytes.")
+    except BaseException:
+        discard_chunk(part_path)
+        raise
+    return part_path
+
+
+def discard_chunk(part_path):
+    try:
+        os.remove(part_path)
+    except FileNotFoundError:
+        pass
+
+
+def append_chunk(upload, part_path, expected_digest):
+    """
+    Append a chunk verified by receive_chunk() at upload.offset; the caller
+    holds the upload's row lock and has checked the offset. The upload file
+    never holds unverified bytes (a streaming ingest may be reading it with
+    FFmpeg right now). The side file is removed. Returns the number of bytes
+    appended.
+    """
+    path = upload_abspath(upload)
+    try:
+        with open(path, 'r+b') as target, open(part_path, 'rb') as part:
+            if target.seek(0, os.SEEK_END) > upload.offset:
+                # The rest of an append that crashed midway. FFmpeg may have read
+                # it already, so the streaming ingest falls back to a normal conversion.
+                target.truncate(upload.offset)
+                if upload.ingest_status == 'running':
+                    upload.ingest_status = 'failed'
+            target.seek(upload.offset)
+            shutil.copyfileobj(part, target, READ_BLOCK_SIZE)
+            written = target.tell() - upload.offset
+            target.flush()
+            os.fsync(target.fileno())
+    finally:
+        discard_chunk(part_path)
+
+    upload.offset += written
+    upload.checksum = chain_checksum(upload.checksum, expected_digest)
+    return written
+
+
+def detect_fast_start(path, available):
+    """
+    Can FFmpeg read this source front to back while it is still uploading?
+    Returns True/False, or None when not enough bytes arrived to tell yet.
+
+    Matroska/WebM always can. MP4/MOV only when the moov box (the sample index)
+    comes before mdat (the media data), i.e. files written with +faststart.
+    """
+    with open(path, 'rb') as source:
+        if source.read(4) == MATROSKA_MAGIC:
+            return True
+
+        # Walk the top-level MP4 boxes: [size:4][type:4]([largesize:8])
+        position = 0
+        while position + 8 <= available:
+            source.seek(position)
+            header = source.read(16)
+            size = int.from_bytes(header[:4], 'big')
+            box = header[4:8]
+            if size == 1:
+                size = int.from_bytes(header[8:16], 'big')
+
+            if position == 0 and box not in ISO_TOP_LEVEL_BOXES:
+                return False  # not an MP4/MOV file (e.g. AVI)
+            if box == b'moov':
+                return True
+            if box == b'mdat' or size < 8:
+                return False
+            position += size
+
+    return None
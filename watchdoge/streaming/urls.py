@@ -7,11 +7,15 @@ urlpatterns=[
     path('movies/',views.showMovies, name='admin-movies-list'),
     path('genres/',views.showGenres, name='admin-genres-list'),
     path('uploadMovie/',views.upload_movie, name='upload-movie'),
+    path('uploads/',views.create_upload, name='create-upload'),
+    path('uploads/<uuid:uploadId>/',views.upload_chunk, name='upload-chunk'),
+    path('uploads/<uuid:uploadId>/complete/',views.complete_upload, name='complete-upload'),
     path('addGenre/',views.add_genre, name='add-genre'),
     path('deleteGenre/<int:genreId>/', views.deleteGenre, name='delete-genre'),
     path('deleteMovie/<int:movieId>/', views.deleteMovie, name='delete-movie'),
     path('movieDetails/<int:movieId>/',views.movie_details, name='admin-movie-details'),
     path('editMovie/<int:movieId>/',views.editMovie,name='admin-edit-movie'),
+    path('movieProgress/<int:movieId>/',views.movie_progress,name='admin-movie-progress'),
     path('editGenre/<int:genreId>/',views.editGenre,name='admin-edit-genre'),
     path('users-list/',views.users_list,name='admin-users-list'),
 
@@ -1,6 +1,5 @@
 import uuid
 import os
-import shutil
 from django.conf import settings
 #import subprocess
 
@@ -42,13 +41,24 @@ def delete_original_after_conversion(movie):
     movie.save(update_fields=['file'])
 
 
-def delete_hls_folder(movie):
-    """Delete the HLS folder for a movie (if exists)."""
-    if movie.hls_path:
-        hls_folder = os.path.dirname(os.path.join(settings.MEDIA_ROOT, movie.hls_path))
-        if os.path.isdir(hls_folder):
+def remove_tree_batch(path, limit):
+    """
+    Delete up to `limit` files under `path`, then the folders emptied, `path`
+    included. Returns True once nothing is left. Files already gone are
+    skipped, so running it again after a crash or a retry is safe.
+    """
+    removed = 0
+    for root, dirs, files in os.walk(path, topdown=False):
+        for name in files:
+            if removed >= limit:
+                return False
             try:
-                shutil.rmtree(hls_folder)
-                print(f"[CLEANUP] Deleted HLS folder: {hls_folder}")
-            except Exception as e:
-                print(f"[CLEANUP] Could not delete HLS folder {hls_folder}: {e}")
+                os.remove(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+            removed += 1
+        try:
+            os.rmdir(root)
+        except FileNotFoundError:
+            pass
+    return True
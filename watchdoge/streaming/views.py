@@ -1,18 +1,35 @@
 from django.shortcuts import render,redirect,get_object_or_404
-from django.db.models import Count,Q
-from .models import Movie, Genre
-from .forms import MovieUploadForm, GenreForm, MovieEditForm
+from django.http import JsonResponse, HttpResponse, HttpResponseForbidden, Http404
+from django.http.request import UnreadablePostError
+from django.urls import reverse
+from django.views.decorators.http import require_http_methods, require_POST, require_safe
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.http import urlencode
+from django.db.models import Count
+from .models import Movie, MovieQuerySet, Genre, MovieUpload
+from .forms import MovieUploadForm, GenreForm, MovieEditForm, ChunkedMovieUploadForm
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.core.paginator import Paginator
 from accounts.auth import admin_only,user_only
-from difflib import SequenceMatcher
 import os
 from django.conf import settings
-from django.utils import timezone
 from django.db import transaction
-from .tasks import convert_movie_to_hls
+from .tasks import convert_movie_to_hls, ingest_upload_to_hls, adopt_ingest_output, delete_movie
+from .progress import get_progress
+from .similarity import get_similar_movies
+from .search import filter_by_genres, search_movies
+from .pagination import KeysetPaginator
+from .serving import HLS_CONTENT_TYPES, serve_file, serve_stored_file
+from .tokens import check_playback_token, playback_url
+from .transcode import hls_output_dir
+from .storage import get_hls_storage
+from .uploads import (
+    ALLOWED_UPLOAD_EXTENSIONS, ChunkChecksumError, append_chunk, detect_fast_start, discard_chunk,
+    parse_upload_checksum, receive_chunk, upload_abspath,
+)
+from .utils import movie_file_upload_path
 # Create your views here.
 
 @login_required
@@ -48,6 +65,167 @@ def upload_movie(request):
 
     return render(request, 'streaming/uploadMovie.html', {'form': form})
 
+@login_required
+@admin_only
+@require_POST
+def create_upload(request):
+    """Start a resumable upload: reserve movies/files/<uuid>.<ext> and return its id."""
+    filename = os.path.basename(request.POST.get('filename', ''))
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        size = -1
+
+    if os.path.splitext(filename)[1].lower() not in ALLOWED_UPLOAD_EXTENSIONS:
+        return JsonResponse({'error': 'Unsupported video format.'}, status=400)
+    if size <= 0 or size > settings.MOVIE_UPLOAD_MAX_SIZE:
+        return JsonResponse({'error': 'Invalid file size.'}, status=400)
+
+    upload = MovieUpload(user=request.user, filename=filename, size=size)
+    upload.file_path = movie_file_upload_path(None, filename)
+    os.makedirs(os.path.dirname(upload_abspath(upload)), exist_ok=True)
+    open(upload_abspath(upload), 'wb').close()
+    upload.save()
+
+    return JsonResponse({
+        'id': str(upload.id),
+        'offset': 0,
+        'chunk_size': settings.MOVIE_UPLOAD_CHUNK_SIZE,
+        'url': reverse('upload-chunk', args=[upload.id]),
+        'complete_url': reverse('complete-upload', args=[upload.id]),
+    }, status=201)
+
+@login_required
+@admin_only
+@require_http_methods(['HEAD', 'GET', 'PATCH'])
+def upload_chunk(request, uploadId):
+    """
+    HEAD/GET: current offset, so an interrupted client knows where to resume.
+    PATCH: append the request body at Upload-Offset. The body must match the
+    'Upload-Checksum: sha256 <base64>' header or it is discarded. It is read
+    and verified before the row is locked; the lock is only held to check the
+    offset again and append.
+    """
+    upload = get_object_or_404(MovieUpload, id=uploadId, user=request.user)
+
+    if request.method == 'PATCH':
+        if upload.movie_id:
+            return JsonResponse({'error': 'Upload already completed.'}, status=409)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return JsonResponse({'error': 'Upload-Offset and Content-Length are required.'}, status=400)
+        if offset != upload.offset:
+            return offset_mismatch(upload)
+        if length <= 0 or length > settings.MOVIE_UPLOAD_CHUNK_SIZE or offset + length > upload.size:
+            return JsonResponse({'error': 'Invalid chunk size.'}, status=413)
+        digest = parse_upload_checksum(request.headers.get('Upload-Checksum'))
+        if digest is None:
+            return JsonResponse({'error': 'Upload-Checksum (sha256) is required.'}, status=400)
+
+        try:
+            part_path = receive_chunk(upload, request, length, digest)
+        except ChunkChecksumError:
+            return JsonResponse({'error': 'Checksum mismatch.', 'offset': upload.offset}, status=460)
+        except UnreadablePostError:
+            return JsonResponse({'error': 'Connection lost.', 'offset': upload.offset}, status=400)
+
+        with transaction.atomic():
+            # Lock the row so two requests can never append to the same file at once
+            upload = MovieUpload.objects.select_for_update().get(id=upload.id)
+            if upload.movie_id or offset != upload.offset:
+                # Another request appended (or completed the upload) while this body was read
+                discard_chunk(part_path)
+                if upload.movie_id:
+                    return JsonResponse({'error': 'Upload already completed.'}, status=409)
+                return offset_mismatch(upload)
+            append_chunk(upload, part_path, digest)
+            upload.save(update_fields=['offset', 'checksum', 'ingest_status', 'updated_at'])
+            start_stream_ingest(upload)
+
+    response = HttpResponse(status=204) if request.method == 'PATCH' else JsonResponse({
+        'id': str(upload.id),
+        'offset': upload.offset,
+        'size': upload.size,
+    })
+    response['Upload-Offset'] = upload.offset
+    response['Upload-Length'] = upload.size
+    response['Cache-Control'] = 'no-store'
+    return response
+
+def offset_mismatch(upload):
+    response = JsonResponse({'error': 'Offset mismatch.', 'offset': upload.offset}, status=409)
+    response['Upload-Offset'] = upload.offset
+    return response
+
+def start_stream_ingest(upload):
+    """Start converting a fast-start source as soon as enough of it arrived."""
+    if not settings.MOVIE_UPLOAD_STREAM_INGEST or upload.ingest_status:
+        return
+    if upload.offset < min(settings.STREAM_INGEST_MIN_BYTES, upload.size):
+        return
+
+    fast_start = detect_fast_start(upload_abspath(upload), upload.offset)
+    if fast_start is None:
+        return  # moov not reached yet, check again after the next chunk
+
+    upload.ingest_status = 'running' if fast_start else 'skipped'
+    upload.save(update_fields=['ingest_status'])
+    if fast_start:
+        upload_id = str(upload.id)
+        transaction.on_commit(lambda: ingest_upload_to_hls.delay(upload_id))
+
+@login_required
+@admin_only
+@require_POST
+def complete_upload(request, uploadId):
+    """
+    Finish a resumable upload: every byte must be there and the running checksum
+    must match the client's. Only then is the Movie created and conversion queued.
+    """
+    upload = get_object_or_404(MovieUpload, id=uploadId, user=request.user)
+
+    if upload.movie_id:
+        return JsonResponse({'error': 'Upload already completed.'}, status=409)
+    if not upload.is_complete:
+        return JsonResponse({'error': 'Upload is not complete.', 'offset': upload.offset}, status=409)
+    if request.POST.get('checksum', '').lower() != upload.checksum:
+        return JsonResponse({'error': 'Checksum mismatch. Please upload the file again.'}, status=400)
+
+    form = ChunkedMovieUploadForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'error': 'Could not upload. Check the form.', 'errors': form.errors}, status=400)
+
+    title = form.cleaned_data['title']
+    release_year = form.cleaned_data['release_year']
+    if Movie.objects.filter(title__iexact=title.strip(), release_year=release_year).exists():
+        return JsonResponse({'error': 'This movie already exists.'}, status=400)
+
+    with transaction.atomic():
+        # Same lock as the ingest task, which may be finishing right now
+        upload = MovieUpload.objects.select_for_update().get(id=upload.id)
+
+        movie = form.save(commit=False)
+        movie.file.name = upload.file_path
+        movie.status = 'processing' if upload.ingest_status in ('running', 'finished') else 'uploaded'
+        movie.save()
+        form.save_m2m()
+
+        upload.movie = movie
+        upload.save(update_fields=['movie', 'updated_at'])
+
+        if upload.ingest_status == 'finished':
+            # Encoded while uploading: just move the output into place
+            upload_id = str(upload.id)
+            transaction.on_commit(lambda: adopt_ingest_output.delay(upload_id))
+        elif upload.ingest_status != 'running':
+            # Trigger background HLS conversion
+            transaction.on_commit(lambda: convert_movie_to_hls.delay(movie.id))
+
+    messages.success(request, "Movie uploaded! Conversion in progress.")
+    return JsonResponse({'redirect': reverse('admin-movies-list')})
+
 @login_required
 @admin_only
 def add_genre(request):
@@ -70,25 +248,22 @@ def add_genre(request):
 @admin_only
 def showMovies(request):
     genres = Genre.objects.all()
-    movies = Movie.objects.all()
+    # The admin table also shows the description, duration and trailer of each movie
+    movies = Movie.objects.catalog().only(
+        *MovieQuerySet.CATALOG_FIELDS, 'description', 'duration_minutes', 'trailerUrl'
+    ).order_by('-upload_date')
 
     query = request.GET.get('q')
 
     selected_genres = request.GET.getlist('genres')
 
     if query:
-        movies = movies.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query)
-        )
+        movies = search_movies(movies, query)
 
     if selected_genres:
-        movies = movies.filter(genres__id__in=selected_genres).distinct()
+        movies = filter_by_genres(movies, selected_genres)
     
-    paginator = Paginator(movies,5)
-
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(movies,5,request.GET).get_page()
 
     context = {
         'page_obj':page_obj,
@@ -104,9 +279,7 @@ def showMovies(request):
 def showGenres(request):
     genres = Genre.objects.all().order_by('name')
 
-    paginator = Paginator(genres,5)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(genres,5,request.GET).get_page()
 
     context = {
         'page_obj':page_obj,
@@ -119,12 +292,13 @@ def showGenres(request):
 def movie_details(request,movieId):
     movie=get_object_or_404(Movie,id=movieId)
 
-    recommendation= get_similar_movies(movie)
-    other_movies = Movie.objects.exclude(id__in=[m.id for m in recommendation]).exclude(id=movie.id)[:5]
+    recommendation= get_similar_movies(movie, limit=6)
+    other_movies = Movie.objects.catalog().exclude(id__in=[m.id for m in recommendation]).exclude(id=movie.id)[:5]
     context={
         'movie':movie,
         'allMoives':recommendation,
         'other_movies':other_movies,
+        'playback_url':playback_url(movie),
     }
     return render(request,'streaming/videoDetails.html',context)
 
@@ -146,27 +320,11 @@ def deleteGenre(request,genreId):
 def deleteMovie(request, movieId):
     movie = get_object_or_404(Movie, id=movieId)
 
-    # Delete poster safely
-    if movie.poster and movie.poster.name:
-        poster_path = movie.poster.path
-        if os.path.exists(poster_path):
-            os.remove(poster_path)
-
-    # Delete original video safely (may already be deleted after HLS conversion)
-    if movie.file and movie.file.name:
-        file_path = movie.file.path
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-    # Delete HLS folder (index + segments)
-    if movie.hls_path:
-        hls_folder = os.path.join(settings.MEDIA_ROOT, os.path.dirname(movie.hls_path))
-        if os.path.isdir(hls_folder):
-            import shutil
-            shutil.rmtree(hls_folder, ignore_errors=True)
-
-    # Delete movie entry from DB
-    movie.delete()
+    # Hide it right away; the files, then the row (and what cascades from it),
+    # are removed by Celery: delete_movie -> cleanup_movie_files
+    movie.status = 'deleting'
+    movie.save(update_fields=['status'])
+    transaction.on_commit(lambda: delete_movie.delay(movie.id))
 
     messages.success(request, "Item deleted")
     return redirect('admin-movies-list')
@@ -177,7 +335,7 @@ def dashboard(request):
     total_users= User.objects.count()
     total_movies = Movie.objects.count()
     total_genres = Genre.objects.count()
-    recent_movies = Movie.objects.order_by('-upload_date')[:5]
+    recent_movies = Movie.objects.catalog().order_by('-upload_date')[:5]
     movies_per_genre = Genre.objects.annotate(movie_count=Count('movie'))
     context={
         'total_movies': total_movies,
@@ -234,78 +392,52 @@ def editMovie(request, movieId):
 
 @login_required
 @admin_only
-def users_list(request):
-    users=User.objects.all()
-
-    paginator = Paginator(users,5)
-    page_number=request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    return render(request,'streaming/users_list.html',{'page_obj':page_obj})
-
-
-##############################################
-##############################################
-def get_similar_movies(current_movie, limit=6):
-    all_movies = Movie.objects.exclude(id=current_movie.id)
-    current_year = timezone.now().year
-    # Genre filtering
-    genre_ids = current_movie.genres.values_list('id', flat=True)
-    genre_matches = all_movies.filter(genres__in=genre_ids,release_year__lte=current_year).distinct()
-
-    # Optional: Filter by name similarity using SequenceMatcher
-    def similarity(a, b):
-        return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-    genre_matches = sorted(
-        genre_matches,
-        key=lambda m: similarity(m.title, current_movie.title),
-        reverse=True
-    )
-
-    return genre_matches[:limit]
-
-
-
-
-
-# Cosine Similarity
-'''
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-
-def get_cosine_similar_movies(current_movie, all_movies, limit=6):
-    # Step 1: Build corpus (movie description text)
-    # Combine title + genres into one string
-    corpus = []
-    movie_ids = []
+def movie_progress(request, movieId):
+    """JSON polled by the movie list while a conversion runs."""
+    movie = get_object_or_404(Movie, id=movieId)
+    progress = get_progress(movie.id) if movie.status in ('processing', 'partially_ready') else None
 
-    for movie in all_movies:
-        genres_text = " ".join([g.name for g in movie.genres.all()])
-        text = f"{movie.title} {genres_text}"
-        corpus.append(text)
-        movie_ids.append(movie.id)
+    return JsonResponse({
+        'id': movie.id,
+        'status': movie.status,
+        'percent': progress['percent'] if progress else None,
+        'speed': progress['speed'] if progress else None,
+        'eta_seconds': progress['eta'] if progress else None,
+        'updated': progress['updated'] if progress else None,
+    })
 
-    # Step 2: TF-IDF
-    vectorizer = TfidfVectorizer(stop_words="english")
-    tfidf_matrix = vectorizer.fit_transform(corpus)
+@login_required
+@admin_only
+def users_list(request):
+    users=User.objects.order_by('username')
 
-    # Step 3: Find index of current movie
-    current_index = movie_ids.index(current_movie.id)
+    page_obj = KeysetPaginator(users,5,request.GET).get_page()
 
-    # Step 4: Compute cosine similarity
-    similarity_scores = cosine_similarity(tfidf_matrix[current_index], tfidf_matrix).flatten()
+    return render(request,'streaming/users_list.html',{'page_obj':page_obj})
 
-    # Step 5: Pair movie IDs with similarity
-    movie_similarity = list(zip(movie_ids, similarity_scores))
 
-    # Step 6: Sort & remove current movie
-    movie_similarity = sorted(movie_similarity, key=lambda x: x[1], reverse=True)
-    movie_similarity = [m for m in movie_similarity if m[0] != current_movie.id]
 
-    # Step 7: Get top N similar movies
-    similar_ids = [m[0] for m in movie_similarity[:limit]]
 
-    # Step 8: Query movies back
-    return [movie for movie in all_movies if movie.id in similar_ids]
-'''
+@require_safe
+def serve_hls(request, movieId, filename):
+    """
+    Playlists and segments of a movie (movies/hls/<id>/...), for holders of a
+    playback token minted by the watch page. The token is checked with one HMAC,
+    no session or database access, and playlists are rewritten to carry it on.
+    Sent with ETag/Range support, or offloaded to the web server (HLS_SENDFILE_BACKEND);
+    with object storage (HLS_STORAGE_BACKEND='s3') segments are redirected to the bucket.
+    """
+    token = request.GET.get('token')
+    if not check_playback_token(movieId, token):
+        return HttpResponseForbidden("Invalid or expired playback token.")
+    if os.path.splitext(filename)[1] not in HLS_CONTENT_TYPES:
+        raise Http404()
+
+    storage = get_hls_storage()
+    try:
+        if not storage.is_local:
+            return serve_stored_file(request, storage, movieId, filename, query=urlencode({'token': token}))
+        path = safe_join(hls_output_dir(movieId), filename)
+        return serve_file(request, path, filename, query=urlencode({'token': token}))
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404()
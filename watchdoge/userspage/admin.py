@@ -1,3 +1,6 @@
 from django.contrib import admin
+from .models import UserRecommendation, WatchProgress
 
 # Register your models here.
+admin.site.register(UserRecommendation)
+admin.site.register(WatchProgress)
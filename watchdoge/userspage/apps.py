@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UserspageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userspage'
+
+    def ready(self):
+        import userspage.signals
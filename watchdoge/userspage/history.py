@@ -0,0 +1,67 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .library import refresh_library, schedule_library_refresh
+from .models import WatchHistory, WatchHistoryArchive
+from .recommendations import forget_recommendation
+
+UPSERT_SQL = f"""
+    INSERT INTO {WatchHistory._meta.db_table} (user_id, movie_id, watched_at, play_count)
+    VALUES (%s, %s, %s, 1)
+    ON CONFLICT (user_id, movie_id) DO UPDATE
+    SET watched_at = EXCLUDED.watched_at, play_count = {WatchHistory._meta.db_table}.play_count + 1
+    RETURNING id, play_count
+"""
+
+
+def record_watch(user_id, movie_id):
+    """
+    Log a play: one INSERT ... ON CONFLICT statement (SQLite and PostgreSQL),
+    so concurrent tabs cannot create duplicate rows the way get_or_create
+    could. A repeat play moves the movie to the top of the history and bumps
+    its play count. The raw SQL sends no post_save, so this does what the
+    WatchHistory receivers (userspage/signals.py) do after a save.
+    """
+    watched_at = timezone.now()
+    with connection.cursor() as cursor:
+        # Raw SQL: adapt the aware datetime the way the ORM stores it (naive UTC on SQLite)
+        cursor.execute(UPSERT_SQL, [user_id, movie_id, connection.ops.adapt_datetimefield_value(watched_at)])
+        history_id, play_count = cursor.fetchone()
+    if play_count == 1:
+        forget_recommendation(user_id, movie_id)
+    schedule_library_refresh(user_id)
+    return WatchHistory(id=history_id, user_id=user_id, movie_id=movie_id, watched_at=watched_at, play_count=play_count)
+
+
+def archive_history(batch_size=None):
+    """
+    Move WatchHistory rows older than WATCH_HISTORY_RETENTION_DAYS to
+    WatchHistoryArchive, oldest first, one transaction per batch (short
+    locks, resumable). Returns the number of rows moved.
+    """
+    batch_size = batch_size or settings.WATCH_HISTORY_ARCHIVE_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=settings.WATCH_HISTORY_RETENTION_DAYS)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                WatchHistory.objects.filter(watched_at__lt=cutoff).order_by('watched_at')
+                .values_list('id', 'user_id', 'movie_id', 'watched_at', 'play_count')[:batch_size]
+            )
+            if not rows:
+                return moved
+            WatchHistoryArchive.objects.bulk_create([
+                WatchHistoryArchive(user_id=user_id, movie_id=movie_id, watched_at=watched_at, play_count=play_count)
+                for _, user_id, movie_id, watched_at, play_count in rows
+            ])
+            # A plain DELETE: the post_delete receivers would otherwise load and
+            # handle every row; the libraries are refreshed once per user below
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {WatchHistory._meta.db_table} WHERE id IN ({', '.join(['%s'] * len(rows))})",
+                    [row[0] for row in rows],
+                )
+        for user_id in {row[1] for row in rows}:
+            refresh_library(user_id)
+        moved += len(rows)
@@ -0,0 +1,160 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from streaming.models import Movie
+from .models import Favorite, UserLibrary, Watchlist, WatchHistory, WatchHistoryArchive, WatchProgress
+
+LIBRARY_FIELDS = ('recent', 'favorites', 'plan_to_watch')
+
+
+def library_cache_key(user_id):
+    return f"user-library:{user_id}"
+
+
+class LibraryItem:
+    """A row of the library as the templates use it: item.movie, item.watched_at, item.id (history row)."""
+
+    def __init__(self, movie, id=None, watched_at=None, position=None, duration=None):
+        self.movie = movie
+        self.id = id
+        self.watched_at = watched_at
+        self.position = position
+        self.duration = duration
+
+    @property
+    def progress_percent(self):
+        if not self.position or not self.duration:
+            return 0
+        return min(int(self.position * 100 / self.duration), 100)
+
+    @property
+    def in_progress(self):
+        if not self.position:
+            return False
+        margin = settings.WATCH_PROGRESS_RESUME_MARGIN
+        return self.position >= margin and not (self.duration and self.duration - self.position < margin)
+
+
+def plan_to_watch_queryset(user_id):
+    """
+    Watchlist rows of movies the user has not watched, as one query (NOT
+    EXISTS on the history and on the archive its old rows are moved to).
+    """
+    watched = WatchHistory.objects.filter(user_id=user_id, movie_id=OuterRef('movie_id'))
+    archived = WatchHistoryArchive.objects.filter(user_id=user_id, movie_id=OuterRef('movie_id'))
+    return (
+        Watchlist.objects.filter(user_id=user_id).exclude(Exists(watched)).exclude(Exists(archived))
+        .exclude(movie__status='deleting').order_by('-added_at')
+    )
+
+
+def build_library(user_id):
+    """The library state of one user: three bounded, indexed queries."""
+    size = settings.USER_LIBRARY_SIZE
+    history = list(
+        WatchHistory.objects.filter(user_id=user_id)
+        .values_list('id', 'movie_id', 'watched_at')[:settings.USER_LIBRARY_RECENT_SIZE]
+    )
+    progress = {
+        movie_id: (position, duration)
+        for movie_id, position, duration in WatchProgress.objects
+        .filter(user_id=user_id, movie_id__in=[movie_id for _, movie_id, _ in history])
+        .values_list('movie_id', 'position', 'duration')
+    }
+    return {
+        'recent': [
+            {
+                'history': history_id,
+                'movie': movie_id,
+                'watched_at': watched_at.isoformat(),
+                'position': progress.get(movie_id, (None, None))[0],
+                'duration': progress.get(movie_id, (None, None))[1],
+            }
+            for history_id, movie_id, watched_at in history
+        ],
+        'favorites': list(
+            Favorite.objects.filter(user_id=user_id).order_by('-added_at').values_list('movie_id', flat=True)[:size]
+        ),
+        'plan_to_watch': list(plan_to_watch_queryset(user_id).values_list('movie_id', flat=True)[:size]),
+    }
+
+
+def refresh_library(user_id):
+    """Rebuild and store one user's library, after a write to their history, favorites or watchlist."""
+    state = build_library(user_id)
+    try:
+        with transaction.atomic():
+            UserLibrary.objects.update_or_create(user_id=user_id, defaults=state)
+    except IntegrityError:  # the user was deleted (cascade)
+        return state
+    cache.set(library_cache_key(user_id), state, settings.USER_LIBRARY_CACHE_TIMEOUT)
+    return state
+
+
+def schedule_library_refresh(user_id):
+    transaction.on_commit(lambda: refresh_library(user_id))
+
+
+def update_library_progress(progress):
+    """
+    Copy flushed WatchProgress rows into the recent lists they appear in: one
+    read and one bulk update for the whole batch, not a rebuild per user.
+    """
+    by_user = {}
+    for row in progress:
+        by_user.setdefault(row.user_id, {})[row.movie_id] = row
+    libraries = list(UserLibrary.objects.filter(user_id__in=by_user))
+    changed = []
+    for library in libraries:
+        rows = by_user[library.user_id]
+        entries = [entry for entry in library.recent if entry['movie'] in rows]
+        for entry in entries:
+            row = rows[entry['movie']]
+            entry['position'], entry['duration'] = row.position, row.duration
+        if entries:
+            library.updated_at = timezone.now()
+            changed.append(library)
+    UserLibrary.objects.bulk_update(changed, ['recent', 'updated_at'], batch_size=settings.WATCH_PROGRESS_BATCH_SIZE)
+    cache.delete_many([library_cache_key(library.user_id) for library in changed])
+
+
+def get_library(user):
+    """
+    {'recent': [LibraryItem...], 'favorites': [...], 'plan_to_watch': [...]}:
+    the state from the cache or the UserLibrary row (built on first use),
+    then one catalog query for the movies of all three lists.
+    """
+    if not user.is_authenticated:
+        return {field: [] for field in LIBRARY_FIELDS}
+
+    key = library_cache_key(user.id)
+    state = cache.get(key)
+    if state is None:
+        state = UserLibrary.objects.filter(user_id=user.id).values(*LIBRARY_FIELDS).first()
+        if state is None:
+            state = refresh_library(user.id)
+        else:
+            cache.set(key, state, settings.USER_LIBRARY_CACHE_TIMEOUT)
+
+    movie_ids = {entry['movie'] for entry in state['recent']}
+    movie_ids.update(state['favorites'], state['plan_to_watch'])
+    movies = Movie.objects.catalog().in_bulk(movie_ids) if movie_ids else {}
+
+    # Movies deleted since the last refresh are simply left out
+    return {
+        'recent': [
+            LibraryItem(
+                movies[entry['movie']],
+                id=entry['history'],
+                watched_at=parse_datetime(entry['watched_at']),
+                position=entry['position'],
+                duration=entry['duration'],
+            )
+            for entry in state['recent'] if entry['movie'] in movies
+        ],
+        'favorites': [LibraryItem(movies[movie_id]) for movie_id in state['favorites'] if movie_id in movies],
+        'plan_to_watch': [LibraryItem(movies[movie_id]) for movie_id in state['plan_to_watch'] if movie_id in movies],
+    }
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from userspage.history import archive_history
+
+
+class Command(BaseCommand):
+    help = "Move WatchHistory rows older than WATCH_HISTORY_RETENTION_DAYS to WatchHistoryArchive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Rows moved per transaction.")
+
+    def handle(self, *args, **options):
+        count = archive_history(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Watch history archived ({count} rows)."))
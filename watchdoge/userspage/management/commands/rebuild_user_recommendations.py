@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from userspage.recommendations import rebuild_recommendations
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed \"Because you watched\" feeds (UserRecommendation) for every user."
+
+    def handle(self, *args, **options):
+        count = rebuild_recommendations()
+        self.stdout.write(self.style.SUCCESS(f"User recommendations rebuilt ({count} rows)."))
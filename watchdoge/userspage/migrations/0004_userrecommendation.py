@@ -0,0 +1,34 @@
+# Generated by Django 4.2.23 on 2026-10-18 13:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0015_moviesimilarity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('userspage', '0003_watchlist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('because_of', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='streaming.movie')),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='streaming.movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-score'], name='user_recommendation_rank_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='userrecommendation',
+            constraint=models.UniqueConstraint(fields=('user', 'movie'), name='unique_user_recommendation'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('userspage', '0005_watchprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserLibrary',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='library', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recent', models.JSONField(default=list)),
+                ('favorites', models.JSONField(default=list)),
+                ('plan_to_watch', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
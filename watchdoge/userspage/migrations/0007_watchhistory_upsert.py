@@ -0,0 +1,58 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:22
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def merge_duplicate_history(apps, schema_editor):
+    # Keep the latest row of every (user, movie), with the number of rows as its play count
+    WatchHistory = apps.get_model('userspage', 'WatchHistory')
+    duplicates = (
+        WatchHistory.objects.order_by().values('user_id', 'movie_id')
+        .annotate(rows=models.Count('id')).filter(rows__gt=1)
+    )
+    for group in duplicates.iterator():
+        ids = list(
+            WatchHistory.objects.filter(user_id=group['user_id'], movie_id=group['movie_id'])
+            .order_by('-watched_at', '-id').values_list('id', flat=True)
+        )
+        WatchHistory.objects.filter(id=ids[0]).update(play_count=len(ids))
+        WatchHistory.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('streaming', '0017_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('userspage', '0006_userlibrary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WatchHistoryArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('watched_at', models.DateTimeField()),
+                ('play_count', models.PositiveIntegerField(default=1)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='watchhistory',
+            name='play_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(merge_duplicate_history, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='watchhistoryarchive',
+            name='movie',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='streaming.movie'),
+        ),
+        migrations.AddField(
+            model_name='watchhistoryarchive',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.23 on 2026-10-18 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Separate from 0007 so the duplicate merge is committed before the tables are altered
+
+    dependencies = [
+        ('userspage', '0007_watchhistory_upsert'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', '-added_at', 'movie'], name='favorite_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchhistory',
+            index=models.Index(fields=['user', '-watched_at', 'movie'], name='watch_history_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchhistory',
+            index=models.Index(fields=['watched_at'], name='watch_history_age_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['user', '-added_at', 'movie'], name='watchlist_recent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='watchhistory',
+            constraint=models.UniqueConstraint(fields=('user', 'movie'), name='unique_watch_history'),
+        ),
+        migrations.AddIndex(
+            model_name='watchhistoryarchive',
+            index=models.Index(fields=['user', '-watched_at'], name='watch_archive_user_idx'),
+        ),
+    ]
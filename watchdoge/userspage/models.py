@@ -13,17 +13,32 @@ class Favorite(models.Model):
 
     class Meta:
         unique_together = ('user', 'movie')  # prevents duplicates
+        indexes = [
+            models.Index(fields=['user', '-added_at', 'movie'], name='favorite_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.movie.title}"
 
 class WatchHistory(models.Model):
+    # One row per user and movie: watching again bumps watched_at and play_count
+    # (see userspage/history.py). Rows older than WATCH_HISTORY_RETENTION_DAYS move
+    # to WatchHistoryArchive.
     user = models.ForeignKey(User,on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     watched_at = models.DateTimeField(auto_now_add=True)
+    play_count = models.PositiveIntegerField(default=1)
 
     class Meta:
         ordering=['-watched_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'movie'], name='unique_watch_history'),
+        ]
+        indexes = [
+            # covers the "recently watched" reads: range scan in order, no table lookups
+            models.Index(fields=['user', '-watched_at', 'movie'], name='watch_history_recent_idx'),
+            models.Index(fields=['watched_at'], name='watch_history_age_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} watched {self.movie.title}"
@@ -35,3 +50,83 @@ class Watchlist(models.Model):
 
     class Meta:
         unique_together = ('user', 'movie')  # prevents duplicates
+        indexes = [
+            models.Index(fields=['user', '-added_at', 'movie'], name='watchlist_recent_idx'),
+        ]
+
+class WatchHistoryArchive(models.Model):
+    """WatchHistory rows past the retention period, moved here in batches by archive_watch_history."""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    watched_at = models.DateTimeField()
+    play_count = models.PositiveIntegerField(default=1)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-watched_at'], name='watch_archive_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} watched {self.movie_id} (archived)"
+
+class UserRecommendation(models.Model):
+    """
+    Precomputed "Because you watched…" feed: movies a user has not seen yet,
+    each with the movie from their history that brought it in. Rebuilt
+    periodically by Celery (see userspage/recommendations.py).
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='recommendations')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    because_of = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'movie'], name='unique_user_recommendation'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='user_recommendation_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} -> {self.movie_id} ({self.score:.3f})"
+
+class WatchProgress(models.Model):
+    """
+    Where a user stopped in a movie, for resuming playback. Written in batches
+    from the buffered player heartbeats (see userspage/progress.py), never
+    once per heartbeat.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='watch_progress')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='+')
+    position = models.FloatField(help_text="Seconds")
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds, as reported by the player")
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'movie'], name='unique_watch_progress'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-updated_at'], name='watch_progress_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} at {self.position:.0f}s of {self.movie_id}"
+
+class UserLibrary(models.Model):
+    """
+    Compact per-user library state read by the profile, watchlist and home
+    pages in one query (or cache hit): recently watched movies with their
+    resume position, favorites and plan-to-watch, as movie ids. Maintained on
+    write by signals and the watch progress flush (see userspage/library.py).
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='library')
+    recent = models.JSONField(default=list)
+    favorites = models.JSONField(default=list)
+    plan_to_watch = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Library of {self.user_id}"
@@ -0,0 +1,175 @@
+import math
+import threading
+import time
+from datetime import datetime, timezone
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from streaming.models import Movie
+from .library import update_library_progress
+from .models import WatchProgress
+
+PENDING_KEY = "watch-progress:pending"
+FLUSHING_KEY = "watch-progress:flushing"
+
+
+def encode_entry(position, duration, at):
+    return f"{position}:{'' if duration is None else duration}:{at}"
+
+
+def decode_entry(value):
+    position, duration, at = value.split(":")
+    return float(position), float(duration) if duration else None, float(at)
+
+
+class RedisProgressBuffer:
+    """
+    Pending positions in one Redis hash, field "user:movie". HSET overwrites,
+    so however often the player reports, a flush window holds one entry per
+    user-movie. Shared by every web process and drained by the Celery flush.
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def add(self, user_id, movie_id, value):
+        self.client.hset(PENDING_KEY, f"{user_id}:{movie_id}", value)
+
+    def get(self, user_id, movie_id):
+        field = f"{user_id}:{movie_id}"
+        return self.client.hget(PENDING_KEY, field) or self.client.hget(FLUSHING_KEY, field)
+
+    def take(self):
+        # RENAME is atomic: heartbeats arriving during the flush start a fresh hash.
+        # A FLUSHING_KEY left by a flush that died is written first.
+        if not self.client.exists(FLUSHING_KEY):
+            try:
+                self.client.rename(PENDING_KEY, FLUSHING_KEY)
+            except redis.ResponseError:  # nothing pending
+                return {}
+        return self.client.hgetall(FLUSHING_KEY)
+
+    def release(self):
+        self.client.delete(FLUSHING_KEY)
+
+
+class LocalProgressBuffer:
+    """In-process stand-in when no Redis is configured; each process flushes its own."""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def add(self, user_id, movie_id, value):
+        with self.lock:
+            self.entries[f"{user_id}:{movie_id}"] = value
+
+    def get(self, user_id, movie_id):
+        return self.entries.get(f"{user_id}:{movie_id}")
+
+    def take(self):
+        with self.lock:
+            entries, self.entries = self.entries, {}
+        return entries
+
+    def release(self):
+        pass
+
+
+_buffer = None
+_flushed_at = time.monotonic()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        url = settings.WATCH_PROGRESS_REDIS_URL
+        _buffer = RedisProgressBuffer(url) if url else LocalProgressBuffer()
+    return _buffer
+
+
+def parse_position(value):
+    """Seconds from a heartbeat field, or None if missing, negative or not a number."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) and value >= 0 else None
+
+
+def record_progress(user_id, movie_id, position, duration=None):
+    """
+    Heartbeat from the player: only the buffer is touched. Positions reach
+    the database on the next flush_progress (Celery beat, every
+    WATCH_PROGRESS_FLUSH_INTERVAL seconds).
+    """
+    global _flushed_at
+    buffer = get_buffer()
+    buffer.add(user_id, movie_id, encode_entry(position, duration, time.time()))
+    if isinstance(buffer, LocalProgressBuffer) and time.monotonic() - _flushed_at >= settings.WATCH_PROGRESS_FLUSH_INTERVAL:
+        # no shared buffer for the worker to drain: the process flushes its own
+        _flushed_at = time.monotonic()
+        flush_progress()
+
+
+def flush_progress():
+    """Write the buffered positions with one upsert per batch; returns the number of rows."""
+    buffer = get_buffer()
+    entries = buffer.take()
+    if not entries:
+        return 0
+
+    rows = {}
+    for field, value in entries.items():
+        user_id, movie_id = map(int, field.split(":"))
+        rows[user_id, movie_id] = decode_entry(value)
+
+    # Movies or users deleted since the heartbeat would fail the foreign keys
+    movie_ids = set(Movie.objects.filter(id__in={movie_id for _, movie_id in rows}).values_list('id', flat=True))
+    user_ids = set(
+        get_user_model().objects.filter(id__in={user_id for user_id, _ in rows}).values_list('id', flat=True)
+    )
+    progress = [
+        WatchProgress(
+            user_id=user_id,
+            movie_id=movie_id,
+            position=position,
+            duration=duration,
+            updated_at=datetime.fromtimestamp(at, tz=timezone.utc),
+        )
+        for (user_id, movie_id), (position, duration, at) in rows.items()
+        if user_id in user_ids and movie_id in movie_ids
+    ]
+    WatchProgress.objects.bulk_create(
+        progress,
+        batch_size=settings.WATCH_PROGRESS_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['user', 'movie'],
+        update_fields=['position', 'duration', 'updated_at'],
+    )
+    update_library_progress(progress)
+    buffer.release()
+    return len(progress)
+
+
+def get_resume_position(user, movie):
+    """
+    Seconds to start playback from: the buffered heartbeat if there is one,
+    else the stored progress. 0 near the start or the end of the movie.
+    """
+    if not user.is_authenticated:
+        return 0
+    value = get_buffer().get(user.id, movie.id)
+    if value is not None:
+        position, duration, _ = decode_entry(value)
+    else:
+        progress = WatchProgress.objects.filter(user=user, movie=movie).values_list('position', 'duration').first()
+        if progress is None:
+            return 0
+        position, duration = progress
+
+    if position < settings.WATCH_PROGRESS_RESUME_MARGIN:
+        return 0
+    if duration and duration - position < settings.WATCH_PROGRESS_RESUME_MARGIN:
+        return 0
+    return int(position)
@@ -0,0 +1,180 @@
+from array import array
+from itertools import repeat
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from streaming.models import select_catalog_movie
+from streaming.recommender import insert_rows
+from .models import Favorite, UserRecommendation, Watchlist, WatchHistory
+
+GENERATION_KEY = "user-recommendations:generation"
+ITERATOR_CHUNK_SIZE = 5000
+
+
+def feed_cache_key(user_id):
+    return f"user-recommendations:{user_id}"
+
+
+def interaction_matrix():
+    """
+    (user ids, movie ids, users x movies CSR matrix of interaction weights).
+
+    The interaction tables are streamed with iterator() into compact typed
+    arrays (20 bytes per row), so memory grows with the number of interactions
+    and never holds model instances or a full queryset cache. Repeated
+    interactions (watched and favorited) add up.
+    """
+    weights = settings.USER_RECOMMENDATION_WEIGHTS
+    users, movies, values = array('q'), array('q'), array('f')
+    for model, weight in ((WatchHistory, weights['watched']), (Favorite, weights['favorite']), (Watchlist, weights['watchlist'])):
+        rows = model.objects.order_by().values_list('user_id', 'movie_id').iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+        for user_id, movie_id in rows:
+            users.append(user_id)
+            movies.append(movie_id)
+            values.append(weight)
+
+    user_ids, user_rows = np.unique(np.asarray(users, dtype=np.int64), return_inverse=True)
+    movie_ids, movie_columns = np.unique(np.asarray(movies, dtype=np.int64), return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.asarray(values, dtype=np.float32), (user_rows, movie_columns)),
+        shape=(len(user_ids), len(movie_ids)),
+    )
+    matrix.sum_duplicates()
+    return user_ids, movie_ids, matrix
+
+
+def item_neighbours(matrix, k):
+    """
+    Movies x movies CSR matrix keeping, for every movie, its k nearest
+    neighbours by cosine similarity of their user columns (item-item
+    co-occurrence). Computed in blocks of RECOMMENDER_BATCH_SIZE movies so
+    only one block of the (sparse) co-occurrence matrix exists at a time.
+    """
+    columns = normalize(matrix.tocsc(), axis=0)
+    by_movie = columns.T.tocsr()
+    movie_count = matrix.shape[1]
+    batch_size = settings.RECOMMENDER_BATCH_SIZE
+
+    rows, cols, data = [], [], []
+    for start in range(0, movie_count, batch_size):
+        block = (by_movie[start:start + batch_size] @ columns).tocsr()
+        for offset in range(block.shape[0]):
+            lo, hi = block.indptr[offset], block.indptr[offset + 1]
+            neighbours, scores = block.indices[lo:hi], block.data[lo:hi]
+            keep = neighbours != start + offset
+            neighbours, scores = neighbours[keep], scores[keep]
+            if len(scores) > k:
+                best = np.argpartition(scores, -k)[-k:]
+                neighbours, scores = neighbours[best], scores[best]
+            rows.append(np.full(len(neighbours), start + offset))
+            cols.append(neighbours)
+            data.append(scores)
+
+    if not rows:
+        return sparse.csr_matrix((movie_count, movie_count), dtype=np.float32)
+    return sparse.csr_matrix(
+        (np.concatenate(data), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(movie_count, movie_count),
+    )
+
+
+def feed_rows(user_ids, movie_ids, matrix, neighbours, size):
+    """
+    (user id, movie id, because-of movie id, score) tuples: for each user the
+    `size` unseen movies with the highest weighted sum of similarities to the
+    movies they interacted with, attributed to the movie contributing most.
+    """
+    for row, user_id in enumerate(user_ids.tolist()):
+        lo, hi = matrix.indptr[row], matrix.indptr[row + 1]
+        seen, weights = matrix.indices[lo:hi], matrix.data[lo:hi]
+        block = neighbours[seen].tocoo()
+
+        unseen = ~np.isin(block.col, seen)
+        candidates, sources = block.col[unseen], block.row[unseen]
+        contributions = block.data[unseen] * weights[sources]
+        if not len(candidates):
+            continue
+
+        # Group by candidate, strongest contribution first within each group
+        order = np.lexsort((-contributions, candidates))
+        candidates, sources, contributions = candidates[order], sources[order], contributions[order]
+        starts = np.flatnonzero(np.r_[True, candidates[1:] != candidates[:-1]])
+        scores = np.add.reduceat(contributions, starts)
+        candidates, because = candidates[starts], seen[sources[starts]]
+
+        if len(scores) > size:
+            best = np.argpartition(scores, -size)[-size:]
+            candidates, because, scores = candidates[best], because[best], scores[best]
+        yield from zip(repeat(user_id), movie_ids[candidates].tolist(), movie_ids[because].tolist(), scores.tolist())
+
+
+def rebuild_recommendations():
+    """
+    Recompute every user's feed from WatchHistory, Favorite and Watchlist and
+    replace UserRecommendation. Cached feeds are invalidated by bumping the
+    cache generation afterwards.
+    """
+    user_ids, movie_ids, matrix = interaction_matrix()
+    neighbours = item_neighbours(matrix, settings.USER_RECOMMENDATIONS_NEIGHBOURS)
+    rows = list(feed_rows(user_ids, movie_ids, matrix, neighbours, settings.USER_RECOMMENDATIONS_SIZE))
+
+    with transaction.atomic():
+        UserRecommendation.objects.all().delete()
+        insert_rows(UserRecommendation, ('user', 'movie', 'because_of', 'score'), rows)
+    transaction.on_commit(bump_generation)
+    return len(rows)
+
+
+def bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, None)
+
+
+def load_feed(user_id, groups, per_group):
+    """[{'because_of': movie, 'movies': [...]}, ...] from the precomputed rows, best group first."""
+    recommendations = (
+        UserRecommendation.objects
+        .filter(user_id=user_id, movie__release_year__lte=timezone.now().year)
+        .exclude(movie__status='deleting')
+        .select_related('because_of')
+        .order_by('-score')
+    )
+    recommendations = select_catalog_movie(recommendations, 'because_of', 'because_of__title')
+    feed = {}
+    for recommendation in recommendations:
+        group = feed.get(recommendation.because_of_id)
+        if group is None:
+            if len(feed) == groups:
+                continue
+            group = feed[recommendation.because_of_id] = {'because_of': recommendation.because_of, 'movies': []}
+        if len(group['movies']) < per_group:
+            group['movies'].append(recommendation.movie)
+    return list(feed.values())
+
+
+def get_user_feed(user, groups=3, per_group=6):
+    """
+    "Because you watched…" rows for a page: a cache lookup, falling back to
+    one query on UserRecommendation. Never computes anything in the request.
+    """
+    if not user.is_authenticated:
+        return []
+    generation = cache.get(GENERATION_KEY, 1)
+    key = feed_cache_key(user.id)
+    feed = cache.get(key, version=generation)
+    if feed is None:
+        feed = load_feed(user.id, groups, per_group)
+        cache.set(key, feed, settings.USER_RECOMMENDATIONS_CACHE_TIMEOUT, version=generation)
+    return feed
+
+
+def forget_recommendation(user_id, movie_id):
+    """A recommended movie was watched/favorited/listed: drop it until the next rebuild."""
+    if UserRecommendation.objects.filter(user_id=user_id, movie_id=movie_id).delete()[0]:
+        cache.delete(feed_cache_key(user_id), version=cache.get(GENERATION_KEY, 1))
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Favorite, Watchlist, WatchHistory
+from .library import schedule_library_refresh
+from .recommendations import forget_recommendation
+
+
+@receiver(post_save, sender=WatchHistory)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Watchlist)
+def drop_seen_recommendation(sender, instance, created, **kwargs):
+    if created:
+        forget_recommendation(instance.user_id, instance.movie_id)
+
+
+@receiver(post_save, sender=WatchHistory)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Watchlist)
+@receiver(post_delete, sender=WatchHistory)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Watchlist)
+def refresh_user_library(sender, instance, **kwargs):
+    schedule_library_refresh(instance.user_id)
@@ -0,0 +1,26 @@
+from celery import shared_task
+from .history import archive_history
+from .progress import flush_progress
+from .recommendations import rebuild_recommendations
+
+
+@shared_task
+def rebuild_user_recommendations():
+    """Recompute the "Because you watched…" feeds, scheduled by Celery beat."""
+    count = rebuild_recommendations()
+    print(f"[TASK] User recommendations rebuilt ({count} rows)")
+
+
+@shared_task
+def flush_watch_progress():
+    """Upsert the buffered player positions into WatchProgress, scheduled by Celery beat."""
+    count = flush_progress()
+    if count:
+        print(f"[TASK] Watch progress flushed ({count} rows)")
+
+
+@shared_task
+def archive_watch_history():
+    """Move history rows past the retention period to WatchHistoryArchive, scheduled by Celery beat."""
+    count = archive_history()
+    print(f"[TASK] Watch history archived ({count} rows)")
@@ -1,3 +1,338 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from itertools import count
+from unittest import mock
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from streaming.models import Genre, Movie
+from streaming.tests import StreamingTestCase, poster_file
+from .history import archive_history, record_watch
+from .library import get_library, plan_to_watch_queryset, refresh_library
+from .models import Favorite, UserRecommendation, Watchlist, WatchHistory, WatchHistoryArchive, WatchProgress
+from .progress import LocalProgressBuffer, flush_progress, get_buffer, get_resume_position, record_progress
+from .recommendations import (
+    GENERATION_KEY, bump_generation, forget_recommendation, get_user_feed, item_neighbours, rebuild_recommendations,
+)
 
-# Create your tests here.
+
+class PageQueryTests(StreamingTestCase):
+    """Pages listing movies load them in a fixed number of queries, however many there are."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('viewer', password='pw')
+        self.client.force_login(self.user)
+        self.genres = [Genre.objects.create(name=name) for name in ('drama', 'comedy')]
+        self.titles = count()
+
+    def create_movies(self, number):
+        movies = []
+        for _ in range(number):
+            movie = Movie.objects.create(title=f'Movie {next(self.titles)}', status='ready', release_year=2000, poster=poster_file())
+            movie.genres.set(self.genres)
+            movies.append(movie)
+        return movies
+
+    def watch_and_list(self):
+        for movie in self.create_movies(3):
+            WatchHistory.objects.create(user=self.user, movie=movie)
+        for movie in self.create_movies(3):
+            Watchlist.objects.create(user=self.user, movie=movie)
+        because_of = self.create_movies(1)[0]
+        for movie in self.create_movies(3):
+            UserRecommendation.objects.create(user=self.user, movie=movie, because_of=because_of, score=1)
+        refresh_library(self.user.id)
+
+    def test_watchlist(self):
+        self.assertConstantQueries(9, reverse('watchlist'), self.watch_and_list)
+
+    def test_profile(self):
+        self.assertConstantQueries(11, reverse('user-profile'), self.watch_and_list)
+
+    def test_home(self):
+        self.assertConstantQueries(11, reverse('home'), self.watch_and_list)
+
+    def test_admin_movie_list(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.assertConstantQueries(7, reverse('admin-movies-list'), lambda: self.create_movies(3))
+
+
+class WatchedListTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('viewer', password='pw')
+        self.client.force_login(self.user)
+
+    def test_the_whole_history_is_paginated(self):
+        for number in range(25):
+            movie = Movie.objects.create(title=f'Movie {number}', status='ready', release_year=2000)
+            WatchHistory.objects.create(user=self.user, movie=movie)
+
+        first = self.client.get(reverse('watchlist')).context['watched_movies']
+        self.assertEqual(len(first), 20)
+        self.assertTrue(first.has_next())
+
+        second = self.client.get(reverse('watchlist'), {'cursor': first.next_cursor}).context['watched_movies']
+        self.assertEqual(len(second), 5)
+        self.assertFalse(second.has_next())
+        watched = [item.movie.title for item in [*first, *second]]
+        self.assertEqual(watched, [f'Movie {number}' for number in reversed(range(25))])
+
+
+class WatchHistoryTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('viewer', password='pw')
+        self.movie = Movie.objects.create(title='Dune', status='ready', release_year=2000)
+
+    def test_replays_update_the_single_row(self):
+        first = record_watch(self.user.id, self.movie.id)
+        second = record_watch(self.user.id, self.movie.id)
+        self.assertEqual((first.play_count, second.play_count), (1, 2))
+        self.assertEqual(first.id, second.id)
+        row = WatchHistory.objects.get(user=self.user, movie=self.movie)
+        self.assertEqual((row.play_count, row.watched_at), (2, second.watched_at))
+
+    def test_replays_move_the_watch_time_forward(self):
+        first = record_watch(self.user.id, self.movie.id)
+        with mock.patch('userspage.history.timezone.now', return_value=first.watched_at + timedelta(hours=1)):
+            second = record_watch(self.user.id, self.movie.id)
+        # Stored as the ORM stores it, so lookups and ordering on watched_at work
+        row = WatchHistory.objects.get(watched_at=second.watched_at)
+        self.assertEqual(row.play_count, 2)
+        self.assertEqual(WatchHistory.objects.filter(watched_at__gt=first.watched_at).get(), row)
+
+    def test_only_rows_past_the_retention_period_are_archived(self):
+        recent = Movie.objects.create(title='Arrival', status='ready', release_year=2000)
+        older = Movie.objects.create(title='Solaris', status='ready', release_year=2000)
+        for movie in (self.movie, recent, older):
+            record_watch(self.user.id, movie.id)
+        retention = timedelta(days=settings.WATCH_HISTORY_RETENTION_DAYS)
+        WatchHistory.objects.filter(movie=self.movie).update(watched_at=timezone.now() - retention - timedelta(days=1))
+        WatchHistory.objects.filter(movie=older).update(watched_at=timezone.now() - retention - timedelta(days=30))
+        WatchHistory.objects.filter(movie=recent).update(watched_at=timezone.now() - retention + timedelta(days=1))
+
+        self.assertEqual(archive_history(batch_size=1), 2)
+        self.assertEqual(list(WatchHistory.objects.values_list('movie_id', flat=True)), [recent.id])
+        self.assertEqual(
+            set(WatchHistoryArchive.objects.values_list('movie_id', 'play_count')), {(self.movie.id, 1), (older.id, 1)}
+        )
+        self.assertEqual(archive_history(), 0)
+
+    def test_first_play_drops_the_recommendation_and_refreshes_the_library(self):
+        other = Movie.objects.create(title='Arrival', status='ready', release_year=2000)
+        UserRecommendation.objects.create(user=self.user, movie=self.movie, because_of=other, score=1)
+        refresh_library(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_watch(self.user.id, self.movie.id)
+        self.assertFalse(UserRecommendation.objects.filter(user=self.user).exists())
+        self.assertEqual([item.movie.id for item in get_library(self.user)['recent']], [self.movie.id])
+
+    def test_archived_movies_stay_out_of_plan_to_watch(self):
+        Watchlist.objects.create(user=self.user, movie=self.movie)
+        record_watch(self.user.id, self.movie.id)
+        old = timezone.now() - timedelta(days=settings.WATCH_HISTORY_RETENTION_DAYS + 1)
+        WatchHistory.objects.update(watched_at=old)
+        self.assertEqual(archive_history(), 1)
+        self.assertTrue(WatchHistoryArchive.objects.filter(user=self.user, movie=self.movie).exists())
+        self.assertFalse(plan_to_watch_queryset(self.user.id).exists())
+
+
+class RecommendationTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        self.binger = User.objects.create_user('binger', password='pw')
+        self.movies = [Movie.objects.create(title=f'Movie {number}', status='ready', release_year=2000) for number in range(4)]
+
+    def feed_ids(self, user):
+        return {movie.id for group in get_user_feed(user) for movie in group['movies']}
+
+    def rebuild(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return rebuild_recommendations()
+
+    def test_item_neighbours(self):
+        # Users x movies: movies 0 and 1 always go together, 2 once with them, 3 alone
+        matrix = sparse.csr_matrix(np.array([
+            [1, 1, 0, 0],
+            [1, 1, 1, 0],
+            [0, 0, 0, 1],
+        ], dtype=np.float32))
+        for batch_size in (1, 1000):
+            with self.subTest(batch_size=batch_size), override_settings(RECOMMENDER_BATCH_SIZE=batch_size):
+                neighbours = item_neighbours(matrix, 2).toarray()
+                np.testing.assert_allclose(neighbours, [
+                    [0, 1, 0.5 ** 0.5, 0],
+                    [1, 0, 0.5 ** 0.5, 0],
+                    [0.5 ** 0.5, 0.5 ** 0.5, 0, 0],
+                    [0, 0, 0, 0],
+                ], rtol=1e-6)
+
+        # k=1 keeps only the best one, and a movie is never its own neighbour
+        neighbours = item_neighbours(matrix, 1)
+        self.assertEqual(neighbours[0].indices.tolist(), [1])
+        self.assertEqual(neighbours[1].indices.tolist(), [0])
+        self.assertEqual(neighbours[2].nnz, 1)
+        self.assertEqual(neighbours[3].nnz, 0)
+
+    def test_seen_movies_are_not_recommended(self):
+        for movie in self.movies:
+            WatchHistory.objects.create(user=self.binger, movie=movie)
+        WatchHistory.objects.create(user=self.viewer, movie=self.movies[0])
+        Favorite.objects.create(user=self.viewer, movie=self.movies[1])
+
+        self.rebuild()
+        rows = UserRecommendation.objects.filter(user=self.viewer)
+        self.assertEqual({row.movie_id for row in rows}, {self.movies[2].id, self.movies[3].id})
+        self.assertTrue({row.because_of_id for row in rows} <= {self.movies[0].id, self.movies[1].id})
+        # The binger has seen everything
+        self.assertFalse(UserRecommendation.objects.filter(user=self.binger).exists())
+
+    def test_cached_feeds_follow_the_generation(self):
+        WatchHistory.objects.create(user=self.binger, movie=self.movies[0])
+        WatchHistory.objects.create(user=self.binger, movie=self.movies[1])
+        WatchHistory.objects.create(user=self.viewer, movie=self.movies[0])
+        self.assertEqual(self.feed_ids(self.viewer), set())
+
+        # Rebuilt rows stay invisible behind the cached feed until the generation moves on
+        with self.captureOnCommitCallbacks(execute=False):
+            rebuild_recommendations()
+        self.assertEqual(self.feed_ids(self.viewer), set())
+
+        bump_generation()
+        self.assertEqual(cache.get(GENERATION_KEY), 2)
+        self.assertEqual(self.feed_ids(self.viewer), {self.movies[1].id})
+        with self.assertNumQueries(0):
+            get_user_feed(self.viewer)
+
+    def test_rebuild_invalidates_cached_feeds(self):
+        WatchHistory.objects.create(user=self.binger, movie=self.movies[0])
+        WatchHistory.objects.create(user=self.binger, movie=self.movies[1])
+        WatchHistory.objects.create(user=self.viewer, movie=self.movies[0])
+        self.assertEqual(self.feed_ids(self.viewer), set())
+        self.rebuild()
+        self.assertEqual(self.feed_ids(self.viewer), {self.movies[1].id})
+
+    def test_forgotten_recommendations_stay_hidden(self):
+        WatchHistory.objects.create(user=self.binger, movie=self.movies[0])
+        WatchHistory.objects.create(user=self.binger, movie=self.movies[1])
+        WatchHistory.objects.create(user=self.viewer, movie=self.movies[0])
+        self.rebuild()
+        self.assertEqual(self.feed_ids(self.viewer), {self.movies[1].id})
+
+        # Listing it drops the row and the cached feed
+        Watchlist.objects.create(user=self.viewer, movie=self.movies[1])
+        self.assertEqual(self.feed_ids(self.viewer), set())
+        bump_generation()
+        self.assertEqual(self.feed_ids(self.viewer), set())
+        # ...and the next rebuild counts it as seen
+        self.rebuild()
+        self.assertEqual(self.feed_ids(self.viewer), set())
+
+    def test_forgetting_a_movie_never_recommended_keeps_the_cache(self):
+        get_user_feed(self.viewer)
+        forget_recommendation(self.viewer.id, self.movies[0].id)
+        with self.assertNumQueries(0):
+            get_user_feed(self.viewer)
+
+
+@override_settings(WATCH_PROGRESS_FLUSH_INTERVAL=3600, WATCH_PROGRESS_RESUME_MARGIN=30)
+class WatchProgressTests(StreamingTestCase):
+    def setUp(self):
+        super().setUp()
+        # A fresh per-process buffer for every test
+        patches = {'userspage.progress._buffer': LocalProgressBuffer(), 'userspage.progress._flushed_at': time.monotonic()}
+        for target, value in patches.items():
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user('viewer', password='pw')
+        self.movie = Movie.objects.create(title='Dune', status='ready', release_year=2000)
+        self.url = reverse('watch-progress', args=[self.movie.id])
+
+    def stored(self):
+        return list(WatchProgress.objects.values_list('user_id', 'movie_id', 'position', 'duration'))
+
+    def test_the_last_heartbeat_wins(self):
+        for position in (10, 20, 15):
+            record_progress(self.user.id, self.movie.id, position, 600)
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(flush_progress(), 1)
+        self.assertEqual(self.stored(), [(self.user.id, self.movie.id, 15, 600)])
+
+    def test_flush_upserts_every_pending_position(self):
+        other = User.objects.create_user('other', password='pw')
+        arrival = Movie.objects.create(title='Arrival', status='ready', release_year=2000)
+        record_progress(self.user.id, self.movie.id, 100, 600)
+        self.assertEqual(flush_progress(), 1)
+
+        record_progress(self.user.id, self.movie.id, 200, 600)
+        record_progress(self.user.id, arrival.id, 50)
+        record_progress(other.id, self.movie.id, 70, 600)
+        self.assertEqual(flush_progress(), 3)
+        self.assertEqual(set(self.stored()), {
+            (self.user.id, self.movie.id, 200, 600),
+            (self.user.id, arrival.id, 50, None),
+            (other.id, self.movie.id, 70, 600),
+        })
+        # Drained: nothing left to write
+        self.assertEqual(flush_progress(), 0)
+
+    def test_flush_skips_deleted_movies(self):
+        gone = Movie.objects.create(title='Gone', status='ready', release_year=2000)
+        record_progress(self.user.id, gone.id, 100)
+        record_progress(self.user.id, self.movie.id, 100)
+        Movie.objects.filter(id=gone.id).delete()
+        self.assertEqual(flush_progress(), 1)
+        self.assertEqual(self.stored(), [(self.user.id, self.movie.id, 100, None)])
+
+    @override_settings(WATCH_PROGRESS_FLUSH_INTERVAL=0)
+    def test_a_process_without_redis_flushes_its_own_buffer(self):
+        record_progress(self.user.id, self.movie.id, 100)
+        self.assertEqual(self.stored(), [(self.user.id, self.movie.id, 100, None)])
+
+    def test_resume_position(self):
+        self.assertEqual(get_resume_position(self.user, self.movie), 0)
+        for position, duration, expected in (
+            (10, 600, 0),          # near the start
+            (300.7, 600, 300),
+            (580, 600, 0),         # near the end: start over
+            (580, None, 580),      # no duration reported
+        ):
+            with self.subTest(position=position, duration=duration):
+                # Read from the buffer before the flush, and from the table after it
+                record_progress(self.user.id, self.movie.id, position, duration)
+                self.assertEqual(get_resume_position(self.user, self.movie), expected)
+                flush_progress()
+                self.assertEqual(get_resume_position(self.user, self.movie), expected)
+
+    def test_heartbeats_are_buffered(self):
+        self.client.force_login(self.user)
+        response = self.client.post(self.url, {'position': '120.5', 'duration': '600'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.stored(), [])
+        self.assertEqual(get_resume_position(self.user, self.movie), 120)
+
+    def test_bad_positions_are_rejected(self):
+        self.client.force_login(self.user)
+        for data in ({}, {'position': ''}, {'position': 'abc'}, {'position': '-1'}, {'position': 'nan'}, {'position': 'inf'}):
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(self.url, data).status_code, 400)
+        self.assertIsNone(get_buffer().get(self.user.id, self.movie.id))
+
+    def test_heartbeats_need_a_signed_in_user(self):
+        response = self.client.post(self.url, {'position': '120'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(get_buffer().entries), 0)
+
+    def test_heartbeats_are_post_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(self.url, {'position': '120'}).status_code, 405)
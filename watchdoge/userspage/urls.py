@@ -8,7 +8,9 @@ urlpatterns=[
     path('genre/<str:genreName>/',views.movies_by_genre, name='movies-by-genre'),
     path('movie/<int:movieId>/',views.movie_details,name='movie-details'),
     path('watch-movie/<int:movieId>/',views.watch_movie,name='watch-movie'),
+    path('watch-movie/<int:movieId>/progress/',views.watch_progress,name='watch-progress'),
     path('search/',views.movie_search,name='movie-search'),
+    path('search/suggest/',views.movie_suggest,name='movie-suggest'),
     path('profile/',views.user_profile_view,name='user-profile'),
     path('profile/<str:username>/edit-pfp/',views.edit_profile_pic,name='edit-profile-pic'),
     path('profile/<str:username>/edit-bio/',views.edit_profile_bio,name='edit-profile-bio'),
@@ -1,58 +1,66 @@
 from django.shortcuts import render,redirect,get_object_or_404
-from streaming.models import Movie,Genre
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
+from django.urls import reverse
+from streaming.models import Movie,Genre,select_catalog_movie
+from streaming.similarity import get_similar_movies
+from streaming.search import filter_by_genres, search_movies
+from streaming.suggest import suggest_movies
+from streaming.cache import cache_anonymous_page
+from streaming.tokens import playback_url
+from streaming.pagination import KeysetPaginator
 from django.db.models.functions import Lower
 from django.contrib.auth.decorators import login_required
 from accounts.models import UserProfile
 from .models import WatchHistory, Favorite, Watchlist
+from .recommendations import get_user_feed
+from .library import get_library, plan_to_watch_queryset
+from .history import record_watch
+from .progress import get_resume_position, parse_position, record_progress
 from accounts.auth import user_only
 from django.contrib import messages
-from difflib import SequenceMatcher
 import os
 from django.conf import settings
 from django.utils import timezone 
 # Create your views here.
 
+@cache_anonymous_page()
 def home(request):
-    movies=Movie.objects.all()
-    genres=Genre.objects.all()
-
     current_year = timezone.now().year
     
-    latest_movies= movies.filter(release_year=current_year).order_by('-release_year')
-    coming_soon = movies.filter(release_year__gt=current_year).order_by('release_year')
+    latest_movies= Movie.objects.catalog().filter(release_year=current_year).order_by('-release_year')
+    coming_soon = Movie.objects.catalog().filter(release_year__gt=current_year).order_by('release_year')
     
 
+    library = get_library(request.user)
+
     context={
-        'movies':movies,
-        'genres':genres,
         'latest_movies':latest_movies,
         'coming_soon':coming_soon,
+        'continue_watching':[item for item in library['recent'] if item.in_progress],
+        'recommendation_feed':get_user_feed(request.user),
     }
     return render(request,'userspage/homepage.html',context)
 
+@cache_anonymous_page()
 def genres_list(request):
     genres=Genre.objects.all().order_by('name')
 
     return render(request, 'userspage/genres.html',{'genres':genres})
 
+@cache_anonymous_page()
 def movies_list(request):
-    movies = Movie.objects.all().order_by('title')
-    paginator = Paginator(movies,15)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    movies = Movie.objects.catalog().order_by('title')
+    page_obj = KeysetPaginator(movies,15,request.GET).get_page()
 
     return render(request,'userspage/movies.html',{'page_obj':page_obj})
 
+@cache_anonymous_page()
 def movies_by_genre(request,genreName):
     genre=Genre.objects.get(name__iexact=genreName)
-    movies=Movie.objects.filter(genres=genre).order_by(Lower('title'))
-
-    paginator = Paginator(movies,15)
+    movies=Movie.objects.catalog().filter(genres=genre).annotate(sort_title=Lower('title')).order_by('sort_title')
 
-    page_number=request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(movies,15,request.GET).get_page()
 
     context={
         'genre':genre,
@@ -61,7 +69,7 @@ def movies_by_genre(request,genreName):
     return render(request,'userspage/movies_by_genre.html',context)
 
 def movie_details(request,movieId):
-    movie=get_object_or_404(Movie,id=movieId)
+    movie=get_object_or_404(Movie.objects.live(),id=movieId)
 
     is_favorite=False
     if request.user.is_authenticated:
@@ -82,37 +90,45 @@ def movie_details(request,movieId):
     return render(request,'userspage/movie_details.html',context)
 
 def watch_movie(request,movieId):
-    movie=get_object_or_404(Movie,id=movieId)
+    movie=get_object_or_404(Movie.objects.live(),id=movieId)
     
     #Log watch movies
     if request.user.is_authenticated:
-        WatchHistory.objects.get_or_create(user=request.user,movie=movie)
+        record_watch(request.user.id, movie.id)
 
     recommendations=get_similar_movies(movie)
     context={
         'movie':movie,
         'recommended_movies':recommendations,
-        'MEDIA_URL': settings.MEDIA_URL
+        'playback_url':playback_url(movie),
+        'resume_position':get_resume_position(request.user, movie),
+        'heartbeat_interval':settings.WATCH_PROGRESS_HEARTBEAT_INTERVAL,
     }
     return render(request,'userspage/watch_movie.html',context)
 
+@login_required
+@require_POST
+def watch_progress(request,movieId):
+    # Player heartbeat: buffered, written to WatchProgress by the periodic flush
+    position = parse_position(request.POST.get('position'))
+    if position is None:
+        return JsonResponse({'error':'position is required.'},status=400)
+    duration = parse_position(request.POST.get('duration')) or None
+    record_progress(request.user.id, movieId, position, duration)
+    return HttpResponse(status=204)
+
 def movie_search(request):
     query = request.GET.get('query','')
     selected_genres = request.GET.getlist('genres')
-    movies= Movie.objects.all()
+    movies= Movie.objects.catalog().order_by('title')
     
     if query:
-        movies = movies.filter(
-            Q(title__icontains=query) |
-            Q(description__icontains=query) 
-        ).distinct()
+        movies = search_movies(movies, query)
 
     if selected_genres:
-        movies = movies.filter(genres__id__in=selected_genres).distinct()
+        movies = filter_by_genres(movies, selected_genres)
     
-    paginator = Paginator(movies,10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = KeysetPaginator(movies,10,request.GET).get_page()
 
     context={
         'query':query,
@@ -121,41 +137,33 @@ def movie_search(request):
     }
     return render(request, 'userspage/search_result.html', context)
 
-#######################
-#######################
-def get_similar_movies(current_movie, limit=5):
-    all_movies = Movie.objects.exclude(id=current_movie.id)
-
-    current_year=timezone.now().year
-    # Genre filtering
-    genre_ids = current_movie.genres.values_list('id', flat=True)
-    genre_matches = all_movies.filter(genres__in=genre_ids,release_year__lte=current_year).distinct()
-
-    # Optional: Filter by name similarity using SequenceMatcher
-    def similarity(a, b):
-        return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-
-    genre_matches = sorted(
-        genre_matches,
-        key=lambda m: similarity(m.title, current_movie.title),
-        reverse=True
-    )
+def movie_suggest(request):
+    # Typeahead for the search box: served from the in-memory title index, no query
+    query = request.GET.get('query','')
+    results = [
+        {
+            'id':movie_id,
+            'title':title,
+            'release_year':release_year,
+            'url':reverse('movie-details', args=[movie_id]),
+        }
+        for movie_id, title, release_year in suggest_movies(query)
+    ]
+    return JsonResponse({'query':query,'results':results})
 
-    return genre_matches[:limit]
-###########################
-###########################
 
 @login_required
 @user_only
 def user_profile_view(request):
     profile = UserProfile.objects.get(user=request.user)
-    history = WatchHistory.objects.filter(user=request.user)[:10]
-    favorites = Favorite.objects.filter(user=request.user).select_related('movie')
+    library = get_library(request.user)
 
     context={
         'profile':profile,
-        'watch_history':history,
-        'favorite_movies':favorites,
+        'continue_watching':[item for item in library['recent'] if item.in_progress],
+        'watch_history':library['recent'][:10],
+        'favorite_movies':library['favorites'],
+        'recommendation_feed':get_user_feed(request.user),
     }
     return render(request, 'userspage/user_profile.html',context)
 
@@ -199,7 +207,7 @@ def edit_profile_bio(request, username):
 
 @login_required
 def toggle_favorite(request, movieId):
-    movie = get_object_or_404(Movie, id=movieId)
+    movie = get_object_or_404(Movie.objects.live(), id=movieId)
     favorite, created = Favorite.objects.get_or_create(user=request.user, movie=movie)
 
     if not created:
@@ -215,16 +223,17 @@ def toggle_favorite(request, movieId):
 @user_only
 def my_watchlist(request):
     profile = UserProfile.objects.get(user=request.user)
-    # All movies the user has watched
-    watched_movies = WatchHistory.objects.filter(user=request.user).select_related('movie')
-
-    # Movies in Watchlist but not yet watched
-    plan_to_watch = Watchlist.objects.filter(user=request.user).exclude(
-        movie__in=[w.movie for w in watched_movies]
-    ).select_related('movie')
+    # The whole history, newest first, a keyset page at a time (the library row only keeps the latest few)
+    watched = select_catalog_movie(
+        WatchHistory.objects.filter(user=request.user).exclude(movie__status='deleting'), 'watched_at'
+    ).order_by('-watched_at')
+    watched_page = KeysetPaginator(watched,20,request.GET).get_page()
+
+    # Movies in Watchlist but not yet watched (NOT EXISTS subquery, history is never loaded)
+    plan_to_watch = select_catalog_movie(plan_to_watch_queryset(request.user.id))
     context = {
         'profile':profile,
-        'watched_movies': watched_movies,
+        'watched_movies': watched_page,
         'plan_to_watch': plan_to_watch,
     }
     return render(request, 'userspage/watchlist.html', context)
@@ -232,7 +241,7 @@ def my_watchlist(request):
 @login_required
 @user_only
 def add_to_watchlist(request, movieId):
-    movie = get_object_or_404(Movie, id=movieId)
+    movie = get_object_or_404(Movie.objects.live(), id=movieId)
     Watchlist.objects.get_or_create(user=request.user, movie=movie)
     messages.error(request, "You need an account to perform this action!")
     return redirect('movie-details', movieId=movie.id)
@@ -1,5 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+from streaming.cache import get_or_build
 from streaming.models import Genre
 
+
+def cached_genres():
+    return get_or_build('genres', 'all', lambda: list(Genre.objects.all()), local=True)
+
+
 def genres_list(request):
-    genres = Genre.objects.all()
-    return {'all_genres':genres}
\ No newline at end of file
+    # Lazy: only pages that render the genre menu look the list up (and then from the cache)
+    return {'all_genres':SimpleLazyObject(cached_genres)}
@@ -161,8 +161,193 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 CELERY_BROKER_URL = 'redis://localhost:6380/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6380/0'
 
+# Shared cache (web + Celery workers), e.g. conversion progress
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6380/1',
+    }
+}
 
+# In-process cache in front of it for values read on almost every request (the genre menu).
+# Invalidations from other processes are seen after at most LOCAL_CACHE_TTL seconds.
+LOCAL_CACHE_TTL = 30
+
+# Anonymous catalog pages (home, movies, genres) are cached whole for PAGE_CACHE_TIMEOUT seconds;
+# Movie/Genre changes invalidate them immediately. While one request rebuilds a cold page, others
+# wait up to CACHE_BUILD_LOCK_TIMEOUT seconds for it instead of rebuilding it too.
+PAGE_CACHE_TIMEOUT = 60 * 15
+CACHE_BUILD_LOCK_TIMEOUT = 10
+
+
+# FFmpeg binaries used by the HLS conversion tasks
+FFMPEG_PATH = config('FFMPEG_PATH', default=r"C:\ffmpeg\bin\ffmpeg.exe")
+FFPROBE_PATH = config('FFPROBE_PATH', default=r"C:\ffmpeg\bin\ffprobe.exe")
+
+# Resumable movie uploads (streaming/uploads.py)
+MOVIE_UPLOAD_MAX_SIZE = 50 * 1024 ** 3      # 50 GB
+MOVIE_UPLOAD_CHUNK_SIZE = 8 * 1024 ** 2     # largest chunk a single PATCH may carry
+
+# Streaming ingest: fast-start sources (MP4 with moov first, MKV) start converting once
+# STREAM_INGEST_MIN_BYTES arrived, with FFmpeg following the growing file up to the upload
+# size. If no new data arrives for STREAM_INGEST_READ_TIMEOUT seconds the ingest is dropped
+# and the movie is converted normally after the upload completes.
+MOVIE_UPLOAD_STREAM_INGEST = True
+STREAM_INGEST_MIN_BYTES = 16 * 1024 ** 2
+STREAM_INGEST_READ_TIMEOUT = 60
+
+# HLS output
+# Adaptive bitrate ladder, highest quality first. Every rung becomes one variant
+# playlist (movies/hls/<id>/<name>/index.m3u8) listed in movies/hls/<id>/master.m3u8.
+HLS_SEGMENT_SECONDS = 6
+# Default segment packaging: 'mpegts' (.ts) or 'fmp4' (CMAF: init.mp4 + .m4s, less
+# container overhead and reusable for DASH). Movies can override it when uploaded.
+HLS_SEGMENT_TYPE = config('HLS_SEGMENT_TYPE', default='mpegts')
+HLS_RENDITIONS = [
+    {'name': '1080p', 'height': 1080, 'video_bitrate': '5000k', 'maxrate': '5350k', 'bufsize': '7500k', 'audio_bitrate': '192k'},
+    {'name': '720p', 'height': 720, 'video_bitrate': '2800k', 'maxrate': '2996k', 'bufsize': '4200k', 'audio_bitrate': '128k'},
+    {'name': '480p', 'height': 480, 'video_bitrate': '1400k', 'maxrate': '1498k', 'bufsize': '2100k', 'audio_bitrate': '128k'},
+    {'name': '360p', 'height': 360, 'video_bitrate': '800k', 'maxrate': '856k', 'bufsize': '1200k', 'audio_bitrate': '96k'},
+]
 
+# Sources that are already H.264 (+ AAC) are remuxed into HLS with "-c copy" instead of
+# being re-encoded, provided their keyframes are at most this many seconds apart.
+HLS_PASSTHROUGH = True
+HLS_PASSTHROUGH_MAX_KEYFRAME_INTERVAL = 10
+
+# Playlists are written as EVENT playlists while FFmpeg runs, so a movie becomes
+# watchable ("partially_ready") once every variant has HLS_PUBLISH_MIN_SEGMENTS segments.
+# The playlists are finalized to VOD when the conversion is done.
+HLS_PUBLISH_MIN_SEGMENTS = 3
+
+# Serving (/hls/<id>/...): segments are cached as immutable, playlists only for
+# HLS_PLAYLIST_MAX_AGE seconds since they grow while a movie is partially ready.
+# HLS_SENDFILE_BACKEND hands the file transfer to the web server:
+#   'x-accel-redirect' (nginx, internal location HLS_SENDFILE_ROOT aliased to MEDIA_ROOT)
+#   'x-sendfile' (Apache mod_xsendfile / lighttpd)
+#   '' (Django streams the file, zero-copy where the WSGI server supports sendfile)
+HLS_PLAYLIST_MAX_AGE = 2
+HLS_SENDFILE_BACKEND = config('HLS_SENDFILE_BACKEND', default='')
+HLS_SENDFILE_ROOT = '/protected-media/'
+
+# Similar movies: number of neighbours kept per movie in the precomputed index
+# (MovieSimilarity). Rebuilt by Celery SIMILAR_MOVIES_REBUILD_DELAY seconds after a movie's
+# title, description or genres change (one rebuild for all changes in that window).
+SIMILAR_MOVIES_INDEX_SIZE = 20
+SIMILAR_MOVIES_REBUILD_DELAY = 60
+
+# Recommender (streaming/recommender.py): weight of each feature block in the similarity
+# score, description vocabulary size, rows per batch of the catalog-wide top-k and
+# size of the (SVD-reduced) movie embeddings.
+RECOMMENDER_WEIGHTS = {'title': 0.3, 'description': 0.3, 'genres': 0.4}
+RECOMMENDER_MAX_TERMS = 50000
+RECOMMENDER_BATCH_SIZE = 1000
+RECOMMENDER_EMBEDDING_DIM = 128
+
+# "Because you watched…" feeds (userspage/recommendations.py): item-item co-occurrence over
+# WatchHistory, Favorite and Watchlist (weighted per signal), USER_RECOMMENDATIONS_NEIGHBOURS
+# neighbours per movie, USER_RECOMMENDATIONS_SIZE movies stored per user. Rebuilt hourly by
+# Celery beat; pages read them from the cache.
+USER_RECOMMENDATION_WEIGHTS = {'watched': 1.0, 'favorite': 3.0, 'watchlist': 0.5}
+USER_RECOMMENDATIONS_NEIGHBOURS = 50
+USER_RECOMMENDATIONS_SIZE = 30
+USER_RECOMMENDATIONS_CACHE_TIMEOUT = 60 * 60
+
+# Search box typeahead (streaming/suggest.py): results per request, and how often (seconds)
+# each process checks whether movies changed and its in-memory title index must be rebuilt.
+SUGGEST_LIMIT = 8
+SUGGEST_INDEX_CHECK_INTERVAL = 5
+
+CELERY_BEAT_SCHEDULE = {
+    'rebuild-similar-movies': {
+        'task': 'streaming.tasks.rebuild_movie_similarities',
+        'schedule': 60 * 60 * 24,
+    },
+    'rebuild-user-recommendations': {
+        'task': 'userspage.tasks.rebuild_user_recommendations',
+        'schedule': 60 * 60,
+    },
+    'flush-watch-progress': {
+        'task': 'userspage.tasks.flush_watch_progress',
+        'schedule': 30,
+    },
+    'collect-orphaned-media': {
+        'task': 'streaming.tasks.collect_orphaned_media',
+        'schedule': 60 * 60 * 24,
+    },
+    'archive-watch-history': {
+        'task': 'userspage.tasks.archive_watch_history',
+        'schedule': 60 * 60 * 24,
+    },
+}
 
-
-
+# Playback tokens: the watch page signs the movie id + expiry (HMAC with SECRET_KEY),
+# /hls/ checks the ?token= on every playlist/segment request without a DB or session hit.
+# A token lives for the movie's runtime (plus the rest of the conversion while it is
+# partially ready) and PLAYBACK_TOKEN_TTL seconds on top for pauses and seeking.
+PLAYBACK_TOKEN_TTL = 60 * 60 * 6
+
+# Minimum seconds between two conversion progress updates (cache + Celery task state)
+HLS_PROGRESS_INTERVAL = 2
+
+# Parallel conversion: sources at least HLS_PARALLEL_MIN_SECONDS long are cut into
+# keyframe-aligned chunks of about HLS_CHUNK_SECONDS, encoded by separate Celery
+# workers and stitched back into one playlist per rendition. The workers share movies/work
+# under MEDIA_ROOT, so this only applies with HLS_STORAGE_BACKEND = 'local'.
+HLS_PARALLEL_MIN_SECONDS = 600
+HLS_CHUNK_SECONDS = 120
+
+# Resume positions: the player reports its position every WATCH_PROGRESS_HEARTBEAT_INTERVAL
+# seconds; reports are coalesced per user+movie in a Redis hash (WATCH_PROGRESS_REDIS_URL,
+# None = per-process buffer) and upserted into WatchProgress every WATCH_PROGRESS_FLUSH_INTERVAL
+# seconds (the 'flush-watch-progress' beat entry). Playback resumes unless the position is
+# within WATCH_PROGRESS_RESUME_MARGIN seconds of the start or the end.
+WATCH_PROGRESS_REDIS_URL = 'redis://localhost:6380/1'
+WATCH_PROGRESS_HEARTBEAT_INTERVAL = 10
+WATCH_PROGRESS_FLUSH_INTERVAL = 30
+WATCH_PROGRESS_BATCH_SIZE = 1000
+WATCH_PROGRESS_RESUME_MARGIN = 30
+
+# Per-user library row (UserLibrary) behind the profile, watchlist and "Continue watching":
+# the USER_LIBRARY_RECENT_SIZE most recently watched movies, up to USER_LIBRARY_SIZE favorites
+# and plan-to-watch movies. Rebuilt on every history/favorite/watchlist write, cached per user.
+USER_LIBRARY_RECENT_SIZE = 20
+USER_LIBRARY_SIZE = 50
+USER_LIBRARY_CACHE_TIMEOUT = 60 * 60
+
+# Watch history keeps one row per user and movie; rows not replayed for
+# WATCH_HISTORY_RETENTION_DAYS are moved to WatchHistoryArchive nightly, in batches of
+# WATCH_HISTORY_ARCHIVE_BATCH_SIZE rows per transaction.
+WATCH_HISTORY_RETENTION_DAYS = 365
+WATCH_HISTORY_ARCHIVE_BATCH_SIZE = 1000
+
+# Deleting a movie only hides it (status 'deleting'); Celery deletes its files
+# MEDIA_CLEANUP_BATCH_SIZE at a time, retrying up to MEDIA_CLEANUP_MAX_RETRIES times on errors,
+# then the row.
+MEDIA_CLEANUP_BATCH_SIZE = 500
+MEDIA_CLEANUP_MAX_RETRIES = 5
+
+# Media garbage collection (streaming/media_gc.py, nightly and `manage.py collect_media_garbage`):
+# files/folders under MEDIA_ROOT that no row refers to are removed once untouched for
+# MEDIA_GC_GRACE_SECONDS; rows are looked up MEDIA_GC_CHUNK_SIZE names per query. Uploads that
+# never became a movie and got no chunk for as long are deleted first, then their files collected.
+MEDIA_GC_GRACE_SECONDS = 60 * 60 * 24
+MEDIA_GC_CHUNK_SIZE = 1000
+
+# HLS storage (streaming/storage.py): 'local' keeps the output in MEDIA_ROOT/movies/hls;
+# 's3' stores it in an S3-compatible bucket (AWS, MinIO: set HLS_S3_ENDPOINT_URL) under
+# HLS_S3_PREFIX/<id>/, uploading segments on HLS_UPLOAD_WORKERS threads while FFmpeg runs
+# (multipart above HLS_S3_MULTIPART_THRESHOLD bytes), so workers only keep the segments in
+# flight on disk. Segments are served as redirects to presigned URLs valid HLS_S3_URL_EXPIRY seconds.
+HLS_STORAGE_BACKEND = config('HLS_STORAGE_BACKEND', default='local')
+HLS_S3_BUCKET = config('HLS_S3_BUCKET', default='watchdoge-hls')
+HLS_S3_ENDPOINT_URL = config('HLS_S3_ENDPOINT_URL', default='')
+HLS_S3_REGION = config('HLS_S3_REGION', default='')
+HLS_S3_ACCESS_KEY = config('HLS_S3_ACCESS_KEY', default='')
+HLS_S3_SECRET_KEY = config('HLS_S3_SECRET_KEY', default='')
+HLS_S3_PREFIX = 'hls'
+HLS_S3_URL_EXPIRY = 300
+HLS_S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+HLS_S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+HLS_S3_MULTIPART_CONCURRENCY = 4
+HLS_UPLOAD_WORKERS = 4
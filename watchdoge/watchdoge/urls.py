@@ -18,13 +18,15 @@ from django.contrib import admin
 from django.urls import path,include
 from django.conf import settings
 from django.conf.urls.static import static
+from streaming.views import serve_hls
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('movie-admin/',include('streaming.urls')),
     path('',include('userspage.urls')),
-    path('account/',include('accounts.urls'))
+    path('account/',include('accounts.urls')),
+    path('hls/<int:movieId>/<path:filename>', serve_hls, name='hls-file'),
 ]
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)